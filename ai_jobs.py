@@ -0,0 +1,195 @@
+import collections
+import threading
+import time
+import uuid
+
+# Background queue for Gemini requests.
+#
+# The UI submits a job and returns straight away; a small worker pool runs the
+# jobs off the Streamlit script thread. Every API key has its own token
+# bucket (requests per minute with a burst allowance) and a cap on requests in
+# flight, so a burst of @gemini mentions on the shared system key is smoothed
+# out instead of getting throttled by the API. A job whose key is at its limit
+# waits in the queue without holding back jobs for other keys. The queue is
+# bounded: once it is full, submit raises QueueFull and the caller tells the
+# user to try again. A running job pays for every request beyond its first
+# (retries, hedges, failover to another key; see gemini_utils.KeySlots)
+# through acquire/release, so that traffic stays inside the keys' limits too.
+
+AI_WORKERS = 4
+AI_QUEUE_MAX = 50  # queued (not yet running) jobs across all keys
+KEY_MAX_CONCURRENCY = 2  # requests in flight per API key
+KEY_RATE_PER_MINUTE = 30
+KEY_BURST = 5
+IDLE_WAIT = 0.5  # seconds a worker sleeps when nothing is runnable
+_PRIVATE_FIELDS = ('api_key', 'fallback_key')
+
+
+class QueueFull(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute=KEY_RATE_PER_MINUTE, burst=KEY_BURST, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.clock = clock
+        self.updated_at = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self):
+        # Takes a token if one is available; otherwise returns the seconds
+        # until the next one (0 means acquired)
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AIJobQueue:
+    def __init__(self, run, workers=AI_WORKERS, max_queued=AI_QUEUE_MAX,
+                 max_per_key=KEY_MAX_CONCURRENCY, rate_per_minute=KEY_RATE_PER_MINUTE,
+                 burst=KEY_BURST, start=True):
+        # run(job) does the work for one job dict; exceptions are recorded on
+        # the job and never stop the worker
+        self.run = run
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_per_key = max_per_key
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self._queue = collections.deque()
+        self._running = {}  # job id -> job
+        self._in_flight = collections.Counter()  # api key -> running jobs
+        self._buckets = {}  # api key -> TokenBucket
+        self._cond = threading.Condition()
+        self._stop = False
+        self._threads = []
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        if start:
+            self.start()
+
+    def start(self):
+        with self._cond:
+            self._stop = False
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                t = threading.Thread(target=self._work, name=f"ai-worker-{i}", daemon=True)
+                self._threads.append(t)
+                t.start()
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+
+    def submit(self, chat_id, api_key, **payload):
+        """Queues a job and returns it; raises QueueFull when the queue is at capacity."""
+        job = dict(payload, id=uuid.uuid4().hex, chat_id=chat_id, api_key=api_key,
+                   submitted_at=time.time(), state='queued')
+        with self._cond:
+            if len(self._queue) >= self.max_queued:
+                self.rejected += 1
+                raise QueueFull(f"{len(self._queue)} AI requests are already waiting")
+            self._queue.append(job)
+            self._cond.notify()
+        return job
+
+    def pending(self, chat_id=None):
+        # Queued and running jobs, oldest first, without any API keys
+        with self._cond:
+            jobs = list(self._running.values()) + list(self._queue)
+        jobs = [j for j in jobs if chat_id is None or j['chat_id'] == chat_id]
+        jobs.sort(key=lambda j: j['submitted_at'])
+        return [{k: v for k, v in j.items() if k not in _PRIVATE_FIELDS} for j in jobs]
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'running': len(self._running),
+                'keys_in_flight': len(+self._in_flight),
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+            }
+
+    # --- Slots for a running job's extra requests ---
+    def acquire(self, api_key, slot=True):
+        """Takes a token for api_key, and a slot unless slot=False, if they are free right now."""
+        with self._cond:
+            if slot and self._in_flight[api_key] >= self.max_per_key:
+                return False
+            if self._bucket(api_key).try_acquire():
+                return False
+            if slot:
+                self._in_flight[api_key] += 1
+            return True
+
+    def release(self, api_key):
+        with self._cond:
+            self._in_flight[api_key] -= 1
+            self._cond.notify_all()
+
+    # --- Workers ---
+    def _bucket(self, api_key):
+        bucket = self._buckets.get(api_key)
+        if bucket is None:
+            bucket = self._buckets[api_key] = TokenBucket(self.rate_per_minute, self.burst)
+        return bucket
+
+    def _next_job(self):
+        # First queued job whose key has a free slot and a token; otherwise
+        # None and how long until a rate-limited key can go again
+        wait = IDLE_WAIT
+        for job in self._queue:
+            key = job['api_key']
+            if self._in_flight[key] >= self.max_per_key:
+                continue
+            delay = self._bucket(key).try_acquire()
+            if delay:
+                wait = min(wait, delay)
+                continue
+            self._queue.remove(job)
+            return job, 0
+        return None, wait
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job, wait = self._next_job()
+                while job is None:
+                    if self._stop:
+                        return
+                    self._cond.wait(wait)
+                    job, wait = self._next_job()
+                job['state'] = 'running'
+                self._running[job['id']] = job
+                self._in_flight[job['api_key']] += 1
+
+            try:
+                self.run(job)
+                ok = True
+            except Exception as e:
+                job['error'] = str(e)
+                ok = False
+
+            with self._cond:
+                self._running.pop(job['id'], None)
+                self._in_flight[job['api_key']] -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                # A key slot just opened up
+                self._cond.notify_all()
@@ -2,15 +2,28 @@ import streamlit as st
 # from database import init_db, get_db_connection # Removed for Firebase
 from auth import login_user, create_user
 import ui_components as ui
-from firebase_db import check_db_connection
+from storage import get_backend
 
 # Initialize Database
 # init_db() # No longer needed for Firebase
 
 st.set_page_config(page_title="Gemini Group Chat", layout="wide")
 
+# Firestore metrics are grouped per rerun, labelled with the screen shown
+if st.session_state.get('user') is None:
+    ui.start_metrics_rerun("app:login")
+else:
+    active = st.session_state.get('active_chat_id')
+    ui.start_metrics_rerun("app:admin" if active == "ADMIN" else "app:chat" if active else "app:home")
+
+# The chat UI is built on Firestore's realtime listener and the outbox, so it
+# needs the Firestore backend; the SQLite backend serves scripts and tests
+if get_backend().name != "firestore":
+    st.error("❌ The chat app needs STORAGE_BACKEND=firestore; the SQLite backend only serves the scripts and tests.")
+    st.stop()
+
 # Check Firebase Connection
-db_connected, db_error = check_db_connection()
+db_connected, db_error = get_backend().check_connection()
 if not db_connected:
     st.error(f"❌ Database Error: {db_error}")
     st.info("👉 **Action Required**: Go to the [Firebase Console](https://console.firebase.google.com/), select your project, and create a **Firestore Database** (in Native mode).")
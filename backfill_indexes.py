@@ -0,0 +1,25 @@
+from firebase_db import backfill_chat_members, backfill_important_index, backfill_chat_summaries, backfill_search_index
+
+def backfill():
+    # Chat listings query the 'members' and summary fields, the Important
+    # Questions panel reads the important_messages index and search reads a
+    # local full-text index; data written before these existed needs them
+    # filled in once.
+    print("Backfilling chat members...")
+    updated = backfill_chat_members()
+    print(f"✅ Updated {updated} chat(s).")
+
+    print("Computing chat summaries...")
+    summarized = backfill_chat_summaries()
+    print(f"✅ Summarized {summarized} chat(s).")
+
+    print("Indexing important messages...")
+    indexed = backfill_important_index()
+    print(f"✅ Indexed {indexed} message(s).")
+
+    print("Building the local search index...")
+    searchable = backfill_search_index()
+    print(f"✅ Indexed {searchable} message(s) for search.")
+
+if __name__ == "__main__":
+    backfill()
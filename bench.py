@@ -0,0 +1,306 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+# Offline benchmark for the Firestore-backed app paths.
+#
+# firebase_db.db is swapped for an in-memory fake (firestore_fake.py) with a
+# configurable per-RPC latency, and gemini_utils.model_registry for a stub
+# that streams a canned answer, so the scenarios below run without network
+# access or credentials. Each scenario reports wall time plus the Firestore
+# reads and writes it cost, and is compared against bench_baseline.json:
+# more reads or writes than the baseline, or a wall time beyond the
+# tolerance, is reported as a regression and makes the script exit 1.
+#
+#   python bench.py                     # run and compare
+#   python bench.py --update-baseline   # accept the current numbers
+#
+# Scenarios run in order on one seeded dataset, like a single server
+# process: caches warmed by one scenario stay warm for the next. The whole
+# suite is repeated on a fresh dataset and the median wall time is kept, since
+# the AI and outbox paths involve threads and are noisier than the counts.
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+DEFAULT_LATENCY = 0.005  # seconds per Firestore round trip
+WALL_TOLERANCE = 0.25  # fraction over the baseline wall time allowed
+WALL_SLACK_MS = 5  # absolute slack, so tiny scenarios don't flap
+SEED_USERS = 40
+SEED_SHARED_CHATS = 20
+SEED_PRIVATE_CHATS = 2  # per user
+SEED_MESSAGES = 300  # in the chat that is opened; others get a few
+POLL_TICKS = 30
+DEFAULT_REPEAT = 3  # runs per invocation; the median wall time is reported
+STUB_ANSWER = "Here is a short answer from the stub model. " * 8
+
+# Keep the local SQLite files (search index, caches, outbox) out of the repo,
+# and import firebase_db without connecting to a real project
+ORIGINAL_CWD = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix="bench-"))
+os.environ["FIREBASE_DB_OFFLINE"] = "1"
+
+import firebase_db  # noqa: E402
+import gemini_utils  # noqa: E402
+from firestore_fake import FakeFirestore  # noqa: E402
+
+
+class StubChat:
+    def __init__(self, answer):
+        self.answer = answer
+
+    def send_message(self, prompt, stream=False, request_options=None):
+        if not stream:
+            return SimpleNamespace(text=self.answer)
+        words = self.answer.split(" ")
+        return (SimpleNamespace(text=w + " ") for w in words)
+
+
+class StubModel:
+    def __init__(self, answer):
+        self.answer = answer
+
+    def start_chat(self, history=None):
+        return StubChat(self.answer)
+
+    def generate_content(self, prompt, request_options=None):
+        return SimpleNamespace(text="Summary from the stub model.")
+
+
+class StubModelRegistry:
+    # Same get_model() as GeminiModelRegistry, without any network client
+    def __init__(self, answer=STUB_ANSWER):
+        self.model = StubModel(answer)
+
+    def get_model(self, api_key, model_name=gemini_utils.DEFAULT_MODEL):
+        return self.model
+
+
+def seed(client, rng):
+    # Deterministic dataset, written straight into the fake (not counted)
+    from auth import make_hash
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    users = []
+    for i in range(SEED_USERS):
+        ref = client.collection('users').document(f"user{i}")
+        ref.set({'username': f"user{i}", 'password_hash': make_hash("password"),
+                 'role': 'admin' if i == 0 else 'user', 'personal_api_key': 'stub-key',
+                 'created_at': start, 'unread_mentions': []})
+        users.append(ref.id)
+
+    chats = []
+    for i in range(SEED_SHARED_CHATS):
+        chats.append((f"shared{i}", users[i % len(users)], rng.choice(['Study', 'Fun']), []))
+    for u in users:
+        for j in range(SEED_PRIVATE_CHATS):
+            chats.append((f"private-{u}-{j}", u, 'Private', rng.sample(users, 2)))
+
+    batch, pending = client.batch(), 0
+    for n, (chat_id, owner, category, participants) in enumerate(chats):
+        count = SEED_MESSAGES if chat_id == "shared0" else rng.randint(3, 15)
+        last = None
+        for k in range(count):
+            sender = rng.choice(users)
+            last = start + datetime.timedelta(minutes=n * 1000 + k)
+            batch.set(client.collection('messages').document(f"{chat_id}-m{k}"), {
+                'chat_id': chat_id, 'sender_id': sender, 'sender_name': sender,
+                'content': f"message {k} in {chat_id} " + " ".join(rng.choice(["exam", "notes", "lunch", "gemini", "help"]) for _ in range(6)),
+                'timestamp': last, 'is_ai': False, 'is_important': k % 50 == 0})
+            pending += 1
+            if pending >= 400:
+                batch.commit()
+                batch, pending = client.batch(), 0
+        batch.set(client.collection('chats').document(chat_id), {
+            'user_id': owner, 'category': category, 'title': f"Chat {chat_id}",
+            'created_at': start, 'participants': participants,
+            'members': sorted({owner, *participants}),
+            'last_message': {'sender_name': owner, 'content': "…", 'is_ai': False},
+            'last_activity_at': last, 'message_count': count, 'important_count': 0})
+        pending += 1
+    batch.commit()
+    return users
+
+
+# --- Scenarios ---
+# Each takes the shared context dict and returns nothing; they run in order.
+
+def scenario_login(ctx):
+    from auth import login_user
+    for i in range(5):
+        assert login_user(f"user{i}", "password") is not None
+
+
+def scenario_sidebar(ctx):
+    for user_id in ctx['users'][:5]:
+        data = firebase_db.get_sidebar_data(user_id)
+        assert data['chats']['Study'] or data['chats']['Fun']
+
+
+def scenario_chat_open(ctx):
+    chat = firebase_db.get_chat_details(ctx['chat_id'])
+    page, _ = firebase_db.get_messages_page_firestore(ctx['chat_id'])
+    firebase_db.get_chat_members(chat)
+    assert page
+
+
+def scenario_poll_ticks(ctx):
+    # Every session viewing the chat reads from one shared listener
+    manager = ctx['manager']
+    for tick in range(POLL_TICKS):
+        for session in range(3):
+            messages, _ = manager.get_messages(ctx['chat_id'], f"session{session}")
+        assert messages
+
+
+def scenario_poll_ticks_fallback(ctx):
+    # Delta polling through the message cache, used when the listener is down
+    for tick in range(POLL_TICKS):
+        assert firebase_db.get_messages_firestore("shared1")
+
+
+def scenario_send_with_mentions(ctx):
+    outbox = ctx['outbox']
+    for i in range(10):
+        outbox.enqueue(ctx['chat_id'], "user1", "user1", f"question {i} for @user2 and @user3 and @nobody")
+        while outbox.flush_due():
+            pass
+
+
+def scenario_ai_reply(ctx):
+    from ui_components import run_ai_job
+    for i in range(3):
+        question = ctx['outbox'].enqueue(ctx['chat_id'], "user1", "user1", f"@Gemini explain topic {i}")
+        job = {'id': f"ai-job-{i}", 'chat_id': ctx['chat_id'], 'prompt': f"explain topic {i}",
+               'api_key': 'stub-key', 'fallback_key': None, 'question_id': question['id'],
+               'use_cache': True}
+        run_ai_job(job, ctx['outbox'], ctx['response_cache'])
+
+
+def scenario_admin_delete(ctx):
+    for chat_id in ("shared0", "shared1", "shared2"):
+        firebase_db.delete_chat_firestore(chat_id)
+
+
+SCENARIOS = [
+    ("login", scenario_login),
+    ("sidebar", scenario_sidebar),
+    ("chat_open", scenario_chat_open),
+    ("poll_ticks", scenario_poll_ticks),
+    ("poll_ticks_fallback", scenario_poll_ticks_fallback),
+    ("send_with_mentions", scenario_send_with_mentions),
+    ("ai_reply", scenario_ai_reply),
+    ("admin_delete", scenario_admin_delete),
+]
+
+
+def run(latency):
+    from outbox import Outbox
+    from realtime import ChatSubscriptionManager
+    from response_cache import ResponseCache
+
+    client = FakeFirestore()
+    firebase_db.set_db(client)
+    gemini_utils.model_registry = StubModelRegistry()
+    users = seed(client, random.Random(0))
+
+    outbox = Outbox(firebase_db.save_messages_firestore, db_name="bench_outbox.db", start=False)
+    ctx = {
+        'users': users,
+        'chat_id': "shared0",
+        'outbox': outbox,
+        'manager': ChatSubscriptionManager(client, cache=firebase_db.message_cache),
+        'response_cache': ResponseCache(db_name=None),
+    }
+    # The AI job waits for the question to be flushed; nothing else drains
+    # the outbox here, so flush on demand instead of running its worker
+    outbox.wait_for_message = lambda msg_id, timeout=10: (outbox.flush_due(), 'sent')[1]
+
+    client.latency = latency
+    results = {}
+    for name, scenario in SCENARIOS:
+        client.reset_stats()
+        started = time.perf_counter()
+        scenario(ctx)
+        wall_ms = (time.perf_counter() - started) * 1000
+        stats = client.stats()
+        results[name] = {'wall_ms': round(wall_ms, 1), 'reads': stats['reads'],
+                         'writes': stats['writes'], 'round_trips': stats['round_trips']}
+    ctx['manager'].close()
+    return results
+
+
+def compare(results, baseline, check_wall=True):
+    # [(scenario, message)] for every metric that got worse
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ('reads', 'writes'):
+            if current[metric] > base[metric]:
+                regressions.append((name, f"{metric} {base[metric]} -> {current[metric]}"))
+        if not check_wall:
+            continue
+        limit = base['wall_ms'] * (1 + WALL_TOLERANCE) + WALL_SLACK_MS
+        if current['wall_ms'] > limit:
+            regressions.append((name, f"wall {base['wall_ms']:.1f}ms -> {current['wall_ms']:.1f}ms"))
+    return regressions
+
+
+def format_report(results, baseline, latency):
+    lines = [f"Firestore latency: {latency * 1000:.1f}ms per round trip",
+             f"{'scenario':<22}{'wall ms':>10}{'reads':>8}{'writes':>8}{'rpcs':>7}  vs baseline"]
+    for name, r in results.items():
+        base = baseline.get(name)
+        delta = ""
+        if base:
+            delta = (f"{r['wall_ms'] - base['wall_ms']:+.1f}ms "
+                     f"{r['reads'] - base['reads']:+d}r {r['writes'] - base['writes']:+d}w")
+        lines.append(f"{name:<22}{r['wall_ms']:>10.1f}{r['reads']:>8}{r['writes']:>8}{r['round_trips']:>7}  {delta}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Firestore-backed app paths")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="seconds per Firestore round trip")
+    parser.add_argument("--update-baseline", action="store_true", help=f"write the results to {os.path.basename(BASELINE_PATH)}")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs to take the median wall time over")
+    parser.add_argument("--out", help="also write the report to this file")
+    args = parser.parse_args()
+
+    baseline, check_wall = {}, False
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            saved = json.load(f)
+        baseline = saved['scenarios']
+        # Wall times are only comparable at the same latency; reads and writes always are
+        check_wall = saved.get('latency') == args.latency
+
+    runs = [run(args.latency) for _ in range(max(1, args.repeat))]
+    results = {name: dict(r, wall_ms=statistics.median(run_[name]['wall_ms'] for run_ in runs))
+               for name, r in runs[-1].items()}
+    report = format_report(results, baseline, args.latency)
+    regressions = compare(results, baseline, check_wall)
+    if regressions:
+        report += "\n\nRegressions:\n" + "\n".join(f"  {name}: {msg}" for name, msg in regressions)
+    print(report)
+    if args.out:
+        with open(os.path.join(ORIGINAL_CWD, args.out), "w") as f:
+            f.write(report + "\n")
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({'latency': args.latency, 'scenarios': results}, f, indent=2)
+            f.write("\n")
+        print(f"\nBaseline written to {BASELINE_PATH}")
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
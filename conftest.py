@@ -0,0 +1,46 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+# Import firebase_db without connecting to a real project
+os.environ.setdefault("FIREBASE_DB_OFFLINE", "1")
+
+import firebase_db  # noqa: E402
+import gemini_utils  # noqa: E402
+from firestore_fake import FakeFirestore  # noqa: E402
+from outbox import Outbox  # noqa: E402
+
+
+class CountingModel:
+    def __init__(self):
+        self.streams = 0
+
+    def start_chat(self, history=None):
+        return self
+
+    def send_message(self, prompt, stream=False, request_options=None):
+        self.streams += 1
+        return iter([SimpleNamespace(text="A monad is a monoid in the category of endofunctors.")])
+
+
+class StubRegistry:
+    def __init__(self, model):
+        self.model = model
+
+    def get_model(self, api_key, model_name=gemini_utils.DEFAULT_MODEL):
+        return self.model
+
+
+@pytest.fixture
+def chat(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = FakeFirestore()
+    firebase_db.set_db(client)
+    client.collection('chats').document("chat1").set({
+        'user_id': "u1", 'category': 'Study', 'title': "FAQ", 'participants': [], 'members': ["u1"],
+        'message_count': 0, 'important_count': 0})
+    model = CountingModel()
+    monkeypatch.setattr(gemini_utils, 'model_registry', StubRegistry(model))
+    outbox = Outbox(firebase_db.save_messages_firestore, db_name=str(tmp_path / "outbox.db"), start=False)
+    return SimpleNamespace(client=client, model=model, outbox=outbox)
@@ -1,6 +1,5 @@
-import sqlite3
-from auth import create_user, make_hash
-from database import get_db_connection
+from auth import create_user
+from storage import get_backend
 
 def create_admin():
     username = "admin"
@@ -12,12 +11,9 @@ def create_admin():
     else:
         print(f"User '{username}' already exists.")
         
-    # Force update role to admin
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("UPDATE users SET role = 'admin' WHERE username = ?", (username,))
-    conn.commit()
-    conn.close()
+    # Force update role to admin (in whichever backend STORAGE_BACKEND selects)
+    backend = get_backend()
+    backend.make_user_admin(backend.get_user_by_username(username)['id'])
     print(f"User '{username}' is now an ADMIN.")
 
 if __name__ == "__main__":
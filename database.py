@@ -4,6 +4,10 @@ import hashlib
 import os
 
 DB_NAME = "chat_app.db"
+OUTBOX_DB_NAME = "outbox.db"
+RESPONSE_CACHE_DB_NAME = "response_cache.db"
+STORAGE_DB_NAME = "local_store.db"
+SEARCH_DB_NAME = "search_index.db"
 
 def init_db():
     """Initializes the SQLite database with necessary tables."""
@@ -63,7 +67,177 @@ def init_db():
     conn.commit()
     conn.close()
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+def init_outbox_db(db_name=OUTBOX_DB_NAME):
+    """Initializes the local outbox that queues messages for Firestore."""
+    conn = sqlite3.connect(db_name)
+    # WAL lets the UI append while the flush worker reads
+    conn.execute("PRAGMA journal_mode=WAL")
+    c = conn.cursor()
+
+    # sender_id has no declared type so user ids (text) and the AI's 0 keep their type
+    c.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    msg_id TEXT UNIQUE NOT NULL,
+                    chat_id TEXT NOT NULL,
+                    sender_id,
+                    sender_name TEXT,
+                    content TEXT,
+                    is_ai BOOLEAN DEFAULT 0,
+                    is_important BOOLEAN DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at REAL DEFAULT 0,
+                    last_error TEXT,
+                    claimed_by TEXT,
+                    claimed_at REAL
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_chat ON outbox(chat_id, seq)")
+    # Outbox files created before rows were claimed lack the claim columns
+    columns = {row[1] for row in c.execute("PRAGMA table_info(outbox)")}
+    for column, declaration in (('claimed_by', 'TEXT'), ('claimed_at', 'REAL')):
+        if column not in columns:
+            c.execute(f"ALTER TABLE outbox ADD COLUMN {column} {declaration}")
+
+    # Dead letters: messages that kept failing, kept until they are retried
+    c.execute('''CREATE TABLE IF NOT EXISTS outbox_failed (
+                    seq INTEGER PRIMARY KEY,
+                    msg_id TEXT UNIQUE NOT NULL,
+                    chat_id TEXT NOT NULL,
+                    sender_id,
+                    sender_name TEXT,
+                    content TEXT,
+                    is_ai BOOLEAN DEFAULT 0,
+                    is_important BOOLEAN DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    attempts INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    failed_at REAL NOT NULL
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_failed_chat ON outbox_failed(chat_id, seq)")
+
+    conn.commit()
+    conn.close()
+
+def init_response_cache_db(db_name=RESPONSE_CACHE_DB_NAME):
+    """Initializes the on-disk tier of the Gemini response cache."""
+    conn = sqlite3.connect(db_name)
+    conn.execute("PRAGMA journal_mode=WAL")
+    c = conn.cursor()
+
+    c.execute('''CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_used ON response_cache(last_used_at)")
+
+    conn.commit()
+    conn.close()
+
+def init_storage_db(db_name=STORAGE_DB_NAME):
+    """Initializes the schema of the SQLite storage backend (see sqlite_backend.py)."""
+    conn = sqlite3.connect(db_name)
+    # WAL: readers never block the writer and vice versa
+    conn.execute("PRAGMA journal_mode=WAL")
+    c = conn.cursor()
+
+    # Ids are text (uuid hex), like Firestore document ids
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+                    id TEXT PRIMARY KEY,
+                    username TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    role TEXT DEFAULT 'user',
+                    personal_api_key TEXT DEFAULT '',
+                    created_at TEXT NOT NULL
+                )''')
+
+    # Summary columns mirror the Firestore chat document; last_message and
+    # context_summary hold JSON
+    c.execute('''CREATE TABLE IF NOT EXISTS chats (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    category TEXT DEFAULT 'Private',
+                    title TEXT,
+                    created_at TEXT NOT NULL,
+                    last_message TEXT,
+                    last_activity_at TEXT NOT NULL,
+                    message_count INTEGER DEFAULT 0,
+                    important_count INTEGER DEFAULT 0,
+                    context_summary TEXT
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chats_category_activity ON chats(category, last_activity_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chats_user ON chats(user_id)")
+
+    # Creator and participants of each chat (Firestore's 'members' array)
+    c.execute('''CREATE TABLE IF NOT EXISTS chat_members (
+                    chat_id TEXT NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+                    user_id TEXT NOT NULL,
+                    is_participant BOOLEAN DEFAULT 0,
+                    added_at TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, user_id)
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_members_user ON chat_members(user_id)")
+
+    # sender_id has no declared type so user ids (text) and the AI's 0 keep their type
+    c.execute('''CREATE TABLE IF NOT EXISTS messages (
+                    id TEXT PRIMARY KEY,
+                    chat_id TEXT NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+                    sender_id,
+                    sender_name TEXT,
+                    content TEXT,
+                    is_ai BOOLEAN DEFAULT 0,
+                    is_important BOOLEAN DEFAULT 0,
+                    timestamp TEXT NOT NULL
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_timestamp ON messages(chat_id, timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_important ON messages(is_important, timestamp)")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS unread_mentions (
+                    user_id TEXT NOT NULL,
+                    chat_id TEXT NOT NULL,
+                    PRIMARY KEY (user_id, chat_id)
+                )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )''')
+
+    conn.commit()
+    conn.close()
+
+def init_search_db(db_name=SEARCH_DB_NAME):
+    """Initializes the full-text message index (see search_index.py)."""
+    conn = sqlite3.connect(db_name)
+    conn.execute("PRAGMA journal_mode=WAL")
+    c = conn.cursor()
+
+    # FTS5 inverted index over message text; the other columns are stored for
+    # filtering and display only
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+                    content,
+                    sender_name,
+                    msg_id UNINDEXED,
+                    chat_id UNINDEXED,
+                    timestamp UNINDEXED,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )''')
+    # Default ranking: BM25 with content matches weighted over sender names.
+    # Ordering by the built-in rank column lets FTS5 use its top-k path.
+    c.execute("INSERT INTO message_fts (message_fts, rank) VALUES ('rank', 'bm25(1.0, 0.3)')")
+    # msg_id -> FTS rowid, so re-indexing an edited message replaces its row
+    c.execute('''CREATE TABLE IF NOT EXISTS message_fts_ids (
+                    msg_id TEXT PRIMARY KEY,
+                    fts_rowid INTEGER NOT NULL,
+                    chat_id TEXT NOT NULL
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_message_fts_ids_chat ON message_fts_ids(chat_id)")
+
+    conn.commit()
+    conn.close()
+
+def get_db_connection(db_name=DB_NAME):
+    conn = sqlite3.connect(db_name)
     conn.row_factory = sqlite3.Row
     return conn
@@ -3,29 +3,64 @@ from firebase_admin import credentials
 from google.cloud import firestore
 from google.oauth2 import service_account
 import streamlit as st
+import contextvars
 import datetime
+import inspect
 from google.api_core import exceptions
 import json
+import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from firestore_metrics import instrument, track
+from message_cache import MessageCache
+from search_index import SearchIndex, SEARCH_RESULT_LIMIT
+from storage import SHARED_CATEGORIES, MENTION_PATTERN, LAST_MESSAGE_PREVIEW_CHARS
+from user_directory import UserDirectory
 
-# Load credentials - try Streamlit secrets first, then local file
-try:
-    # Try to load from Streamlit secrets (for deployment)
-    firebase_secrets = st.secrets["firebase"]
-    cred = service_account.Credentials.from_service_account_info(dict(firebase_secrets))
-    project_id = firebase_secrets["project_id"]
-except (FileNotFoundError, KeyError):
-    # Fallback to local firebase_key.json file (for local development)
-    with open("firebase_key.json", "r") as f:
-        key_data = json.load(f)
-        project_id = key_data.get("project_id")
-    cred = service_account.Credentials.from_service_account_file("firebase_key.json")
-
-db = firestore.Client(credentials=cred, project=project_id, database='grpapp')
+logger = logging.getLogger(__name__)
+
+def connect():
+    # Load credentials - try Streamlit secrets first, then local file
+    try:
+        # Try to load from Streamlit secrets (for deployment)
+        firebase_secrets = st.secrets["firebase"]
+        cred = service_account.Credentials.from_service_account_info(dict(firebase_secrets))
+        project_id = firebase_secrets["project_id"]
+    except (FileNotFoundError, KeyError):
+        # Fallback to local firebase_key.json file (for local development)
+        with open("firebase_key.json", "r") as f:
+            key_data = json.load(f)
+            project_id = key_data.get("project_id")
+        cred = service_account.Credentials.from_service_account_file("firebase_key.json")
+    return firestore.Client(credentials=cred, project=project_id, database='grpapp')
+
+# FIREBASE_DB_OFFLINE skips connecting, for harnesses that call set_db() with
+# their own client (see bench.py). The client is wrapped so every operation
+# is recorded in firestore_metrics.
+db = None if os.environ.get("FIREBASE_DB_OFFLINE") else instrument(connect())
+
+# Shared by all sessions in this process; see message_cache.py
+message_cache = MessageCache()
+search_index = SearchIndex()
 
 def get_db():
     return db
 
+def set_db(client):
+    # Swaps the Firestore client (e.g. for a fake) and drops everything cached
+    # from the previous one
+    global db
+    db = instrument(client)
+    message_cache.clear()
+    with _user_profiles_lock:
+        _user_profiles.clear()
+    invalidate_user_directory()
+    with _sidebar_versions_lock:
+        _sidebar_versions.clear()
+    bump_important_version()
+
 def check_db_connection():
     try:
         # Try to access a non-existent document to verify connection/existence
@@ -51,7 +86,9 @@ def create_user_firestore(username, password_hash, role='user'):
         'personal_api_key': '',
         'created_at': firestore.SERVER_TIMESTAMP
     }
-    users_ref.add(new_user)
+    _, user_ref = users_ref.add(new_user)
+    user_directory.upsert(user_ref.id, username, role)
+    _unknown_usernames.discard(username)
     return True
 
 def get_user_by_username(username):
@@ -68,6 +105,100 @@ def update_user_key(user_id, new_key):
 
 def make_user_admin(user_id):
     db.collection('users').document(user_id).update({'role': 'admin'})
+    user_directory.set_role(user_id, 'admin')
+    invalidate_user_profile(user_id)
+
+# --- User Profile Cache ---
+# Public profile fields only (never password hashes or API keys), cached for
+# USER_PROFILE_TTL seconds so member lists do not re-read users every rerun.
+USER_PROFILE_TTL = 60
+USER_PROFILE_FIELDS = ['username', 'role']
+_user_profiles = {} # user id -> (expires_at, profile or None if missing)
+_user_profiles_lock = threading.Lock()
+
+def get_users_by_ids(user_ids):
+    # Resolves many users at once: cached profiles are reused and everything
+    # else is fetched with a single get_all round trip. Returns {id: profile}.
+    now = time.monotonic()
+    found, missing = {}, []
+    with _user_profiles_lock:
+        for uid in dict.fromkeys(user_ids):
+            entry = _user_profiles.get(uid)
+            if entry is not None and entry[0] > now:
+                if entry[1] is not None:
+                    found[uid] = entry[1]
+            else:
+                missing.append(uid)
+
+    if missing:
+        refs = [db.collection('users').document(uid) for uid in missing]
+        fetched = {}
+        for snap in db.get_all(refs, field_paths=USER_PROFILE_FIELDS):
+            if snap.exists:
+                profile = snap.to_dict()
+                profile['id'] = snap.id
+                fetched[snap.id] = profile
+        expires_at = now + USER_PROFILE_TTL
+        with _user_profiles_lock:
+            for uid in missing:
+                _user_profiles[uid] = (expires_at, fetched.get(uid))
+        found.update(fetched)
+    return found
+
+def invalidate_user_profile(user_id):
+    with _user_profiles_lock:
+        _user_profiles.pop(user_id, None)
+
+# --- User Directory ---
+# Shared by the process (see user_directory.py): backs mention resolution, the
+# add-member picker and the admin user list without re-reading `users`. Kept
+# current by the create/delete/role-change functions here and reloaded in full
+# every USER_DIRECTORY_TTL seconds to pick up changes made by other processes.
+USER_DIRECTORY_TTL = 300
+user_directory = UserDirectory()
+_user_directory_lock = threading.Lock()
+_unknown_usernames = set() # @names known not to belong to anyone, until the next reload
+
+def get_user_directory():
+    with _user_directory_lock:
+        if user_directory.loaded_at is None or time.monotonic() - user_directory.loaded_at > USER_DIRECTORY_TTL:
+            users = []
+            for doc in db.collection('users').select(['username', 'role']).stream():
+                u = doc.to_dict()
+                if u.get('username'):
+                    u['id'] = doc.id
+                    users.append(u)
+            user_directory.load(users, time.monotonic())
+            _unknown_usernames.clear()
+    return user_directory
+
+def invalidate_user_directory():
+    with _user_directory_lock:
+        user_directory.loaded_at = None
+
+def resolve_usernames(usernames):
+    # Returns {username: user_id} for the names that belong to a user
+    directory = get_user_directory()
+    result = {}
+    missing = []
+    for name in usernames:
+        uid = directory.get_id(name)
+        if uid:
+            result[name] = uid
+        elif name not in _unknown_usernames:
+            missing.append(name)
+    # Names unknown to the directory may belong to users created by another
+    # server process since the last load: look them up in one query each
+    # 30 names (the Firestore "in" limit) and remember the answer.
+    for i in range(0, len(missing), 30):
+        chunk = missing[i:i + 30]
+        _unknown_usernames.update(chunk)
+        for doc in db.collection('users').where('username', 'in', chunk).select(['username', 'role']).stream():
+            u = doc.to_dict()
+            directory.upsert(doc.id, u['username'], u.get('role', 'user'))
+            _unknown_usernames.discard(u['username'])
+            result[u['username']] = doc.id
+    return result
 
 def get_all_users():
     users = []
@@ -84,9 +215,17 @@ def create_chat_firestore(user_id, category, title):
         'category': category,
         'title': title,
         'created_at': firestore.SERVER_TIMESTAMP,
-        'participants': []  # Array of user IDs who have access (for private chats)
+        'participants': [],  # Array of user IDs who have access (for private chats)
+        'members': [user_id],  # Creator + participants, for indexed membership queries
+        # Summary, maintained by save_messages_firestore / toggle_message_importance
+        'last_message': None,
+        'last_activity_at': firestore.SERVER_TIMESTAMP,
+        'message_count': 0,
+        'important_count': 0
     }
     _, doc_ref = db.collection('chats').add(new_chat)
+    # Shared chats show up in everyone's sidebar, private ones only in the creator's
+    bump_sidebar_version(None if category in SHARED_CATEGORIES else user_id)
     return doc_ref.id
 
 def get_chats_by_category_firestore(user_id, category):
@@ -96,35 +235,66 @@ def get_chats_by_category_firestore(user_id, category):
         # Shared Categories: Fetch ALL chats in this category
         query = chats_ref.where('category', '==', category)
     else:
-        # Private Category: Fetch chats where user is creator OR participant
-        # We need to fetch all private chats and filter in Python since Firestore doesn't support OR on different fields easily
-        query = chats_ref.where('category', '==', category)
+        # Private Category: Fetch only chats where user is creator OR participant,
+        # via the 'members' array (creator + participants) so we never scan
+        # other users' private chats
+        query = chats_ref.where('category', '==', category).where('members', 'array_contains', user_id)
+
+    # Most recently active first, ordered server-side (see README for the composite indexes)
+    query = query.order_by('last_activity_at', direction=firestore.Query.DESCENDING)
         
     results = []
     for doc in query.stream():
         chat = doc.to_dict()
         chat['id'] = doc.id
-        
-        # For private chats, only include if user is creator or participant
-        if category == 'Private':
-            is_creator = chat.get('user_id') == user_id
-            is_participant = user_id in chat.get('participants', [])
-            if not (is_creator or is_participant):
-                continue
+
+        # Chats part-way through deletion are hidden until the admin finishes them
+        if chat.get('deleting'):
+            continue
         
         results.append(chat)
-    
-    # Sort in Python to avoid "Index Required" error from Firestore
-    # Handle cases where created_at might be None or missing
-    def get_sort_key(x):
-        val = x.get('created_at')
-        if val is None:
-            return datetime.datetime.min
-        return val
-
-    results.sort(key=get_sort_key, reverse=True)
     return results
 
+# --- Sidebar ---
+# In-process change counters for sidebar contents: one per user plus a global
+# one (key None) for shared chats. Sessions cache their sidebar data and reload
+# when either counter they depend on has moved (or their TTL runs out, which
+# covers changes made by other server processes).
+_sidebar_versions = {}
+_sidebar_versions_lock = threading.Lock()
+
+def bump_sidebar_version(user_id=None):
+    with _sidebar_versions_lock:
+        _sidebar_versions[user_id] = _sidebar_versions.get(user_id, 0) + 1
+
+def get_sidebar_version(user_id):
+    with _sidebar_versions_lock:
+        return (_sidebar_versions.get(None, 0), _sidebar_versions.get(user_id, 0))
+
+def get_sidebar_data(user_id):
+    # Everything the sidebar needs in one pass: unread mentions plus the
+    # user's chats for every category (two chat queries and one user read).
+    chats_ref = db.collection('chats')
+    queries = [
+        chats_ref.where('category', 'in', SHARED_CATEGORIES),
+        chats_ref.where('category', '==', 'Private').where('members', 'array_contains', user_id),
+    ]
+    chats = {'Private': [], 'Study': [], 'Fun': []}
+    for query in queries:
+        query = query.order_by('last_activity_at', direction=firestore.Query.DESCENDING)
+        for doc in query.stream():
+            chat = doc.to_dict()
+            chat['id'] = doc.id
+            # Chats part-way through deletion are hidden until the admin finishes them
+            if chat.get('deleting'):
+                continue
+            chats.setdefault(chat.get('category'), []).append(chat)
+    return {'unread': get_user_unread_mentions(user_id), 'chats': chats}
+
+def save_context_summary(chat_id, summary_state):
+    # Rolling Gemini context summary for the chat (see gemini_context.py)
+    db.collection('chats').document(chat_id).update({'context_summary': summary_state})
+
 def get_chat_details(chat_id):
     doc = db.collection('chats').document(chat_id).get()
     if doc.exists:
@@ -134,41 +304,183 @@ def get_chat_details(chat_id):
     return None
 
 # --- Messages ---
+
 def save_message_firestore(chat_id, sender_id, sender_name, content, is_ai=False, is_important=False):
-    msg_data = {
+    return save_messages_firestore([{
         'chat_id': chat_id,
         'sender_id': sender_id,
         'sender_name': sender_name,
         'content': content,
-        'timestamp': firestore.SERVER_TIMESTAMP,
         'is_ai': is_ai,
         'is_important': is_important
-    }
-    db.collection('messages').add(msg_data)
-    
-    # Handle Mentions
-    import re
-    mentions = re.findall(r'@(\w+)', content)
-    for username in mentions:
-        # Find user by username
-        users_ref = db.collection('users').where('username', '==', username).stream()
-        for user_doc in users_ref:
-            target_user_id = user_doc.id
-            if target_user_id != sender_id: # Don't notify self
+    }])[0]
+
+def save_messages_firestore(messages):
+    # Writes several messages, their mention fan-out and the chat summaries
+    # (last message, activity time, counts) in one batch. A message carrying
+    # an 'id' is written to that document, which makes retries from the
+    # outbox idempotent. Returns the message ids.
+    batch = db.batch()
+    writes = []
+    mention_updates = set()
+    summaries = {} # chat id -> summary update
+    for m in messages:
+        msg_data = {
+            'chat_id': m['chat_id'],
+            'sender_id': m['sender_id'],
+            'sender_name': m['sender_name'],
+            'content': m['content'],
+            'timestamp': firestore.SERVER_TIMESTAMP,
+            'is_ai': m.get('is_ai', False),
+            'is_important': m.get('is_important', False)
+        }
+        if m.get('is_streaming'):
+            msg_data['is_streaming'] = True
+        msg_ref = db.collection('messages').document(m.get('id'))
+        batch.set(msg_ref, msg_data)
+        writes.append((msg_ref, msg_data))
+
+        summary = summaries.setdefault(m['chat_id'], {'count': 0, 'important': 0})
+        summary['count'] += 1
+        summary['important'] += 1 if msg_data['is_important'] else 0
+        summary['last_message'] = {
+            'sender_name': m['sender_name'],
+            'content': m['content'][:LAST_MESSAGE_PREVIEW_CHARS],
+            'is_ai': msg_data['is_ai']
+        }
+
+        # Handle Mentions: resolve every @name through the username index and
+        # add the unread-mention updates to the same batch.
+        mentions = set(MENTION_PATTERN.findall(m['content']))
+        for uid in resolve_usernames(mentions).values():
+            if uid != m['sender_id']: # Don't notify self
+                mention_updates.add((uid, m['chat_id']))
+
+    summary_updates = {}
+    for chat_id, summary in summaries.items():
+        update = {
+            'last_message': summary['last_message'],
+            'last_activity_at': firestore.SERVER_TIMESTAMP,
+            'message_count': firestore.Increment(summary['count'])
+        }
+        if summary['important']:
+            update['important_count'] = firestore.Increment(summary['important'])
+        summary_updates[chat_id] = update
+        batch.update(db.collection('chats').document(chat_id), update)
+
+    for target_user_id, chat_id in mention_updates:
+        batch.update(db.collection('users').document(target_user_id),
+                     {'unread_mentions': firestore.ArrayUnion([chat_id])})
+    try:
+        batch.commit()
+    except exceptions.NotFound:
+        # A mentioned user (or the chat) was deleted meanwhile, which fails the
+        # whole batch. Save the messages on their own, then apply the rest of
+        # the updates one by one, skipping whatever no longer exists.
+        invalidate_user_directory()
+        msg_batch = db.batch()
+        for msg_ref, msg_data in writes:
+            msg_batch.set(msg_ref, msg_data)
+        msg_batch.commit()
+        for chat_id, update in summary_updates.items():
+            try:
+                db.collection('chats').document(chat_id).update(update)
+            except exceptions.NotFound:
+                pass
+        for target_user_id, chat_id in mention_updates:
+            try:
                 add_unread_mention(target_user_id, chat_id)
+            except exceptions.NotFound:
+                pass
+
+    for target_user_id, _ in mention_updates:
+        bump_sidebar_version(target_user_id)
+
+    # Write-through with a provisional local timestamp; the next delta fetch
+    # replaces it with the server-assigned one.
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for msg_ref, msg_data in writes:
+        message_cache.merge(msg_data['chat_id'], [dict(msg_data, id=msg_ref.id, timestamp=now)], from_server=False)
+    _index_for_search([dict(msg_data, id=msg_ref.id, timestamp=now) for msg_ref, msg_data in writes])
+    return [msg_ref.id for msg_ref, _ in writes]
+
+# --- Streaming Messages ---
+# An AI reply is created once as an empty placeholder, its content is updated
+# at checkpoints while tokens arrive (so other viewers see progress through
+# their listeners), and it is finalized with the full text.
+def start_streaming_message(chat_id, sender_id, sender_name, msg_id=None):
+    return save_messages_firestore([{
+        'id': msg_id,
+        'chat_id': chat_id,
+        'sender_id': sender_id,
+        'sender_name': sender_name,
+        'content': '',
+        'is_ai': True,
+        'is_streaming': True
+    }])[0]
+
+def update_streaming_message(msg_id, content):
+    db.collection('messages').document(msg_id).update({'content': content})
+    message_cache.update_message(msg_id, content=content)
+
+def finish_streaming_message(chat_id, msg_id, sender_id, sender_name, content):
+    # Final text, chat preview and mention fan-out in one batch
+    batch = db.batch()
+    batch.update(db.collection('messages').document(msg_id), {'content': content, 'is_streaming': False})
+    batch.update(db.collection('chats').document(chat_id), {
+        'last_message': {
+            'sender_name': sender_name,
+            'content': content[:LAST_MESSAGE_PREVIEW_CHARS],
+            'is_ai': True
+        },
+        'last_activity_at': firestore.SERVER_TIMESTAMP
+    })
+    mentions = set(MENTION_PATTERN.findall(content))
+    targets = [uid for uid in resolve_usernames(mentions).values() if uid != sender_id]
+    for target_user_id in targets:
+        batch.update(db.collection('users').document(target_user_id),
+                     {'unread_mentions': firestore.ArrayUnion([chat_id])})
+    batch.commit()
+    for target_user_id in targets:
+        bump_sidebar_version(target_user_id)
+    message_cache.update_message(msg_id, content=content, is_streaming=False)
+    _index_for_search([{'id': msg_id, 'chat_id': chat_id, 'sender_name': sender_name, 'content': content,
+                        'timestamp': datetime.datetime.now(datetime.timezone.utc)}])
 
 def toggle_message_importance(msg_id, current_status):
-    db.collection('messages').document(msg_id).update({'is_important': not current_status})
+    # Flips the flag and keeps the important_messages index in step, in one
+    # batch. The stored flag wins over current_status, which may be stale
+    # when two viewers star the same message within the listener's lag.
+    msg_ref = db.collection('messages').document(msg_id)
+    index_ref = db.collection('important_messages').document(msg_id)
+    msg_doc = msg_ref.get()
+    if not msg_doc.exists:
+        return
+    msg = msg_doc.to_dict()
+    current_status = msg.get('is_important', False)
+    batch = db.batch()
+    batch.update(msg_ref, {'is_important': not current_status})
+    batch.update(db.collection('chats').document(msg['chat_id']),
+                 {'important_count': firestore.Increment(-1 if current_status else 1)})
+    if current_status:
+        batch.delete(index_ref)
+    else:
+        batch.set(index_ref, _important_entry(msg))
+    batch.commit()
+    message_cache.update_message(msg_id, is_important=not current_status)
+    bump_important_version()
 
 def add_unread_mention(user_id, chat_id):
     user_ref = db.collection('users').document(user_id)
     # Use array_union to add unique chat_id to unread_mentions list
     user_ref.update({'unread_mentions': firestore.ArrayUnion([chat_id])})
+    bump_sidebar_version(user_id)
 
 def remove_unread_mention(user_id, chat_id):
     user_ref = db.collection('users').document(user_id)
     # Use array_remove to remove chat_id
     user_ref.update({'unread_mentions': firestore.ArrayRemove([chat_id])})
+    bump_sidebar_version(user_id)
 
 def get_user_unread_mentions(user_id):
     doc = db.collection('users').document(user_id).get()
@@ -177,6 +489,19 @@ def get_user_unread_mentions(user_id):
     return []
 
 def get_messages_firestore(chat_id):
+    # Served from the shared message cache. A cached chat kept current by a
+    # snapshot listener costs no reads; otherwise it is topped up with a delta
+    # fetch instead of being re-read in full.
+    cached = message_cache.get(chat_id)
+    if cached is not None and cached.complete:
+        if cached.live:
+            return list(cached.sorted_messages())
+        merged = message_cache.merge(chat_id, get_messages_since_firestore(chat_id, cached.cursor))
+        if merged is not None:
+            return merged
+    return message_cache.put(chat_id, _load_messages(chat_id))
+
+def _load_messages(chat_id):
     msgs_ref = db.collection('messages')
     # Removed order_by to avoid index requirement
     query = msgs_ref.where('chat_id', '==', chat_id)
@@ -197,20 +522,219 @@ def get_messages_firestore(chat_id):
     results.sort(key=get_sort_key) # Ascending order
     return results
 
-def get_important_messages(user_id):
-    # Fetch all messages marked as important
-    # Ideally we should filter by user access, but for now let's fetch all important ones 
-    # and filter by chats the user has access to if needed. 
-    # For simplicity in this group app, we'll show all important messages from chats the user is part of.
-    # Since we don't have easy "user in chat" logic for public chats, we'll just fetch all important messages.
-    
-    query = db.collection('messages').where('is_important', '==', True)
+# Server timestamps are assigned at commit time, so a message can land slightly
+# "behind" one we have already seen. Re-reading a short window before the cursor
+# catches those; callers de-duplicate by message id.
+MESSAGE_CURSOR_OVERLAP = datetime.timedelta(seconds=5)
+
+def get_messages_since_firestore(chat_id, since=None):
+    # Delta fetch for polling: only messages newer than the cursor are read.
+    # Needs a composite index on messages (chat_id ASC, timestamp ASC).
+    if since is None:
+        return _load_messages(chat_id)
+
+    query = (db.collection('messages')
+             .where('chat_id', '==', chat_id)
+             .where('timestamp', '>=', since - MESSAGE_CURSOR_OVERLAP)
+             .order_by('timestamp'))
+
     results = []
     for doc in query.stream():
         msg = doc.to_dict()
         msg['id'] = doc.id
         results.append(msg)
     return results
+
+MESSAGE_PAGE_SIZE = 50
+
+def get_messages_page_firestore(chat_id, limit=MESSAGE_PAGE_SIZE, before=None):
+    # One page of history: the newest `limit` messages older than `before`
+    # (or the newest overall), oldest first, plus the cursor for the next
+    # older page (None once the start of the chat is reached).
+    # Needs a composite index on messages (chat_id ASC, timestamp DESC).
+    # A live chat's newest window serves the pages it holds, and pages read
+    # beyond it are added to the cache, so paging back costs each message once.
+    cached = message_cache.get(chat_id)
+    msgs = []
+    if cached is not None and (cached.complete or cached.live):
+        msgs = cached.sorted_messages()
+        if before is not None:
+            msgs = [m for m in msgs if isinstance(m.get('timestamp'), datetime.datetime) and m['timestamp'] < before]
+    if cached is not None and (cached.complete or (cached.live and len(msgs) >= limit)):
+        page = list(msgs[-limit:])
+    else:
+        query = (db.collection('messages')
+                 .where('chat_id', '==', chat_id)
+                 .order_by('timestamp', direction=firestore.Query.DESCENDING))
+        if before is not None:
+            query = query.where('timestamp', '<', before)
+        page = []
+        for doc in query.limit(limit).stream():
+            msg = doc.to_dict()
+            msg['id'] = doc.id
+            page.append(msg)
+        page.reverse()
+        if cached is not None and cached.live:
+            window = cached.sorted_messages()
+            window_start = window[0].get('timestamp') if window else None
+            if before is None or (isinstance(window_start, datetime.datetime) and before <= window_start):
+                message_cache.extend(chat_id, page, reached_start=len(page) < limit)
+
+    older_cursor = page[0]['timestamp'] if len(page) == limit else None
+    return page, older_cursor
+
+# --- Search ---
+def _index_for_search(messages):
+    # Best effort: a problem with the local index must never fail a message
+    # write, but it is logged, since those messages stay unsearchable here
+    # until backfill_search_index() runs
+    try:
+        search_index.add_messages(messages)
+    except Exception:
+        logger.exception("Could not index %d message(s) for search", len(messages))
+
+def search_messages(user_id, text, chat_id=None, category=None, limit=SEARCH_RESULT_LIMIT, chats=None):
+    # Ranked full-text search over the chats the user can open, optionally
+    # narrowed to one chat or category. Access follows the sidebar rules
+    # (shared categories plus private chats the user is a member of); pass
+    # the user's already-loaded sidebar chats to skip the two chat queries.
+    if chats is None:
+        chats = get_sidebar_data(user_id)['chats']
+    visible = {c['id']: c for cat, cat_chats in chats.items() for c in cat_chats
+               if category is None or cat == category}
+    if chat_id is not None:
+        visible = {chat_id: visible[chat_id]} if chat_id in visible else {}
+    results = search_index.search(text, visible, limit)
+    for r in results:
+        chat = visible[r['chat_id']]
+        r['chat_title'] = chat.get('title')
+        r['category'] = chat.get('category')
+    return results
+
+def backfill_search_index():
+    # One-off: index messages written before search existed (or by another
+    # server, whose local index this one does not share)
+    indexed = 0
+    chunk = []
+    for doc in db.collection('messages').stream():
+        msg = doc.to_dict()
+        msg['id'] = doc.id
+        chunk.append(msg)
+        if len(chunk) == FIRESTORE_BATCH_LIMIT:
+            search_index.add_messages(chunk)
+            indexed += len(chunk)
+            chunk = []
+    search_index.add_messages(chunk)
+    return indexed + len(chunk)
+
+# --- Important Messages Index ---
+# important_messages/{msg_id} mirrors each starred message together with its
+# chat's access scope (category, and members for Private chats), so a user's
+# view can be queried directly instead of scanning every starred message.
+IMPORTANT_PAGE_SIZE = 10
+
+# In-process change counter for the index, like the sidebar's: sessions cache
+# their important count and loaded pages and reload when it has moved (or
+# their TTL runs out, which covers stars changed by other server processes).
+_important_version = 0
+_important_version_lock = threading.Lock()
+
+def bump_important_version():
+    global _important_version
+    with _important_version_lock:
+        _important_version += 1
+
+def get_important_version():
+    with _important_version_lock:
+        return _important_version
+
+def _important_entry(msg):
+    chat = get_chat_details(msg['chat_id']) or {}
+    category = chat.get('category', 'Private')
+    return {
+        'chat_id': msg['chat_id'],
+        'category': category,
+        'members': chat.get('members', []) if category not in SHARED_CATEGORIES else [],
+        'sender_name': msg.get('sender_name'),
+        'content': msg.get('content'),
+        'timestamp': msg.get('timestamp'),
+        'starred_at': firestore.SERVER_TIMESTAMP
+    }
+
+def _important_queries(user_id):
+    # Everything the user can see: starred messages from shared chats plus
+    # those from private chats they are a member of
+    index_ref = db.collection('important_messages')
+    return [
+        index_ref.where('category', 'in', SHARED_CATEGORIES),
+        index_ref.where('members', 'array_contains', user_id),
+    ]
+
+def count_important_messages(user_id):
+    return sum(q.count().get()[0][0].value for q in _important_queries(user_id))
+
+def get_important_messages_page(user_id, limit=IMPORTANT_PAGE_SIZE, before=None):
+    # Most recently starred first. Returns (messages, cursor for the next page
+    # or None). Each scope is read at most `limit` documents deep.
+    results = []
+    for query in _important_queries(user_id):
+        query = query.order_by('starred_at', direction=firestore.Query.DESCENDING)
+        if before is not None:
+            query = query.start_after({'starred_at': before})
+        for doc in query.limit(limit).stream():
+            msg = doc.to_dict()
+            msg['id'] = doc.id
+            results.append(msg)
+
+    results.sort(key=lambda m: m.get('starred_at') or datetime.datetime.min.replace(tzinfo=datetime.timezone.utc), reverse=True)
+    page = results[:limit]
+    cursor = page[-1]['starred_at'] if len(page) == limit else None
+    return page, cursor
+
+def iter_important_messages(user_id, page_size=100):
+    # Every starred message the user can access, read a page at a time
+    cursor = None
+    while True:
+        page, cursor = get_important_messages_page(user_id, limit=page_size, before=cursor)
+        yield from page
+        if cursor is None:
+            return
+
+def get_important_messages(user_id):
+    return list(iter_important_messages(user_id))
+
+def get_important_versions(user_id):
+    # (entry id, update time) for everything the user can access, keys only;
+    # changes whenever an entry is added, removed or rewritten
+    versions = set()
+    for query in _important_queries(user_id):
+        for doc in query.select([]).stream():
+            versions.add((doc.id, str(doc.update_time)))
+    return sorted(versions)
+
+def _update_important_members(chat_id, change):
+    # Private chat membership changed: carry it onto the chat's index entries
+    batch = db.batch()
+    pending = 0
+    for doc in db.collection('important_messages').where('chat_id', '==', chat_id).select([]).stream():
+        batch.update(doc.reference, {'members': change})
+        pending += 1
+        if pending == FIRESTORE_BATCH_LIMIT:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    bump_important_version()
+
+def backfill_important_index():
+    # One-off migration: index messages starred before important_messages existed
+    indexed = 0
+    for doc in db.collection('messages').where('is_important', '==', True).stream():
+        db.collection('important_messages').document(doc.id).set(_important_entry(doc.to_dict()))
+        indexed += 1
+    bump_important_version()
+    return indexed
 def get_system_api_key_firestore():
     doc = db.collection('settings').document('global_api_key').get()
     if doc.exists:
@@ -223,14 +747,81 @@ def set_system_api_key_firestore(key):
 # --- Admin Deletion ---
 def delete_user_firestore(user_id):
     db.collection('users').document(user_id).delete()
+    user_directory.remove(user_id)
+    invalidate_user_profile(user_id)
+
+FIRESTORE_BATCH_LIMIT = 500 # Max writes per batch commit
+DELETE_WORKERS = 4 # Batches committed concurrently
+
+def _delete_in_batches(refs, progress=None):
+    # Deletes document refs in batches of FIRESTORE_BATCH_LIMIT, committing up to
+    # DELETE_WORKERS batches at once. progress(n) is called from this thread
+    # with the number of documents deleted by each finished batch.
+    def commit(chunk):
+        batch = db.batch()
+        for ref in chunk:
+            batch.delete(ref)
+        batch.commit()
+        return len(chunk)
+
+    deleted = 0
+    in_flight = set()
+
+    def collect(futures):
+        nonlocal deleted
+        for f in futures:
+            n = f.result()
+            deleted += n
+            if progress:
+                progress(n)
+
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as pool:
+        chunk = []
+        for ref in refs:
+            chunk.append(ref)
+            if len(chunk) == FIRESTORE_BATCH_LIMIT:
+                in_flight.add(pool.submit(contextvars.copy_context().run, commit, chunk))
+                chunk = []
+                # Bound the number of queued batches so memory stays flat
+                if len(in_flight) >= DELETE_WORKERS * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+        if chunk:
+            in_flight.add(pool.submit(contextvars.copy_context().run, commit, chunk))
+        done, _ = wait(in_flight)
+        collect(done)
+    return deleted
+
+def count_chat_messages(chat_id):
+    result = db.collection('messages').where('chat_id', '==', chat_id).count().get()
+    return result[0][0].value
+
+def delete_chat_firestore(chat_id, progress=None):
+    chat_ref = db.collection('chats').document(chat_id)
+    # Flag the chat first: it drops out of listings, and if this run is
+    # interrupted the admin panel offers to resume. Re-running is safe since
+    # only the remaining messages still match the query.
+    try:
+        chat_ref.update({'deleting': True})
+    except exceptions.NotFound:
+        pass
 
-def delete_chat_firestore(chat_id):
-    # Delete messages first
-    msgs = db.collection('messages').where('chat_id', '==', chat_id).stream()
-    for m in msgs:
-        m.reference.delete()
+    # Delete messages first (keys only, no message bodies are read)
+    msgs = db.collection('messages').where('chat_id', '==', chat_id).select([]).stream()
+    deleted = _delete_in_batches((m.reference for m in msgs), progress)
+    starred = db.collection('important_messages').where('chat_id', '==', chat_id).select([]).stream()
+    _delete_in_batches(s.reference for s in starred)
+    bump_important_version()
     # Delete chat
-    db.collection('chats').document(chat_id).delete()
+    chat_ref.delete()
+    message_cache.invalidate(chat_id)
+    search_index.remove_chat(chat_id)
+    bump_sidebar_version()
+    return deleted
+
+def get_user_chat_ids(user_id):
+    query = db.collection('chats').where('user_id', '==', user_id).select([])
+    return [doc.id for doc in query.stream()]
     
 def get_all_chats():
     chats = []
@@ -243,25 +834,87 @@ def get_all_chats():
 # --- Participants ---
 def add_participant_to_chat(chat_id, user_id):
     chat_ref = db.collection('chats').document(chat_id)
-    chat_ref.update({'participants': firestore.ArrayUnion([user_id])})
+    chat_ref.update({
+        'participants': firestore.ArrayUnion([user_id]),
+        'members': firestore.ArrayUnion([user_id])
+    })
+    _update_important_members(chat_id, firestore.ArrayUnion([user_id]))
+    bump_sidebar_version(user_id)
 
 def remove_participant_from_chat(chat_id, user_id):
     chat_ref = db.collection('chats').document(chat_id)
-    chat_ref.update({'participants': firestore.ArrayRemove([user_id])})
+    chat_ref.update({
+        'participants': firestore.ArrayRemove([user_id]),
+        'members': firestore.ArrayRemove([user_id])
+    })
+    _update_important_members(chat_id, firestore.ArrayRemove([user_id]))
+    bump_sidebar_version(user_id)
+
+def backfill_chat_members():
+    # One-off migration for chats created before the 'members' field existed.
+    # Returns the number of chats updated.
+    updated = 0
+    batch = db.batch()
+    pending = 0
+    for doc in db.collection('chats').select(['user_id', 'participants', 'members']).stream():
+        chat = doc.to_dict()
+        members = list(dict.fromkeys([chat.get('user_id')] + chat.get('participants', [])))
+        if chat.get('members') == members:
+            continue
+        batch.update(doc.reference, {'members': members})
+        pending += 1
+        updated += 1
+        if pending == FIRESTORE_BATCH_LIMIT:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return updated
+
+def backfill_chat_summaries():
+    # One-off migration: computes the summary fields for chats created before
+    # they existed, using count() aggregations and the newest message only.
+    updated = 0
+    for doc in db.collection('chats').stream():
+        chat = doc.to_dict()
+        if 'last_activity_at' in chat:
+            continue
+        msgs = db.collection('messages').where('chat_id', '==', doc.id)
+        last = None
+        for m in msgs.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(1).stream():
+            last = m.to_dict()
+        db.collection('chats').document(doc.id).update({
+            'last_message': {
+                'sender_name': last['sender_name'],
+                'content': last['content'][:LAST_MESSAGE_PREVIEW_CHARS],
+                'is_ai': last.get('is_ai', False)
+            } if last else None,
+            'last_activity_at': (last or {}).get('timestamp') or chat.get('created_at') or firestore.SERVER_TIMESTAMP,
+            'message_count': msgs.count().get()[0][0].value,
+            'important_count': msgs.where('is_important', '==', True).count().get()[0][0].value
+        })
+        updated += 1
+    return updated
+
+def get_chat_members(chat):
+    # Creator and participants of an already-loaded chat, resolved together in
+    # one batched lookup. Returns (creator or None, participants).
+    participant_ids = chat.get('participants', [])
+    users = get_users_by_ids([chat.get('user_id')] + participant_ids)
+    participants = [users[uid] for uid in participant_ids if uid in users]
+    return users.get(chat.get('user_id')), participants
 
 def get_chat_participants(chat_id):
     chat = get_chat_details(chat_id)
     if not chat:
         return []
-    
-    participant_ids = chat.get('participants', [])
-    participants = []
-    
-    for uid in participant_ids:
-        user_doc = db.collection('users').document(uid).get()
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            user_data['id'] = user_doc.id
-            participants.append(user_data)
-    
-    return participants
+    return get_chat_members(chat)[1]
+
+# Firestore metrics are attributed to the public function the caller entered
+# through (see firestore_metrics.track), so every public function is tracked
+for _name, _fn in list(globals().items()):
+    if (inspect.isfunction(_fn) and _fn.__module__ == __name__ and not _name.startswith('_')
+            and _name not in ('connect', 'get_db', 'set_db')):
+        globals()[_name] = track(_fn)
+del _name, _fn
@@ -0,0 +1,68 @@
+import firebase_db
+from storage import StorageBackend
+
+# The Firestore implementation of StorageBackend: a thin layer over
+# firebase_db, so the caches, batching and indexes there apply unchanged.
+
+
+class FirestoreBackend(StorageBackend):
+    name = "firestore"
+
+    def check_connection(self):
+        return firebase_db.check_db_connection()
+
+    # --- Users ---
+    def create_user(self, username, password_hash, role='user'):
+        return firebase_db.create_user_firestore(username, password_hash, role)
+
+    def get_user_by_username(self, username):
+        return firebase_db.get_user_by_username(username)
+
+    def make_user_admin(self, user_id):
+        firebase_db.make_user_admin(user_id)
+
+    # --- Chats ---
+    def create_chat(self, user_id, category, title):
+        return firebase_db.create_chat_firestore(user_id, category, title)
+
+    def get_chat(self, chat_id):
+        return firebase_db.get_chat_details(chat_id)
+
+    def get_chats_by_category(self, user_id, category):
+        return firebase_db.get_chats_by_category_firestore(user_id, category)
+
+    def add_participant(self, chat_id, user_id):
+        firebase_db.add_participant_to_chat(chat_id, user_id)
+
+    def delete_chat(self, chat_id):
+        return firebase_db.delete_chat_firestore(chat_id)
+
+    # --- Messages ---
+    def save_messages(self, messages):
+        return firebase_db.save_messages_firestore(messages)
+
+    def get_messages(self, chat_id):
+        return firebase_db.get_messages_firestore(chat_id)
+
+    def toggle_message_importance(self, msg_id, current_status):
+        firebase_db.toggle_message_importance(msg_id, current_status)
+
+    def count_important_messages(self, user_id):
+        return firebase_db.count_important_messages(user_id)
+
+    # --- Mentions ---
+    def add_unread_mention(self, user_id, chat_id):
+        firebase_db.add_unread_mention(user_id, chat_id)
+
+    def remove_unread_mention(self, user_id, chat_id):
+        firebase_db.remove_unread_mention(user_id, chat_id)
+
+    def get_unread_mentions(self, user_id):
+        return firebase_db.get_user_unread_mentions(user_id)
+
+    # --- Settings ---
+    def get_system_api_key(self):
+        return firebase_db.get_system_api_key_firestore()
+
+    def set_system_api_key(self, key):
+        firebase_db.set_system_api_key_firestore(key)
@@ -0,0 +1,371 @@
+import datetime
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+from google.api_core import exceptions
+from google.cloud import firestore
+
+# In-memory stand-in for the parts of the Firestore client this app uses:
+# documents, batches, get_all, filtered/ordered/limited/projected queries,
+# count() aggregations, cursors and on_snapshot listeners, plus the
+# SERVER_TIMESTAMP / Increment / ArrayUnion / ArrayRemove transforms.
+#
+# Every round trip sleeps for `latency` seconds, and reads and writes are
+# counted the way Firestore bills them (one read per document returned, at
+# least one per query; one per 1000 entries counted; one write per document
+# written), so benchmarks can compare both time and cost.
+
+COUNT_ENTRIES_PER_READ = 1000
+
+
+def _copy(data):
+    return {k: (list(v) if isinstance(v, list) else v) for k, v in data.items()}
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, update_time=None, fields=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+        self.fields = fields
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        if self.fields is not None:
+            return {k: v for k, v in _copy(self._data).items() if k in self.fields}
+        return _copy(self._data)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return (self._collection, self.id)
+
+    def get(self, field_paths=None):
+        self._client._round_trip()
+        with self._client._lock:
+            data, update_time = self._client._read(self.path)
+        self._client._count(reads=1)
+        return FakeSnapshot(self, data, update_time, field_paths)
+
+    def set(self, data, merge=False):
+        self._client._commit([('set', self, data, merge)])
+
+    def update(self, data):
+        self._client._commit([('update', self, data, False)])
+
+    def delete(self):
+        self._client._commit([('delete', self, None, False)])
+
+
+class FakeAggregation:
+    def __init__(self, query):
+        self._query = query
+
+    def get(self):
+        client = self._query._client
+        client._round_trip()
+        with client._lock:
+            n = len(client._run(self._query))
+        client._count(reads=max(1, -(-n // COUNT_ENTRIES_PER_READ)))
+        return [[SimpleNamespace(alias='count', value=n)]]
+
+
+class FakeQuery:
+    def __init__(self, client, collection, filters=(), orders=(), limit=None, fields=None, start_after=None):
+        self._client = client
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._fields = fields
+        self._start_after = start_after
+
+    def _with(self, **changes):
+        args = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                    fields=self._fields, start_after=self._start_after)
+        args.update(changes)
+        return FakeQuery(self._client, self._collection, **args)
+
+    def where(self, field, op, value):
+        return self._with(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._with(orders=self._orders + ((field, direction),))
+
+    def limit(self, count):
+        return self._with(limit=count)
+
+    def select(self, field_paths):
+        return self._with(fields=list(field_paths))
+
+    def start_after(self, values):
+        return self._with(start_after=dict(values))
+
+    def count(self):
+        return FakeAggregation(self)
+
+    def stream(self):
+        self._client._round_trip()
+        with self._client._lock:
+            results = self._client._run(self)
+            snaps = [FakeSnapshot(FakeDocumentReference(self._client, self._collection, doc_id), data,
+                                  self._client._update_times.get((self._collection, doc_id)), self._fields)
+                     for doc_id, data in results]
+        self._client._count(reads=max(1, len(snaps)))
+        return iter(snaps)
+
+    def get(self):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        return self._client._watch(self, callback)
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+        self.id = name
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._client, self._collection, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        update_time = self._client._commit([('set', ref, data, False)])
+        return update_time, ref
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(('set', ref, data, merge))
+
+    def update(self, ref, data):
+        self._ops.append(('update', ref, data, False))
+
+    def delete(self, ref):
+        self._ops.append(('delete', ref, None, False))
+
+    def commit(self):
+        return self._client._commit(self._ops)
+
+
+class FakeWatch:
+    def __init__(self, client, query, callback):
+        self._client = client
+        self.query = query
+        self.callback = callback
+        self.docs = {}  # doc id -> data as last delivered
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+        with self._client._lock:
+            if self in self._client._watches:
+                self._client._watches.remove(self)
+
+
+class FakeFirestore:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._docs = {}  # collection -> {doc id: data}
+        self._update_times = {}  # (collection, doc id) -> datetime
+        self._watches = []
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self._last_time = None
+        self.reads = 0
+        self.writes = 0
+        self.round_trips = 0
+
+    # --- Client API ---
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def get_all(self, references, field_paths=None):
+        references = list(references)
+        self._round_trip()
+        with self._lock:
+            snaps = []
+            for ref in references:
+                data, update_time = self._read(ref.path)
+                snaps.append(FakeSnapshot(ref, data, update_time, field_paths))
+        self._count(reads=len(snaps))
+        return iter(snaps)
+
+    # --- Stats ---
+    def stats(self):
+        with self._stats_lock:
+            return {'reads': self.reads, 'writes': self.writes, 'round_trips': self.round_trips}
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.reads = self.writes = self.round_trips = 0
+
+    def _round_trip(self):
+        with self._stats_lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _count(self, reads=0, writes=0):
+        with self._stats_lock:
+            self.reads += reads
+            self.writes += writes
+
+    # --- Storage ---
+    def _read(self, path):
+        data = self._docs.get(path[0], {}).get(path[1])
+        return data, self._update_times.get(path)
+
+    def _now(self):
+        # Strictly increasing, like server commit times
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if self._last_time is not None and now <= self._last_time:
+            now = self._last_time + datetime.timedelta(microseconds=1)
+        self._last_time = now
+        return now
+
+    def _apply(self, current, data, now):
+        result = _copy(current or {})
+        for field, value in data.items():
+            if value is firestore.SERVER_TIMESTAMP:
+                result[field] = now
+            elif isinstance(value, firestore.Increment):
+                result[field] = result.get(field, 0) + value.value
+            elif isinstance(value, firestore.ArrayUnion):
+                items = list(result.get(field) or [])
+                result[field] = items + [v for v in value.values if v not in items]
+            elif isinstance(value, firestore.ArrayRemove):
+                result[field] = [v for v in (result.get(field) or []) if v not in value.values]
+            else:
+                result[field] = value
+        return result
+
+    def _commit(self, ops):
+        self._round_trip()
+        with self._lock:
+            now = self._now()
+            # All or nothing, like a batch: validate before applying
+            staged = {}
+            for kind, ref, data, merge in ops:
+                current = staged[ref.path] if ref.path in staged else self._read(ref.path)[0]
+                if kind == 'update' and current is None:
+                    raise exceptions.NotFound(f"No document to update: {'/'.join(ref.path)}")
+                if kind == 'delete':
+                    staged[ref.path] = None
+                elif kind == 'set' and not merge:
+                    staged[ref.path] = self._apply(None, data, now)
+                else:
+                    staged[ref.path] = self._apply(current, data, now)
+            for (collection, doc_id), data in staged.items():
+                if data is None:
+                    self._docs.get(collection, {}).pop(doc_id, None)
+                    self._update_times.pop((collection, doc_id), None)
+                else:
+                    self._docs.setdefault(collection, {})[doc_id] = data
+                    self._update_times[(collection, doc_id)] = now
+            notifications = self._diff_watches({collection for collection, _ in staged})
+        self._count(writes=len(ops))
+        for watch, changes in notifications:
+            watch.callback([], changes, now)
+        return now
+
+    # --- Queries ---
+    @staticmethod
+    def _matches(data, filters):
+        for field, op, value in filters:
+            if field not in data:
+                return False
+            actual = data[field]
+            if op == '==' and actual != value:
+                return False
+            if op == 'in' and actual not in value:
+                return False
+            if op == 'array_contains' and value not in (actual or []):
+                return False
+            if op in ('<', '<=', '>', '>='):
+                if actual is None:
+                    return False
+                if op == '<' and not actual < value:
+                    return False
+                if op == '<=' and not actual <= value:
+                    return False
+                if op == '>' and not actual > value:
+                    return False
+                if op == '>=' and not actual >= value:
+                    return False
+        return True
+
+    def _run(self, query):
+        # [(doc id, data)] for a query; callers hold the lock
+        docs = self._docs.get(query._collection, {})
+        rows = [(doc_id, data) for doc_id, data in docs.items() if self._matches(data, query._filters)]
+        # Documents missing an ordered field are left out, as in Firestore
+        for field, _ in query._orders:
+            rows = [r for r in rows if r[1].get(field) is not None]
+        for field, direction in reversed(query._orders):
+            rows.sort(key=lambda r: r[1][field], reverse=direction == 'DESCENDING')
+        if not query._orders:
+            rows.sort(key=lambda r: r[0])
+        if query._start_after is not None and query._orders:
+            field, direction = query._orders[0]
+            cursor = query._start_after[field]
+            rows = [r for r in rows if (r[1][field] < cursor if direction == 'DESCENDING' else r[1][field] > cursor)]
+        if query._limit is not None:
+            rows = rows[:query._limit]
+        return rows
+
+    # --- Listeners ---
+    def _watch(self, query, callback):
+        watch = FakeWatch(self, query, callback)
+        with self._lock:
+            self._watches.append(watch)
+            notifications = self._diff_watches({query._collection}, only=watch)
+        for w, changes in notifications:
+            w.callback([], changes, self._last_time)
+        return watch
+
+    def _diff_watches(self, collections, only=None):
+        notifications = []
+        for watch in ([only] if only else self._watches):
+            if watch.query._collection not in collections:
+                continue
+            current = dict(self._run(watch.query))
+            changes = []
+            for doc_id, data in current.items():
+                old = watch.docs.get(doc_id)
+                if old is None or old != data:
+                    changes.append(self._change('ADDED' if old is None else 'MODIFIED', watch.query, doc_id, data))
+            for doc_id in watch.docs.keys() - current.keys():
+                changes.append(self._change('REMOVED', watch.query, doc_id, watch.docs[doc_id]))
+            watch.docs = {doc_id: _copy(data) for doc_id, data in current.items()}
+            if changes or only is not None:
+                self._count(reads=max(1, len([c for c in changes if c.type.name != 'REMOVED'])))
+                notifications.append((watch, changes))
+        return notifications
+
+    def _change(self, kind, query, doc_id, data):
+        ref = FakeDocumentReference(self, query._collection, doc_id)
+        snap = FakeSnapshot(ref, _copy(data), self._update_times.get((query._collection, doc_id)))
+        return SimpleNamespace(type=SimpleNamespace(name=kind), document=snap)
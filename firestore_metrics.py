@@ -0,0 +1,380 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# Firestore cost accounting.
+#
+# firebase_db wraps its client in InstrumentedClient, so every document get,
+# query, count, get_all, write, batch commit and listener snapshot is recorded
+# with its operation type, collection, documents read/written (counted the
+# way Firestore bills them) and latency. Each record is attributed to:
+#   - the firebase_db function it ran under (the outermost tracked one, so a
+#     helper's reads count towards the entry point the UI called),
+#   - the Streamlit session, or "background" for worker and listener threads,
+#   - the session's current rerun, as labelled by start_rerun().
+# Totals per function, per operation/collection and per session are kept for
+# the life of the process, together with the last RERUN_HISTORY reruns and a
+# per-minute series for reads/min. snapshot() returns all of it as plain
+# JSON-able data; if FIRESTORE_METRICS_LOG is set, every finished rerun is
+# also appended to that file as one JSON line.
+
+RERUN_HISTORY = 200  # finished reruns kept for the report
+RATE_HISTORY_MINUTES = 60  # per-minute buckets kept for reads/min
+SESSION_TTL = 3600  # seconds before an idle session's totals are dropped
+BACKGROUND = "background"
+UNTRACKED = "(untracked)"
+
+# (function, session id) of the tracked call in progress; worker threads see
+# it when they are started with contextvars.copy_context()
+_caller = contextvars.ContextVar('firestore_caller', default=None)
+
+
+def _totals():
+    return {'ops': 0, 'reads': 0, 'writes': 0, 'ms': 0.0}
+
+
+def _add(totals, reads, writes, ms):
+    totals['ops'] += 1
+    totals['reads'] += reads
+    totals['writes'] += writes
+    totals['ms'] += ms
+
+
+def _current_session():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else BACKGROUND
+
+
+def _current_caller():
+    caller = _caller.get()
+    return caller if caller is not None else (None, _current_session())
+
+
+def track(fn):
+    """Attributes Firestore operations made inside fn to its name."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _caller.get() is not None:
+            return fn(*args, **kwargs)
+        token = _caller.set((name, _current_session()))
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _caller.reset(token)
+    return wrapper
+
+
+class FirestoreMetrics:
+    def __init__(self, log_path=None, clock=time.time):
+        self.log_path = log_path
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = self.clock()
+            self.by_function = {}  # function -> totals
+            self.by_operation = {}  # (op, collection) -> totals
+            self.by_session = {}  # session id -> totals plus reruns and last_seen
+            self.reruns = deque(maxlen=RERUN_HISTORY)  # finished rerun records
+            self._current = {}  # session id -> rerun record in progress
+            self._minutes = deque(maxlen=RATE_HISTORY_MINUTES)  # [minute, reads, writes]
+
+    def record(self, op, collection, reads=0, writes=0, ms=0.0, function=None, session_id=None):
+        if function is None or session_id is None:
+            current_function, current_session = _current_caller()
+            function = function or current_function
+            session_id = session_id or current_session
+        function = function or UNTRACKED
+        now = self.clock()
+        with self._lock:
+            _add(self.by_function.setdefault(function, _totals()), reads, writes, ms)
+            _add(self.by_operation.setdefault((op, collection), _totals()), reads, writes, ms)
+            session = self.by_session.get(session_id)
+            if session is None:
+                session = self.by_session[session_id] = dict(_totals(), reruns=0, last_seen=now)
+            _add(session, reads, writes, ms)
+            session['last_seen'] = now
+            rerun = self._current.get(session_id)
+            if rerun is not None:
+                _add(rerun, reads, writes, ms)
+                rerun['functions'][function] = rerun['functions'].get(function, 0) + reads
+            minute = int(now // 60)
+            if not self._minutes or self._minutes[-1][0] != minute:
+                self._minutes.append([minute, 0, 0])
+            self._minutes[-1][1] += reads
+            self._minutes[-1][2] += writes
+
+    def start_rerun(self, session_id, label):
+        # Closes the session's previous rerun and opens a new one; called at
+        # the top of every script run and fragment run
+        now = self.clock()
+        with self._lock:
+            finished = self._finish(session_id)
+            self._current[session_id] = dict(_totals(), session_id=session_id, label=label,
+                                             started_at=now, functions={})
+            session = self.by_session.setdefault(session_id, dict(_totals(), reruns=0, last_seen=now))
+            session['reruns'] += 1
+            session['last_seen'] = now
+            self._prune_sessions(now)
+        if finished is not None:
+            self._log(finished)
+
+    def _finish(self, session_id):
+        rerun = self._current.pop(session_id, None)
+        if rerun is None:
+            return None
+        rerun['ms'] = round(rerun['ms'], 1)
+        self.reruns.append(rerun)
+        return rerun
+
+    def _prune_sessions(self, now):
+        for session_id, session in list(self.by_session.items()):
+            if session_id != BACKGROUND and now - session['last_seen'] > SESSION_TTL:
+                del self.by_session[session_id]
+                self._current.pop(session_id, None)
+
+    def _log(self, rerun):
+        if not self.log_path:
+            return
+        try:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(dict(rerun, type='rerun'), default=str) + "\n")
+        except OSError:
+            pass  # metrics must never break the app
+
+    # --- Reports ---
+    def reads_per_minute(self, minutes=5):
+        # Average over the last `minutes` minutes, the current one included
+        now_minute = int(self.clock() // 60)
+        with self._lock:
+            reads = sum(r for m, r, _ in self._minutes if m > now_minute - minutes)
+        elapsed = min(minutes, max(1, (self.clock() - self.started_at) / 60))
+        return reads / elapsed
+
+    def top_functions(self, key='reads', limit=10):
+        with self._lock:
+            rows = [dict(t, function=name) for name, t in self.by_function.items()]
+        return sorted(rows, key=lambda r: r[key], reverse=True)[:limit]
+
+    def top_reruns(self, key='reads', limit=10):
+        with self._lock:
+            rows = list(self.reruns)
+        return sorted(rows, key=lambda r: r[key], reverse=True)[:limit]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'taken_at': self.clock(),
+                'functions': {name: dict(t) for name, t in self.by_function.items()},
+                'operations': [dict(t, op=op, collection=coll) for (op, coll), t in self.by_operation.items()],
+                'sessions': {sid: dict(s) for sid, s in self.by_session.items()},
+                'reruns': [dict(r, functions=dict(r['functions'])) for r in self.reruns],
+                'reads_per_minute': [{'minute': m * 60, 'reads': r, 'writes': w} for m, r, w in self._minutes],
+            }
+
+    def export_json(self):
+        return json.dumps(self.snapshot(), default=str, indent=2)
+
+
+metrics = FirestoreMetrics(log_path=os.environ.get("FIRESTORE_METRICS_LOG"))
+
+
+# --- Client wrappers ---
+# Thin proxies over the google-cloud-firestore objects firebase_db uses. Query
+# builders return wrapped queries; anything not overridden is passed through.
+
+def _unwrap(obj):
+    return getattr(obj, '_wrapped', obj)
+
+
+def _collection_of(ref):
+    ref = _unwrap(ref)
+    parent = getattr(ref, 'parent', None)
+    return parent.id if parent is not None else getattr(ref, '_collection', '?')
+
+
+def _elapsed_ms(started):
+    return (time.perf_counter() - started) * 1000
+
+
+class _Proxy:
+    def __init__(self, wrapped, recorder):
+        self._wrapped = wrapped
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+
+class InstrumentedDocument(_Proxy):
+    def __init__(self, wrapped, recorder, collection):
+        super().__init__(wrapped, recorder)
+        self._collection = collection
+
+    def _timed(self, op, call, reads=0, writes=0):
+        started = time.perf_counter()
+        try:
+            return call()
+        finally:
+            self._recorder.record(op, self._collection, reads, writes, _elapsed_ms(started))
+
+    def get(self, *args, **kwargs):
+        return self._timed('get', lambda: self._wrapped.get(*args, **kwargs), reads=1)
+
+    def set(self, *args, **kwargs):
+        return self._timed('set', lambda: self._wrapped.set(*args, **kwargs), writes=1)
+
+    def update(self, *args, **kwargs):
+        return self._timed('update', lambda: self._wrapped.update(*args, **kwargs), writes=1)
+
+    def delete(self, *args, **kwargs):
+        return self._timed('delete', lambda: self._wrapped.delete(*args, **kwargs), writes=1)
+
+
+class InstrumentedAggregation(_Proxy):
+    def __init__(self, wrapped, recorder, collection):
+        super().__init__(wrapped, recorder)
+        self._collection = collection
+
+    def get(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._wrapped.get(*args, **kwargs)
+        # Billed one read per 1000 index entries counted
+        value = result[0][0].value
+        self._recorder.record('count', self._collection, max(1, -(-value // 1000)), 0, _elapsed_ms(started))
+        return result
+
+
+class InstrumentedQuery(_Proxy):
+    def __init__(self, wrapped, recorder, collection):
+        super().__init__(wrapped, recorder)
+        self._collection = collection
+
+    def _chain(self, name):
+        def build(*args, **kwargs):
+            return InstrumentedQuery(getattr(self._wrapped, name)(*args, **kwargs), self._recorder, self._collection)
+        return build
+
+    def __getattr__(self, name):
+        if name in ('where', 'order_by', 'limit', 'limit_to_last', 'select', 'offset',
+                    'start_at', 'start_after', 'end_at', 'end_before'):
+            return self._chain(name)
+        return getattr(self._wrapped, name)
+
+    def stream(self, *args, **kwargs):
+        # Only time spent inside the underlying iterator counts as latency; the
+        # record is made once iteration ends (or the generator is dropped)
+        function, session_id = _current_caller()
+        count, ms = 0, 0.0
+        started = time.perf_counter()
+        iterator = iter(self._wrapped.stream(*args, **kwargs))
+        ms += _elapsed_ms(started)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    doc = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    ms += _elapsed_ms(started)
+                count += 1
+                yield doc
+        finally:
+            # A query is billed at least one read even when it matches nothing
+            self._recorder.record('query', self._collection, max(1, count), 0, ms, function, session_id)
+
+    def get(self, *args, **kwargs):
+        return list(self.stream(*args, **kwargs))
+
+    def count(self, *args, **kwargs):
+        return InstrumentedAggregation(self._wrapped.count(*args, **kwargs), self._recorder, self._collection)
+
+    def on_snapshot(self, callback):
+        # Listener snapshots arrive on a background thread; each added or
+        # modified document is a billed read
+        function = _current_caller()[0] or 'on_snapshot'
+
+        def counted(docs, changes, read_time):
+            reads = sum(1 for c in changes if c.type.name != 'REMOVED')
+            self._recorder.record('listen', self._collection, max(1, reads) if changes else 0, 0, 0.0,
+                                  function, BACKGROUND)
+            return callback(docs, changes, read_time)
+        return self._wrapped.on_snapshot(counted)
+
+
+class InstrumentedCollection(InstrumentedQuery):
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs), self._recorder, self._collection)
+
+    def add(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._wrapped.add(*args, **kwargs)
+        finally:
+            self._recorder.record('add', self._collection, 0, 1, _elapsed_ms(started))
+
+
+class InstrumentedBatch(_Proxy):
+    def __init__(self, wrapped, recorder):
+        super().__init__(wrapped, recorder)
+        self._collections = {}  # collection -> writes queued
+
+    def _queue(self, ref):
+        collection = _collection_of(ref)
+        self._collections[collection] = self._collections.get(collection, 0) + 1
+        return _unwrap(ref)
+
+    def set(self, ref, *args, **kwargs):
+        return self._wrapped.set(self._queue(ref), *args, **kwargs)
+
+    def update(self, ref, *args, **kwargs):
+        return self._wrapped.update(self._queue(ref), *args, **kwargs)
+
+    def delete(self, ref, *args, **kwargs):
+        return self._wrapped.delete(self._queue(ref), *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._wrapped.commit(*args, **kwargs)
+        finally:
+            ms = _elapsed_ms(started)
+            # One record per collection, with the commit's latency on the first
+            for i, (collection, writes) in enumerate(sorted(self._collections.items())):
+                self._recorder.record('batch', collection, 0, writes, ms if i == 0 else 0.0)
+
+
+class InstrumentedClient(_Proxy):
+    def collection(self, name):
+        return InstrumentedCollection(self._wrapped.collection(name), self._recorder, name)
+
+    def batch(self):
+        return InstrumentedBatch(self._wrapped.batch(), self._recorder)
+
+    def get_all(self, references, *args, **kwargs):
+        references = list(references)
+        collection = _collection_of(references[0]) if references else '?'
+        started = time.perf_counter()
+        try:
+            # Materialized so the round trip is timed; callers iterate either way
+            return list(self._wrapped.get_all([_unwrap(r) for r in references], *args, **kwargs))
+        finally:
+            self._recorder.record('get_all', collection, len(references), 0, _elapsed_ms(started))
+
+
+def instrument(client, recorder=metrics):
+    if client is None or isinstance(client, InstrumentedClient):
+        return client
+    return InstrumentedClient(client, recorder)
@@ -0,0 +1,131 @@
+import datetime
+
+# Token-budgeted history for Gemini calls.
+#
+# The newest messages are sent verbatim for as long as they fit the budget.
+# Everything older is represented by a rolling summary that is stored per chat
+# and only ever extended: when messages age out of the verbatim window they are
+# folded into the existing summary, so summarizing costs scale with what is new
+# since the last call rather than with the age of the chat. Small aged-out
+# spans ride along verbatim (within SUMMARY_BATCH_TOKENS) until there is enough
+# to be worth a summarizer call. load_context_messages reads only as much of
+# the chat as that needs, newest page first.
+
+CONTEXT_TOKEN_BUDGET = 8000  # total tokens of history sent with each call
+SUMMARY_RESERVE_TOKENS = 1000  # room kept for the rolling summary
+SUMMARY_BATCH_TOKENS = 1000  # aged-out text held verbatim before summarizing
+SUMMARY_MAX_INPUT_TOKENS = 8000  # aged-out text folded in per call; older unsummarized turns are dropped
+_CHARS_PER_TOKEN = 4
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    # Cheap local estimate (~4 characters per token); avoids a count_tokens call
+    return len(text) // _CHARS_PER_TOKEN + _MESSAGE_OVERHEAD_TOKENS
+
+
+def _to_history(messages):
+    # Gemini expects alternating roles, so consecutive turns are merged
+    history = []
+    for m in messages:
+        role = "model" if m['is_ai'] else "user"
+        if history and history[-1]['role'] == role:
+            history[-1]['parts'].append(m['content'])
+        else:
+            history.append({"role": role, "parts": [m['content']]})
+    return history
+
+
+def _is_summarized(msg, covered_until):
+    ts = msg.get('timestamp')
+    return covered_until is not None and isinstance(ts, datetime.datetime) and ts <= covered_until
+
+
+def _recent_budget(budget):
+    # Newest messages verbatim, within what the summary and batch slack leave over
+    return budget - SUMMARY_RESERVE_TOKENS - SUMMARY_BATCH_TOKENS
+
+
+def load_context_messages(fetch_page, summary_state=None, budget=CONTEXT_TOKEN_BUDGET):
+    """Returns the newest messages of a chat, oldest first, as many as build_context can use.
+
+    fetch_page(before) returns (page, older_cursor) like
+    firebase_db.get_messages_page_firestore. Pages are read back from the
+    newest until they cover the verbatim window plus the most that can be
+    summarized in one call, or reach what the summary already covers.
+    """
+    covered_until = (summary_state or {}).get('covered_until')
+    wanted = _recent_budget(budget) + SUMMARY_MAX_INPUT_TOKENS
+    messages, tokens, before = [], 0, None
+    while True:
+        page, before = fetch_page(before)
+        messages = page + messages
+        tokens += sum(estimate_tokens(m['content']) for m in page)
+        if before is None or tokens >= wanted or (page and _is_summarized(page[0], covered_until)):
+            return messages
+
+
+def build_context(messages, summary_state=None, summarize=None, budget=CONTEXT_TOKEN_BUDGET):
+    """Returns (history, new_summary_state) for messages sorted oldest first.
+
+    summary_state is the chat's stored {'text', 'covered_until'} (or None), and
+    summarize(previous_text, messages) returns an extended summary text. The
+    returned state is the input object itself unless the summary was extended.
+    """
+    state = summary_state or {}
+    covered_until = state.get('covered_until')
+
+    recent_budget = _recent_budget(budget)
+    used = 0
+    split = len(messages)
+    while split > 0:
+        cost = estimate_tokens(messages[split - 1]['content'])
+        if used + cost > recent_budget:
+            break
+        used += cost
+        split -= 1
+    recent = messages[split:]
+
+    # Aged out of the window but not yet in the summary, newest first up to
+    # what one summarizer call takes
+    pending, pending_tokens = [], 0
+    for m in reversed(messages[:split]):
+        if _is_summarized(m, covered_until):
+            break
+        cost = estimate_tokens(m['content'])
+        if pending_tokens + cost > SUMMARY_MAX_INPUT_TOKENS:
+            break
+        pending_tokens += cost
+        pending.append(m)
+    pending.reverse()
+
+    new_state = summary_state
+    if pending and pending_tokens > SUMMARY_BATCH_TOKENS and summarize is not None:
+        try:
+            text = summarize(state.get('text', ''), pending)
+            new_state = {
+                'text': text,
+                'covered_until': max(
+                    (m['timestamp'] for m in pending if isinstance(m.get('timestamp'), datetime.datetime)),
+                    default=covered_until,
+                ),
+            }
+            pending = []
+        except Exception:
+            pass  # Keep the old summary; the oldest pending turns are dropped below
+
+    # Whatever is still pending rides along verbatim, newest first, within the slack
+    carried, used = [], 0
+    for m in reversed(pending):
+        cost = estimate_tokens(m['content'])
+        if used + cost > SUMMARY_BATCH_TOKENS:
+            break
+        used += cost
+        carried.append(m)
+    carried.reverse()
+
+    turns = []
+    if new_state and new_state.get('text'):
+        turns.append({'is_ai': False, 'content': f"Summary of the earlier conversation:\n{new_state['text']}"})
+        turns.append({'is_ai': True, 'content': "Understood, I'll keep that in mind."})
+    return _to_history(turns + carried + recent), new_state
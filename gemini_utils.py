@@ -1,6 +1,57 @@
+import queue
+import random
+import threading
+import time
+
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.api_core import exceptions as api_exceptions
 from database import get_db_connection
 
+DEFAULT_MODEL = 'gemini-flash-latest'
+MODEL_IDLE_TTL = 15 * 60  # seconds an unused (key, model) pair is kept
+
+# Call deadlines and retries. A reply either starts within FIRST_TOKEN_TIMEOUT
+# or the attempt is abandoned; a second (hedged) attempt is started if the
+# first is still silent after HEDGE_DELAY; nothing runs past CALL_DEADLINE.
+ATTEMPT_TIMEOUT = 30  # seconds, passed to the API as the RPC deadline
+FIRST_TOKEN_TIMEOUT = 15
+HEDGE_DELAY = 5
+CALL_DEADLINE = 60
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 0.5  # seconds; doubled per retry, full jitter
+BACKOFF_MAX = 8
+BREAKER_THRESHOLD = 3  # consecutive failures that open a key's circuit
+BREAKER_COOLDOWN = 30  # seconds before an open circuit lets a trial call through
+
+_RETRYABLE = (
+    api_exceptions.ResourceExhausted,
+    api_exceptions.TooManyRequests,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.InternalServerError,
+    api_exceptions.Aborted,
+    api_exceptions.PermissionDenied,
+    api_exceptions.Unauthenticated,
+    TimeoutError,
+)
+# Errors about the key rather than the request: the next attempt tries the
+# other key first, or the same key again after the backoff if there is no other
+_KEY_ERRORS = (
+    api_exceptions.ResourceExhausted,
+    api_exceptions.TooManyRequests,
+    api_exceptions.PermissionDenied,
+    api_exceptions.Unauthenticated,
+)
+# Of those, the ones that take a key out of rotation straight away. A throttled
+# key only opens its circuit after BREAKER_THRESHOLD failures, since a single
+# 429 usually passes within the backoff.
+_KEY_REJECTED = (
+    api_exceptions.PermissionDenied,
+    api_exceptions.Unauthenticated,
+)
+
 def get_system_api_key():
     conn = get_db_connection()
     c = conn.cursor()
@@ -12,18 +63,473 @@ def get_system_api_key():
 def configure_gemini(api_key):
     genai.configure(api_key=api_key)
 
-def get_gemini_response(prompt, history=[], api_key=None):
+def make_generative_client(api_key):
+    # A client bound to one key, independent of genai.configure's global state
+    return glm.GenerativeServiceClient(client_options={'api_key': api_key})
+
+class GeminiModelRegistry:
+    # Thread-safe pool of GenerativeModel objects keyed by (api key, model name).
+    # Each key gets its own service client, so concurrent sessions using
+    # different personal keys never race on genai.configure. Entries are built
+    # on first use, reused across requests and dropped after MODEL_IDLE_TTL
+    # seconds without use. Pass client_factory to swap in a stub transport.
+
+    def __init__(self, client_factory=make_generative_client, idle_ttl=MODEL_IDLE_TTL):
+        self.client_factory = client_factory
+        self.idle_ttl = idle_ttl
+        self._clients = {}  # api key -> client
+        self._models = {}  # (api key, model name) -> model
+        self._last_used = {}  # (api key, model name) -> monotonic time
+        self._lock = threading.Lock()
+
+    def get_model(self, api_key, model_name=DEFAULT_MODEL):
+        key = (api_key, model_name)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            model = self._models.get(key)
+            if model is None:
+                client = self._clients.get(api_key)
+                if client is None:
+                    client = self.client_factory(api_key)
+                    self._clients[api_key] = client
+                model = genai.GenerativeModel(model_name)
+                model._client = client
+                self._models[key] = model
+            self._last_used[key] = now
+            return model
+
+    def evict(self, api_key):
+        with self._lock:
+            for key in [k for k in self._models if k[0] == api_key]:
+                self._drop(key)
+            self._clients.pop(api_key, None)
+
+    def size(self):
+        with self._lock:
+            return len(self._models)
+
+    def _evict_idle(self, now):
+        for key, last_used in list(self._last_used.items()):
+            if now - last_used > self.idle_ttl:
+                self._drop(key)
+        # Drop clients no remaining model uses
+        in_use = {k[0] for k in self._models}
+        for api_key in [k for k in self._clients if k not in in_use]:
+            del self._clients[api_key]
+
+    def _drop(self, key):
+        self._models.pop(key, None)
+        self._last_used.pop(key, None)
+
+model_registry = GeminiModelRegistry()
+
+class CircuitBreaker:
+    # Per-key circuit: closed while calls succeed, open for BREAKER_COOLDOWN
+    # seconds after BREAKER_THRESHOLD failures in a row (or at once when the
+    # key is rejected), then half-open: one trial call decides whether it
+    # closes again.
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at < self.cooldown:
+            return 'open'
+        return 'half_open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def release(self):
+        # An abandoned call proves nothing either way
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_failure(self, rejected=False):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if rejected or self.failures >= self.threshold or self.opened_at is not None:
+                self.opened_at = self.clock()
+
+_breakers = {}  # api key -> CircuitBreaker
+_breakers_lock = threading.Lock()
+
+def get_breaker(api_key):
+    with _breakers_lock:
+        breaker = _breakers.get(api_key)
+        if breaker is None:
+            breaker = _breakers[api_key] = CircuitBreaker()
+        return breaker
+
+def key_health():
+    # Circuit state per key, with the keys masked, for the admin panel
+    with _breakers_lock:
+        items = list(_breakers.items())
+    return [{'key': f"…{k[-4:]}", 'state': b.state, 'failures': b.failures} for k, b in items]
+
+def _is_retryable(error):
+    return isinstance(error, _RETRYABLE)
+
+def _record_failure(api_key, error):
+    # Bad requests say nothing about the key's health, but they still end the
+    # call, so a half-open trial slot must be handed back
+    if _is_retryable(error):
+        get_breaker(api_key).record_failure(rejected=isinstance(error, _KEY_REJECTED))
+    else:
+        get_breaker(api_key).release()
+
+def _backoff(retry):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** retry))
+
+class KeySlots:
+    # Charges a call's attempts to key_limiter (an object with
+    # acquire(key, slot=True) -> bool and release(key), like AIJobQueue), so
+    # retries, hedges and failover stay inside every key's concurrency and
+    # rate limits. The caller already holds a slot and a token for its own
+    # key (the AI job's): the first attempt on that key uses both, later ones
+    # reuse the slot once it is free but pay a token each, and any attempt
+    # beside them takes a slot of its own. take() returns a handle to give
+    # back once the attempt has stopped, or None if the key is at its limit.
+    # One KeySlots can be shared by the calls a job makes, so they are all
+    # charged to the same job.
+
+    def __init__(self, key_limiter, own_key):
+        self.key_limiter = key_limiter
+        self.own_key = own_key
+        self.own_free = True
+        self.prepaid = True
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        if self.key_limiter is None:
+            return (key, False)
+        with self._lock:
+            if key == self.own_key and self.own_free:
+                if not self.prepaid and not self.key_limiter.acquire(key, slot=False):
+                    return None
+                self.own_free = self.prepaid = False
+                return (key, True)
+        if not self.key_limiter.acquire(key):
+            return None
+        return (key, False)
+
+    def give_back(self, handle):
+        key, own = handle
+        if self.key_limiter is None:
+            return
+        if own:
+            with self._lock:
+                self.own_free = True
+        else:
+            self.key_limiter.release(key)
+
+def _pick_key(keys, slots, avoid=()):
+    # (key, slot handle) for the next attempt, or None. Earlier keys are
+    # preferred (personal before system); a key whose circuit is open is
+    # skipped until its cooldown lets a trial through, and one at its
+    # limiter's limits is skipped for now
+    for key in [k for k in keys if k not in avoid] + [k for k in keys if k in avoid]:
+        breaker = get_breaker(key)
+        if not breaker.allow():
+            continue
+        handle = slots.take(key)
+        if handle is None:
+            breaker.release()
+            continue
+        return key, handle
+    return None
+
+def _candidate_keys(api_key, fallback_key):
+    return [k for i, k in enumerate((api_key, fallback_key)) if k and k not in (api_key, fallback_key)[:i]]
+
+def _close_stream(response):
+    # Cancels the RPC behind a streaming response (gRPC and REST streams both
+    # have cancel()), so an abandoned attempt does not run on to its next chunk
+    stream = getattr(response, '_iterator', response)
+    close = getattr(stream, 'cancel', None) or getattr(stream, 'close', None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception:
+        pass
+
+class _Attempt:
+    # One streaming call on its own thread, reporting through `events`.
+    # cancel() stops it and closes its stream; its limiter slot goes back,
+    # and an unsettled half-open trial is released, only once the thread has
+    # actually finished. settle() marks the outcome as recorded, by whichever
+    # side gets there first.
+
+    def __init__(self, number, key, handle, slots, started_at):
+        self.number = number
+        self.key = key
+        self.handle = handle
+        self.slots = slots
+        self.started_at = started_at
+        self.cancelled = threading.Event()
+        self.response = None
+        self.settled = False
+        self._lock = threading.Lock()
+
+    def settle(self):
+        with self._lock:
+            first = not self.settled
+            self.settled = True
+            return first
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.response is not None:
+            _close_stream(self.response)
+
+    def run(self, model_name, prompt, history, events):
+        try:
+            model = model_registry.get_model(self.key, model_name)
+            self.response = model.start_chat(history=history).send_message(
+                prompt, stream=True, request_options={'timeout': ATTEMPT_TIMEOUT})
+            if self.cancelled.is_set():
+                _close_stream(self.response)  # cancelled while starting
+            for chunk in self.response:
+                if self.cancelled.is_set():
+                    return
+                if chunk.text:
+                    events.put((self.number, 'chunk', chunk.text))
+            events.put((self.number, 'done', None))
+        except Exception as e:
+            events.put((self.number, 'error', e))
+        finally:
+            if self.cancelled.is_set() and self.settle():
+                get_breaker(self.key).release()
+            self.slots.give_back(self.handle)
+
+def stream_gemini_response(prompt, history=[], api_key=None, model_name=DEFAULT_MODEL, fallback_key=None, status=None,
+                           key_limiter=None, slots=None):
+    # Yields the answer text chunk by chunk as Gemini produces it. Errors are
+    # yielded as text too, so the caller always ends up with a message to save;
+    # pass a dict as `status` and its 'complete' entry is set to True only once
+    # the whole answer has arrived.
+    #
+    # Until the first chunk arrives the call can be retried freely: silent
+    # attempts are hedged and then abandoned, retryable errors are retried
+    # with backoff, and a throttled or failing key hands over to fallback_key.
+    # Every attempt is charged to key_limiter (or to the job's shared
+    # `slots`, see KeySlots). Once text has been yielded the winning attempt
+    # is followed to the end.
+    if status is None:
+        status = {}
+    status['complete'] = False
+    keys = _candidate_keys(api_key, fallback_key)
+    if not keys:
+        yield "Error: No API Key provided."
+        return
+    yield from _stream_response(prompt, history, keys, model_name, status, slots or KeySlots(key_limiter, keys[0]))
+
+def _stream_response(prompt, history, keys, model_name, status, slots):
+
+    events = queue.Queue()
+    deadline = time.monotonic() + CALL_DEADLINE
+    in_flight = {}  # attempt number -> _Attempt
+    launches = 0
+    launch_at = time.monotonic()
+    last_error = None
+    avoid = set()  # a key that just failed is tried last on the next launch
+    winner = None
+    first_chunk = ""
+
+    try:
+        while winner is None:
+            now = time.monotonic()
+            if now >= deadline:
+                last_error = last_error or TimeoutError("no reply within the call deadline")
+                break
+
+            # Silent attempts past the first-token deadline count as failures
+            for number, attempt in list(in_flight.items()):
+                if now - attempt.started_at >= FIRST_TOKEN_TIMEOUT:
+                    del in_flight[number]
+                    last_error = TimeoutError(f"no reply within {FIRST_TOKEN_TIMEOUT}s")
+                    if attempt.settle():
+                        _record_failure(attempt.key, last_error)
+                    attempt.cancel()
+                    if not in_flight:
+                        launch_at = now
+
+            if launch_at is not None and now >= launch_at and launches < MAX_ATTEMPTS:
+                picked = _pick_key(keys, slots, avoid={a.key for a in in_flight.values()} | avoid)
+                if picked is None:
+                    launch_at = None
+                    if not in_flight:
+                        last_error = last_error or RuntimeError("no API key is available right now (paused after failures or at its rate limit)")
+                        break
+                else:
+                    attempt = _Attempt(launches, *picked, slots, now)
+                    in_flight[launches] = attempt
+                    threading.Thread(target=attempt.run, args=(model_name, prompt, history, events),
+                                     name=f"gemini-attempt-{launches}", daemon=True).start()
+                    launches += 1
+                    # One hedge while the first attempt is outstanding
+                    launch_at = now + HEDGE_DELAY if len(in_flight) == 1 else None
+
+            if not in_flight and (launch_at is None or launches >= MAX_ATTEMPTS):
+                break
+
+            wake_at = min([deadline] + [a.started_at + FIRST_TOKEN_TIMEOUT for a in in_flight.values()]
+                          + ([launch_at] if launch_at is not None and launches < MAX_ATTEMPTS else []))
+            try:
+                number, kind, value = events.get(timeout=max(0.0, wake_at - now))
+            except queue.Empty:
+                continue
+            attempt = in_flight.get(number)
+            if attempt is None:
+                continue # abandoned attempt
+
+            if kind == 'error':
+                del in_flight[number]
+                last_error = value
+                attempt.settle()
+                _record_failure(attempt.key, value)
+                avoid = {attempt.key} if isinstance(value, _KEY_ERRORS) else set()
+                if not _is_retryable(value):
+                    if not in_flight:
+                        break
+                elif not in_flight:
+                    launch_at = time.monotonic() + _backoff(launches - 1)
+                continue
+
+            winner = attempt
+            attempt.settle()
+            get_breaker(attempt.key).record_success()
+            first_chunk = value if kind == 'chunk' else ""
+            for other in in_flight.values():
+                if other is not winner:
+                    other.cancel()
+            in_flight = {number: winner}
+            if kind == 'done':
+                del in_flight[number]
+                status['complete'] = True
+                return
+
+        if winner is None:
+            yield f"Error calling Gemini API: {last_error}"
+            return
+
+        yield first_chunk
+        while True:
+            try:
+                number, kind, value = events.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                yield "\n\n_(reply cut off: Gemini took too long)_"
+                return
+            if number != winner.number:
+                continue
+            if kind == 'chunk':
+                yield value
+            elif kind == 'done':
+                del in_flight[number]
+                status['complete'] = True
+                return
+            else:
+                del in_flight[number]
+                yield f"\n\n_(reply interrupted: {value})_"
+                return
+    finally:
+        # Abandoned, cut off or dropped by the caller: stop whatever still runs
+        for attempt in in_flight.values():
+            attempt.cancel()
+
+def call_gemini(call, api_key, fallback_key=None, model_name=DEFAULT_MODEL, key_limiter=None, slots=None):
+    # call(model) makes one blocking request and returns its result. Retries
+    # retryable errors with backoff, fails over between keys (every attempt
+    # charged to key_limiter or the job's shared `slots`, see KeySlots) and
+    # raises the last error once MAX_ATTEMPTS or CALL_DEADLINE is used up.
+    keys = _candidate_keys(api_key, fallback_key)
+    if not keys:
+        raise ValueError("No API Key provided.")
+    return _call_with_retries(call, keys, model_name, slots or KeySlots(key_limiter, keys[0]))
+
+def _call_with_retries(call, keys, model_name, slots):
+    deadline = time.monotonic() + CALL_DEADLINE
+    last_error = None
+    avoid = ()
+    for attempt in range(MAX_ATTEMPTS):
+        picked = _pick_key(keys, slots, avoid)
+        if picked is None:
+            raise last_error or RuntimeError("no API key is available right now (paused after failures or at its rate limit)")
+        key, handle = picked
+        try:
+            result = call(model_registry.get_model(key, model_name))
+        except Exception as e:
+            slots.give_back(handle)
+            last_error = e
+            _record_failure(key, e)
+            if not _is_retryable(e):
+                raise
+            avoid = {key} if isinstance(e, _KEY_ERRORS) else ()
+            pause = _backoff(attempt)
+            if time.monotonic() + pause >= deadline:
+                break
+            time.sleep(pause)
+            continue
+        slots.give_back(handle)
+        get_breaker(key).record_success()
+        return result
+    raise last_error
+
+def summarize_conversation(previous_summary, messages, api_key, model_name=DEFAULT_MODEL, fallback_key=None,
+                           key_limiter=None, slots=None):
+    # Extends a rolling chat summary with newly aged-out messages. Raises on
+    # failure so the caller can keep the previous summary.
+    transcript = "\n".join(f"{m['sender_name']}: {m['content']}" for m in messages)
+    prompt = (
+        "You maintain a running summary of a group chat for an AI assistant.\n"
+        "Extend the summary below with the new messages. Keep names, decisions, "
+        "open questions and facts; stay under 300 words.\n\n"
+        f"Current summary:\n{previous_summary or '(none)'}\n\n"
+        f"New messages:\n{transcript}"
+    )
+    return call_gemini(
+        lambda model: model.generate_content(prompt, request_options={'timeout': ATTEMPT_TIMEOUT}).text,
+        api_key, fallback_key, model_name, key_limiter, slots)
+
+def get_gemini_response(prompt, history=[], api_key=None, model_name=DEFAULT_MODEL, fallback_key=None):
     if not api_key:
         return "Error: No API Key provided."
-    
+
     try:
-        configure_gemini(api_key)
-        model = genai.GenerativeModel('gemini-flash-latest')
-        
         # Convert internal history format to Gemini history format if needed
         # For now, we'll just send the prompt as a simple request or build a chat session
-        chat = model.start_chat(history=history)
-        response = chat.send_message(prompt)
-        return response.text
+        return call_gemini(
+            lambda model: model.start_chat(history=history).send_message(
+                prompt, request_options={'timeout': ATTEMPT_TIMEOUT}).text,
+            api_key, fallback_key, model_name)
     except Exception as e:
         return f"Error calling Gemini API: {str(e)}"
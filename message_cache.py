@@ -0,0 +1,186 @@
+import datetime
+import threading
+from collections import OrderedDict
+
+# Process-wide cache of chat messages, shared by every Streamlit session.
+#
+# Entries are keyed by chat id and evicted least-recently-used once the
+# estimated size of all cached messages exceeds the memory budget. Writes made
+# through firebase_db update the cache in place (write-through), and chats with
+# an active snapshot listener are marked "live" so readers can trust them
+# without going back to Firestore. An entry seeded only from a listener's
+# newest-message window is marked incomplete until the full chat is loaded or
+# older pages fetched through firebase_db have reached back to its start.
+
+MESSAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_MESSAGE_OVERHEAD_BYTES = 256  # dict, id and field bookkeeping per message
+
+
+def message_sort_key(msg):
+    val = msg.get('timestamp')
+    if val is None:
+        return datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+    return val
+
+
+def estimate_message_size(msg):
+    size = _MESSAGE_OVERHEAD_BYTES
+    for value in msg.values():
+        if isinstance(value, str):
+            size += len(value)
+    return size
+
+
+class CachedChat:
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.messages = {}  # message id -> message dict
+        self.cursor = None  # newest server timestamp seen
+        self.size = 0
+        self.live = False  # kept current by a snapshot listener
+        self.complete = True  # holds the whole chat, not just its newest window
+        self._sorted = None
+
+    def sorted_messages(self):
+        if self._sorted is None:
+            self._sorted = sorted(self.messages.values(), key=message_sort_key)
+        return self._sorted
+
+    def upsert(self, msg, from_server=True):
+        old = self.messages.get(msg['id'])
+        if old is not None:
+            self.size -= estimate_message_size(old)
+        self.messages[msg['id']] = msg
+        self.size += estimate_message_size(msg)
+        self._sorted = None
+        # Only server-assigned timestamps may move the cursor; a provisional
+        # local timestamp could skip messages committed in between.
+        ts = msg.get('timestamp')
+        if from_server and isinstance(ts, datetime.datetime):
+            if self.cursor is None or ts > self.cursor:
+                self.cursor = ts
+
+
+class MessageCache:
+    def __init__(self, max_bytes=MESSAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._chats = OrderedDict()  # chat id -> CachedChat, LRU first
+        self._chat_of_message = {}  # message id -> chat id
+        self._size = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, chat_id):
+        with self._lock:
+            entry = self._chats.get(chat_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._chats.move_to_end(chat_id)
+            return entry
+
+    def put(self, chat_id, messages, live=None, complete=True):
+        # Replace a chat's messages; returns them sorted. live=None keeps the
+        # current listener state of the chat.
+        with self._lock:
+            previous = self._chats.get(chat_id)
+            if live is None:
+                live = previous.live if previous is not None else False
+            self._drop(chat_id)
+            entry = CachedChat(chat_id)
+            entry.live = live
+            entry.complete = complete
+            for msg in messages:
+                entry.upsert(msg)
+                self._chat_of_message[msg['id']] = chat_id
+            self._chats[chat_id] = entry
+            self._size += entry.size
+            self._evict()
+            return list(entry.sorted_messages())
+
+    def merge(self, chat_id, messages, from_server=True):
+        # Upsert messages into a cached chat; returns None if it is not cached
+        with self._lock:
+            entry = self._chats.get(chat_id)
+            if entry is None:
+                return None
+            before = entry.size
+            for msg in messages:
+                entry.upsert(msg, from_server=from_server)
+                self._chat_of_message[msg['id']] = chat_id
+            self._size += entry.size - before
+            self._chats.move_to_end(chat_id)
+            self._evict()
+            return list(entry.sorted_messages())
+
+    def extend(self, chat_id, older, reached_start=False):
+        # Adds a page of older history to a live chat that holds only its
+        # newest window. The page must reach up to the window's oldest message
+        # so no gap opens up; once it reaches the start of the chat the entry
+        # is complete.
+        with self._lock:
+            entry = self._chats.get(chat_id)
+            if entry is None or entry.complete or not entry.live:
+                return
+            before = entry.size
+            for msg in older:
+                entry.upsert(msg)
+                self._chat_of_message[msg['id']] = chat_id
+            entry.complete = reached_start
+            self._size += entry.size - before
+            self._evict()
+
+    def update_message(self, msg_id, **fields):
+        with self._lock:
+            entry = self._chats.get(self._chat_of_message.get(msg_id))
+            if entry is None or msg_id not in entry.messages:
+                return
+            msg = dict(entry.messages[msg_id])
+            msg.update(fields)
+            before = entry.size
+            entry.upsert(msg, from_server=False)
+            self._size += entry.size - before
+
+    def set_live(self, chat_id, live):
+        with self._lock:
+            entry = self._chats.get(chat_id)
+            if entry is not None:
+                entry.live = live
+
+    def invalidate(self, chat_id):
+        with self._lock:
+            self._drop(chat_id)
+
+    def clear(self):
+        with self._lock:
+            for chat_id in list(self._chats):
+                self._drop(chat_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'chats': len(self._chats),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _drop(self, chat_id):
+        entry = self._chats.pop(chat_id, None)
+        if entry is None:
+            return
+        self._size -= entry.size
+        for msg_id in entry.messages:
+            self._chat_of_message.pop(msg_id, None)
+
+    def _evict(self):
+        # Always keep the most recently used chat, even if it alone is over budget
+        while self._size > self.max_bytes and len(self._chats) > 1:
+            chat_id = next(iter(self._chats))
+            self._drop(chat_id)
+            self.evictions += 1
@@ -0,0 +1,95 @@
+import datetime
+import html
+import re
+import threading
+from collections import OrderedDict
+
+# HTML rendering for chat messages.
+#
+# A message's HTML depends only on its content, its display status and who is
+# looking (their own messages are right-aligned), so rendered fragments are
+# cached process-wide under (message id, version, viewer role). A rerun then
+# only formats messages that are new or changed; everything else is a dict
+# lookup.
+
+FRAGMENT_CACHE_MAX_ENTRIES = 5000
+
+MENTION_RE = re.compile(r'(@\w+)')
+
+_MESSAGE_CLASS = {'ai': 'ai-message', 'me': 'user-message', 'other': 'other-message'}
+_ALIGN_STYLE = {'ai': 'align-items: flex-start;', 'me': 'align-items: flex-end;', 'other': 'align-items: flex-start;'}
+
+
+def viewer_role(msg, viewer_id):
+    if msg['is_ai']:
+        return 'ai'
+    return 'me' if msg['sender_id'] == viewer_id else 'other'
+
+
+def status_text(msg):
+    # What goes in the timestamp slot
+    if msg.get('failed'):
+        return "not sent ⚠️"
+    if msg.get('queued'):
+        return "queued…"
+    if msg.get('pending') and msg['is_ai']:
+        return "thinking…"
+    if msg.get('pending'):
+        return "sending…"
+    if msg.get('is_streaming'):
+        return "typing…"
+    ts = msg['timestamp']
+    if isinstance(ts, datetime.datetime):
+        return ts.strftime("%H:%M")
+    return ""
+
+
+def render_message_html(msg, role):
+    # User text is escaped first, so stray markup (an unclosed tag, "<!--")
+    # cannot spill out of the message bubble
+    content = MENTION_RE.sub(r'<span class="mention">\1</span>', html.escape(msg['content']))
+    sender_name = html.escape(msg['sender_name'])
+    star = " ★" if msg.get('is_important') else ""
+    return f"""
+        <div style="display: flex; flex-direction: column; {_ALIGN_STYLE[role]} width: 100%;">
+            <div class="chat-message {_MESSAGE_CLASS[role]}">
+                <div class="sender-name">{sender_name}</div>
+                <div class="message-content">{content}</div>
+                <div class="timestamp">{status_text(msg)}{star}</div>
+            </div>
+        </div>
+    """
+
+
+class FragmentCache:
+    def __init__(self, max_entries=FRAGMENT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (id, version, role) -> html, LRU first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, msg, viewer_id):
+        role = viewer_role(msg, viewer_id)
+        # str hashes are cached, so keying on the content itself stays cheap
+        version = (msg['content'], msg['timestamp'], msg.get('is_important', False),
+                   msg.get('pending', False), msg.get('queued', False), msg.get('is_streaming', False),
+                   msg.get('failed', False))
+        key = (msg['id'], version, role)
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return html
+        html = render_message_html(msg, role)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = html
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,286 @@
+import datetime
+import threading
+import time
+import uuid
+
+from database import OUTBOX_DB_NAME, init_outbox_db, get_db_connection
+
+# Write-behind outbox for outgoing chat messages.
+#
+# Sending a message only appends it to a local SQLite (WAL) queue, which takes
+# local-disk time; the UI shows it optimistically straight away. A background
+# worker flushes queued messages to Firestore in batches and retries failures
+# with exponential backoff, so short Firestore slowdowns delay delivery but
+# never lose messages. Rows are only deleted once Firestore has accepted them,
+# and anything left over from a previous run is sent on startup.
+#
+# Each message gets its Firestore document id up front, so a retried flush
+# overwrites rather than duplicates. A batch carries at most one message per
+# chat: messages in one commit share a server timestamp, which would make
+# their order ambiguous.
+#
+# When a batch fails its messages are retried one at a time, and a message
+# that has failed before is always sent on its own, so one message Firestore
+# will never accept (too large, too many mentions) cannot hold back others.
+# After MAX_ATTEMPTS it moves to the outbox_failed table, which unblocks its
+# chat; it is shown as not sent until retry_failed() queues it again.
+#
+# Several processes on one machine may share the file (OUTBOX_DB_PATH points
+# them at it). A worker claims each row with a conditional UPDATE before
+# sending it, so only one of them sends a given message; a chat whose oldest
+# message is claimed elsewhere is left alone. A claim held longer than
+# CLAIM_TIMEOUT, by a worker that died mid-send, can be taken over; the
+# message id fixed at enqueue time makes that resend an overwrite.
+
+OUTBOX_DB_PATH_ENV = "OUTBOX_DB_PATH"
+FLUSH_INTERVAL = 0.25  # seconds between queue checks when idle
+BATCH_SIZE = 20  # messages per Firestore commit
+MAX_BACKOFF = 60  # seconds
+MAX_ATTEMPTS = 10  # failed sends before a message is set aside as failed
+CLAIM_TIMEOUT = 120  # seconds before another worker may take over a claimed row
+
+
+def _connect(db_name):
+    conn = get_db_connection(db_name)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _backoff(attempts):
+    return min(2 ** attempts, MAX_BACKOFF)
+
+
+def _row_to_message(row):
+    return {
+        'id': row['msg_id'],
+        'chat_id': row['chat_id'],
+        'sender_id': row['sender_id'],
+        'sender_name': row['sender_name'],
+        'content': row['content'],
+        'is_ai': bool(row['is_ai']),
+        'is_important': bool(row['is_important']),
+        'timestamp': datetime.datetime.fromisoformat(row['created_at']),
+        'pending': True,
+    }
+
+
+class Outbox:
+    def __init__(self, flush, db_name=OUTBOX_DB_NAME, start=True):
+        # flush(messages) writes a list of message dicts to Firestore and
+        # raises on failure
+        self.flush = flush
+        self.db_name = db_name
+        self.worker_id = uuid.uuid4().hex  # owner of this outbox's claims
+        init_outbox_db(db_name)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._worker = None
+        if start:
+            self.start()
+
+    def start(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._run, name="outbox-worker", daemon=True)
+        self._worker.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+    def enqueue(self, chat_id, sender_id, sender_name, content, is_ai=False, is_important=False):
+        """Queues a message and returns it as it should be shown optimistically."""
+        created_at = datetime.datetime.now(datetime.timezone.utc)
+        msg_id = uuid.uuid4().hex
+        conn = _connect(self.db_name)
+        conn.execute(
+            "INSERT INTO outbox (msg_id, chat_id, sender_id, sender_name, content, is_ai, is_important, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (msg_id, chat_id, sender_id, sender_name, content, is_ai, is_important, created_at.isoformat()),
+        )
+        conn.commit()
+        conn.close()
+        self._wake.set()
+        return {
+            'id': msg_id,
+            'chat_id': chat_id,
+            'sender_id': sender_id,
+            'sender_name': sender_name,
+            'content': content,
+            'is_ai': is_ai,
+            'is_important': is_important,
+            'timestamp': created_at,
+            'pending': True,
+        }
+
+    def pending(self, chat_id=None):
+        conn = _connect(self.db_name)
+        if chat_id is None:
+            rows = conn.execute("SELECT * FROM outbox ORDER BY seq").fetchall()
+        else:
+            rows = conn.execute("SELECT * FROM outbox WHERE chat_id = ? ORDER BY seq", (chat_id,)).fetchall()
+        conn.close()
+        return [_row_to_message(r) for r in rows]
+
+    def wait_for_message(self, msg_id, timeout=10):
+        # Blocks until a queued message has left the outbox, so a write made
+        # directly afterwards gets a later server timestamp. Returns 'sent',
+        # 'failed' (set aside after MAX_ATTEMPTS) or 'queued' if it is still
+        # waiting after `timeout` seconds.
+        deadline = time.monotonic() + timeout
+        while True:
+            conn = _connect(self.db_name)
+            queued = conn.execute("SELECT 1 FROM outbox WHERE msg_id = ?", (msg_id,)).fetchone()
+            failed = queued is None and conn.execute(
+                "SELECT 1 FROM outbox_failed WHERE msg_id = ?", (msg_id,)).fetchone()
+            conn.close()
+            if queued is None:
+                return 'failed' if failed else 'sent'
+            if time.monotonic() > deadline:
+                return 'queued'
+            self._wake.set()
+            time.sleep(0.05)
+
+    def failed(self, chat_id=None):
+        conn = _connect(self.db_name)
+        if chat_id is None:
+            rows = conn.execute("SELECT * FROM outbox_failed ORDER BY seq").fetchall()
+        else:
+            rows = conn.execute("SELECT * FROM outbox_failed WHERE chat_id = ? ORDER BY seq", (chat_id,)).fetchall()
+        conn.close()
+        return [dict(_row_to_message(r), pending=False, failed=True, last_error=r['last_error']) for r in rows]
+
+    def retry_failed(self, chat_id=None):
+        """Queues failed messages again; returns how many were requeued."""
+        conn = _connect(self.db_name)
+        where, args = ("WHERE chat_id = ?", (chat_id,)) if chat_id is not None else ("", ())
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute(
+            "INSERT INTO outbox (seq, msg_id, chat_id, sender_id, sender_name, content, is_ai, is_important, created_at) "
+            f"SELECT seq, msg_id, chat_id, sender_id, sender_name, content, is_ai, is_important, created_at "
+            f"FROM outbox_failed {where}", args)
+        conn.execute(f"DELETE FROM outbox_failed {where}", args)
+        conn.commit()
+        conn.close()
+        self._wake.set()
+        return cur.rowcount
+
+    def stats(self):
+        conn = _connect(self.db_name)
+        row = conn.execute("SELECT COUNT(*) AS queued, MAX(attempts) AS max_attempts FROM outbox").fetchone()
+        failed = conn.execute("SELECT COUNT(*) FROM outbox_failed").fetchone()[0]
+        conn.close()
+        return {'queued': row['queued'], 'max_attempts': row['max_attempts'] or 0, 'failed': failed}
+
+    # --- Worker ---
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                # Keep flushing while full batches are going out
+                while self.flush_due() == BATCH_SIZE and not self._stop.is_set():
+                    pass
+            except Exception:
+                # Never let a bad row or a local disk error kill the worker
+                time.sleep(FLUSH_INTERVAL)
+
+    def flush_due(self):
+        """Sends one batch of due messages; returns how many were sent."""
+        conn = _connect(self.db_name)
+        rows = conn.execute("SELECT * FROM outbox ORDER BY seq").fetchall()
+        now = time.time()
+
+        # Only the oldest queued message of each chat is eligible, so a chat
+        # whose head is backing off does not get later messages sent first.
+        batch, seen_chats = [], set()
+        for row in rows:
+            if row['chat_id'] in seen_chats:
+                continue
+            seen_chats.add(row['chat_id'])
+            claimable = row['claimed_by'] is None or row['claimed_at'] <= now - CLAIM_TIMEOUT
+            if row['next_attempt_at'] <= now and claimable:
+                batch.append(row)
+                if len(batch) == BATCH_SIZE:
+                    break
+
+        batch = self._claim(conn, batch, now)
+        if not batch:
+            conn.close()
+            return 0
+
+        # Messages that failed before go alone; the rest share one commit
+        fresh = [r for r in batch if r['attempts'] == 0]
+        singles = [r for r in batch if r['attempts'] > 0]
+        sent = 0
+        if fresh:
+            try:
+                self.flush([_row_to_message(r) for r in fresh])
+            except Exception as e:
+                if len(fresh) == 1:
+                    self._record_failure(conn, fresh[0], e, now)
+                else:
+                    singles = fresh + singles
+            else:
+                self._delete(conn, fresh)
+                sent += len(fresh)
+
+        failures_in_a_row = 0
+        for r in singles:
+            if failures_in_a_row >= 2:
+                # Looks like Firestore itself is failing: wait without
+                # counting an attempt against the remaining messages
+                conn.execute("UPDATE outbox SET next_attempt_at = ?, claimed_by = NULL WHERE seq = ?",
+                             (now + _backoff(r['attempts']), r['seq']))
+                continue
+            try:
+                self.flush([_row_to_message(r)])
+            except Exception as e:
+                failures_in_a_row += 1
+                self._record_failure(conn, r, e, now)
+            else:
+                failures_in_a_row = 0
+                self._delete(conn, [r])
+                sent += 1
+        conn.commit()
+        conn.close()
+        return sent
+
+    def _claim(self, conn, rows, now):
+        # Takes the rows for this worker and commits before anything is sent.
+        # Each UPDATE only matches a row nobody holds (or whose claim has
+        # expired), so of several workers that picked the same row, one wins.
+        claimed = []
+        for r in rows:
+            taken = conn.execute(
+                "UPDATE outbox SET claimed_by = ?, claimed_at = ? "
+                "WHERE seq = ? AND (claimed_by IS NULL OR claimed_at <= ?)",
+                (self.worker_id, now, r['seq'], now - CLAIM_TIMEOUT)).rowcount
+            if taken:
+                claimed.append(r)
+        conn.commit()
+        return claimed
+
+    @staticmethod
+    def _delete(conn, rows):
+        conn.executemany("DELETE FROM outbox WHERE seq = ?", [(r['seq'],) for r in rows])
+        conn.commit()
+
+    @staticmethod
+    def _record_failure(conn, row, error, now):
+        attempts = row['attempts'] + 1
+        if attempts >= MAX_ATTEMPTS:
+            conn.execute(
+                "INSERT OR REPLACE INTO outbox_failed (seq, msg_id, chat_id, sender_id, sender_name, content, is_ai, "
+                "is_important, created_at, attempts, last_error, failed_at) "
+                "SELECT seq, msg_id, chat_id, sender_id, sender_name, content, is_ai, is_important, created_at, ?, ?, ? "
+                "FROM outbox WHERE seq = ?",
+                (attempts, str(error), now, row['seq']))
+            conn.execute("DELETE FROM outbox WHERE seq = ?", (row['seq'],))
+        else:
+            conn.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ?, claimed_by = NULL WHERE seq = ?",
+                (attempts, now + _backoff(row['attempts']), str(error), row['seq']))
@@ -0,0 +1,229 @@
+import datetime
+import hashlib
+import os
+import threading
+import uuid
+
+from fpdf import FPDF
+from fpdf.fonts import fpdf_charwidths
+
+# On-demand PDF export of important messages.
+#
+# Exports are files under EXPORT_DIR named by a hash of the exported entries'
+# ids and versions, so asking again for an unchanged set is just a file
+# lookup. Large sets are built on a background thread; very large ones go
+# through StreamingPdfWriter, which writes each page to disk as soon as it is
+# full and so never holds the whole document (or all messages) in memory.
+
+EXPORT_DIR = "exports"
+BACKGROUND_EXPORT_THRESHOLD = 100  # messages; larger exports build off the script thread
+STREAMING_EXPORT_THRESHOLD = 1000  # messages; larger exports use the streaming writer
+EXPORT_CACHE_MAX_FILES = 50
+
+
+def export_key(versions):
+    # versions: (entry id, update time) pairs for everything being exported
+    digest = hashlib.sha256()
+    for entry_id, updated in sorted(versions, key=lambda v: v[0]):
+        digest.update(f"{entry_id}@{updated}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _latin1(text):
+    # The core PDF fonts only cover latin-1; anything else becomes '?'
+    return (text or '').encode('latin-1', 'replace').decode('latin-1')
+
+
+def _format_ts(ts):
+    if isinstance(ts, datetime.datetime):
+        return ts.strftime("%Y-%m-%d %H:%M:%S")
+    return str(ts)
+
+
+def build_pdf(messages):
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+    pdf.cell(200, 10, txt="Important Questions", ln=1, align='C')
+    pdf.ln(10)
+
+    for m in messages:
+        pdf.set_font("Arial", 'B', 10)
+        pdf.cell(0, 10, txt=f"[{_format_ts(m['timestamp'])}] {_latin1(m['sender_name'])}:", ln=1)
+        pdf.set_font("Arial", '', 10)
+        pdf.multi_cell(0, 10, txt=_latin1(m['content']))
+        pdf.ln(5)
+
+    return pdf.output(dest='S').encode('latin-1')
+
+
+class StreamingPdfWriter:
+    # Minimal PDF writer for plain text in the core Helvetica fonts. Pages are
+    # written out as they fill up; only object offsets stay in memory.
+
+    PAGE_WIDTH, PAGE_HEIGHT = 595.28, 841.89  # A4 in points
+    MARGIN = 28.35  # 1 cm
+    LINE_HEIGHT = 14
+
+    def __init__(self, fileobj):
+        self.f = fileobj
+        self.pos = 0
+        self.offsets = {}  # object number -> byte offset
+        self.pages = []  # page object numbers
+        self.next_obj = 5  # 1 catalog, 2 page tree, 3-4 fonts
+        self.lines = []
+        self.y = self.PAGE_HEIGHT - self.MARGIN
+        self._write(b"%PDF-1.3\n")
+        self._object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        self._object(4, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+
+    def _write(self, data):
+        self.f.write(data)
+        self.pos += len(data)
+
+    def _object(self, num, body):
+        self.offsets[num] = self.pos
+        self._write(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+
+    def _text_width(self, text, size, bold):
+        widths = fpdf_charwidths['helveticaB' if bold else 'helvetica']
+        return sum(widths.get(ch, 600) for ch in text) * size / 1000.0
+
+    def _wrap(self, text, size, bold):
+        max_width = self.PAGE_WIDTH - 2 * self.MARGIN
+        for paragraph in text.split('\n'):
+            line = ''
+            for word in paragraph.split(' '):
+                candidate = f"{line} {word}" if line else word
+                if self._text_width(candidate, size, bold) <= max_width:
+                    line = candidate
+                    continue
+                if line:
+                    yield line
+                # Break words longer than a whole line
+                while self._text_width(word, size, bold) > max_width:
+                    cut = len(word)
+                    while cut > 1 and self._text_width(word[:cut], size, bold) > max_width:
+                        cut -= 1
+                    yield word[:cut]
+                    word = word[cut:]
+                line = word
+            yield line
+
+    def add_text(self, text, size=10, bold=False, gap=0):
+        for line in self._wrap(_latin1(text), size, bold):
+            if self.y - self.LINE_HEIGHT < self.MARGIN:
+                self._flush_page()
+            self.y -= self.LINE_HEIGHT
+            escaped = line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            self.lines.append(f"BT /F{2 if bold else 1} {size} Tf {self.MARGIN:.2f} {self.y:.2f} Td ({escaped}) Tj ET")
+        self.y -= gap
+
+    def _flush_page(self):
+        if not self.lines:
+            return
+        content = "\n".join(self.lines).encode('latin-1')
+        content_num, page_num = self.next_obj, self.next_obj + 1
+        self.next_obj += 2
+        self._object(content_num, b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        self._object(page_num, (
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] "
+            "/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+            % (self.PAGE_WIDTH, self.PAGE_HEIGHT, content_num)).encode('latin-1'))
+        self.pages.append(page_num)
+        self.lines = []
+        self.y = self.PAGE_HEIGHT - self.MARGIN
+
+    def close(self):
+        self._flush_page()
+        kids = " ".join(f"{p} 0 R" for p in self.pages)
+        self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>".encode('latin-1'))
+        self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        xref_at = self.pos
+        count = self.next_obj
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % count)
+        for num in range(1, count):
+            self._write(b"%010d 00000 n \n" % self.offsets[num])
+        self._write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count, xref_at))
+
+
+def write_pdf_streaming(messages, fileobj):
+    # messages may be a generator; each one is written and then dropped
+    writer = StreamingPdfWriter(fileobj)
+    writer.add_text("Important Questions", size=12, bold=True, gap=14)
+    for m in messages:
+        writer.add_text(f"[{_format_ts(m['timestamp'])}] {m['sender_name']}:", bold=True)
+        writer.add_text(m['content'], gap=7)
+    writer.close()
+
+
+class PdfExporter:
+    def __init__(self, export_dir=EXPORT_DIR):
+        self.export_dir = export_dir
+        self._building = {}  # key -> None while running, or the error text
+        self._lock = threading.Lock()
+        os.makedirs(export_dir, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.export_dir, f"{key}.pdf")
+
+    def status(self, key):
+        # ('ready', path), ('building', None), ('failed', error) or ('missing', None)
+        path = self.path_for(key)
+        if os.path.exists(path):
+            return 'ready', path
+        with self._lock:
+            if key not in self._building:
+                return 'missing', None
+            error = self._building[key]
+        return ('failed', error) if error else ('building', None)
+
+    def request(self, key, count, load_messages):
+        """Returns the export's status, starting a build if there is no file for key yet.
+
+        load_messages() returns (or yields) the messages in export order; it
+        is only called when a build is needed.
+        """
+        status, result = self.status(key)
+        if status in ('ready', 'building'):
+            return status, result
+        with self._lock:
+            if self._building.get(key, 'missing') is None:
+                return 'building', None
+            self._building[key] = None
+        if count <= BACKGROUND_EXPORT_THRESHOLD:
+            self._build(key, count, load_messages)
+            return self.status(key)
+        threading.Thread(target=self._build, args=(key, count, load_messages),
+                         name="pdf-export", daemon=True).start()
+        return 'building', None
+
+    def _build(self, key, count, load_messages):
+        path = self.path_for(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                if count > STREAMING_EXPORT_THRESHOLD:
+                    write_pdf_streaming(load_messages(), f)
+                else:
+                    f.write(build_pdf(list(load_messages())))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                self._building[key] = str(e) or type(e).__name__
+            return
+        with self._lock:
+            self._building.pop(key, None)
+        self._prune()
+
+    def _prune(self):
+        # Keep the most recently built exports
+        files = [os.path.join(self.export_dir, name) for name in os.listdir(self.export_dir) if name.endswith('.pdf')]
+        files.sort(key=os.path.getmtime, reverse=True)
+        for stale in files[EXPORT_CACHE_MAX_FILES:]:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
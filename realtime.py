@@ -0,0 +1,243 @@
+import threading
+import time
+
+from message_cache import message_sort_key
+
+# Process-level Firestore listeners for open chats.
+#
+# One on_snapshot listener is held per chat that at least one session is
+# viewing. Every session viewing that chat reads from the same in-memory feed,
+# so Firestore streams each chat once per server process instead of once per
+# tab per poll. Each listener watches only the newest LIVE_WINDOW messages of
+# its chat, so opening a long chat does not stream its whole history; older
+# pages are fetched on demand. Viewers heartbeat on every read; a viewer that stops reading
+# (closed tab, switched chat) is dropped after VIEWER_TTL seconds and the
+# listener is closed when its last viewer is gone.
+#
+# The manager only needs a client exposing collection().where().on_snapshot(),
+# so it can be driven by a local fake or the Firestore emulator. When given a
+# MessageCache, every snapshot is mirrored into it (sharing the same message
+# dicts) and the chat is marked live for as long as the listener runs.
+#
+# A listener that fails to start, dies or stays silent puts its chat into
+# backoff: reads raise ListenerUnavailable straight away until the retry time
+# (doubling per failure, up to LISTENER_RETRY_MAX), so viewers poll through the
+# cache instead of each one restarting and waiting on a broken listener.
+
+LIVE_WINDOW = 200  # newest messages watched per chat
+VIEWER_TTL = 30  # seconds without a heartbeat before a viewer is dropped
+REAP_INTERVAL = 10  # seconds between idle-listener sweeps
+FIRST_SNAPSHOT_TIMEOUT = 5  # seconds to wait for the initial snapshot
+READY_POLL_INTERVAL = 0.1  # seconds between listener health checks while waiting
+LISTENER_RETRY_BASE = 5  # seconds before a failed listener is tried again; doubled per failure
+LISTENER_RETRY_MAX = 300
+
+
+class ListenerUnavailable(ConnectionError):
+    pass
+
+
+class ChatFeed:
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.messages = {}  # message id -> message dict
+        self.version = 0  # bumped on every applied snapshot
+        self.viewers = {}  # session id -> last heartbeat (monotonic)
+        self.callbacks = {}  # session id -> callable(changes), optional push
+        self.ready = threading.Event()
+        self.watch = None
+        self._sorted = []
+        self._sorted_version = -1
+
+    def sorted_messages(self):
+        # Cached per version so concurrent readers share one sort; treat the
+        # returned list as read-only.
+        if self._sorted_version != self.version:
+            self._sorted = sorted(self.messages.values(), key=message_sort_key)
+            self._sorted_version = self.version
+        return self._sorted
+
+
+class ChatSubscriptionManager:
+    def __init__(self, client, cache=None, window=LIVE_WINDOW, viewer_ttl=VIEWER_TTL, reap_interval=REAP_INTERVAL):
+        self.client = client
+        self.cache = cache
+        self.window = window  # None watches the whole chat
+        self.viewer_ttl = viewer_ttl
+        self.reap_interval = reap_interval
+        self._feeds = {}  # chat id -> ChatFeed
+        self._retry = {}  # chat id -> (failures in a row, monotonic time of the next try)
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._reaper = None
+
+    # --- Viewers ---
+    def subscribe(self, chat_id, session_id, callback=None):
+        """Registers (or heartbeats) a viewer and returns the chat's feed."""
+        with self._lock:
+            feed = self._feeds.get(chat_id)
+            if feed is None:
+                feed = ChatFeed(chat_id)
+                self._feeds[chat_id] = feed
+                try:
+                    self._start_listener(feed)
+                except Exception:
+                    self._feeds.pop(chat_id, None)
+                    raise
+            feed.viewers[session_id] = time.monotonic()
+            if callback is not None:
+                feed.callbacks[session_id] = callback
+            self._ensure_reaper()
+        return feed
+
+    def unsubscribe(self, chat_id, session_id):
+        with self._lock:
+            feed = self._feeds.get(chat_id)
+            if feed is None:
+                return
+            feed.viewers.pop(session_id, None)
+            feed.callbacks.pop(session_id, None)
+            if not feed.viewers:
+                self._close_feed(feed)
+
+    def get_messages(self, chat_id, session_id, timeout=FIRST_SNAPSHOT_TIMEOUT):
+        # Heartbeat + read. Waits briefly for the first snapshot so a freshly
+        # opened chat does not render empty. A listener that dies, before or
+        # after its first snapshot (e.g. a missing index), or that stays silent
+        # past the timeout is dropped and its chat put into backoff; the first
+        # read after the retry time starts a fresh one.
+        retry_in = self.retry_in(chat_id)
+        if retry_in:
+            raise ListenerUnavailable(f"Listener for chat {chat_id} failed; retrying in {retry_in:.0f}s")
+        try:
+            feed = self.subscribe(chat_id, session_id)
+        except Exception:
+            self._listener_failed(chat_id)
+            raise
+        deadline = time.monotonic() + timeout
+        while not feed.ready.wait(min(READY_POLL_INTERVAL, max(0.0, deadline - time.monotonic()))):
+            if not self._listener_alive(feed):
+                self._drop_feed(feed)
+                raise ListenerUnavailable(f"Listener for chat {chat_id} stopped before its first snapshot")
+            if time.monotonic() >= deadline:
+                self._drop_feed(feed)
+                raise TimeoutError(f"No snapshot for chat {chat_id} within {timeout}s")
+        with self._lock:
+            if not self._listener_alive(feed):
+                self._drop_feed(feed)
+                raise ListenerUnavailable(f"Listener for chat {chat_id} is no longer active")
+            self._retry.pop(chat_id, None)
+            return feed.sorted_messages(), feed.version
+
+    def retry_in(self, chat_id):
+        # Seconds until a failed listener for the chat may be started again (0: now)
+        with self._lock:
+            failures, retry_at = self._retry.get(chat_id, (0, 0))
+        return max(0.0, retry_at - time.monotonic())
+
+    def _listener_failed(self, chat_id):
+        with self._lock:
+            failures = self._retry.get(chat_id, (0, 0))[0] + 1
+            delay = min(LISTENER_RETRY_MAX, LISTENER_RETRY_BASE * 2 ** (failures - 1))
+            self._retry[chat_id] = (failures, time.monotonic() + delay)
+
+    @staticmethod
+    def _listener_alive(feed):
+        return feed.watch is None or getattr(feed.watch, 'is_active', True)
+
+    def _drop_feed(self, feed):
+        with self._lock:
+            # Another reader may already have replaced (or dropped) it
+            if self._feeds.get(feed.chat_id) is feed:
+                self._close_feed(feed)
+                self._listener_failed(feed.chat_id)
+
+    def has_older(self, chat_id):
+        # True when the chat may have messages older than the watched window
+        with self._lock:
+            feed = self._feeds.get(chat_id)
+            return feed is not None and self.window is not None and len(feed.messages) >= self.window
+
+    def active_chats(self):
+        with self._lock:
+            return {chat_id: len(feed.viewers) for chat_id, feed in self._feeds.items()}
+
+    def reap_idle(self):
+        cutoff = time.monotonic() - self.viewer_ttl
+        with self._lock:
+            for feed in list(self._feeds.values()):
+                for session_id, seen in list(feed.viewers.items()):
+                    if seen < cutoff:
+                        feed.viewers.pop(session_id, None)
+                        feed.callbacks.pop(session_id, None)
+                if not feed.viewers:
+                    self._close_feed(feed)
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            for feed in list(self._feeds.values()):
+                self._close_feed(feed)
+
+    # --- Listener plumbing ---
+    def _start_listener(self, feed):
+        query = self.client.collection('messages').where('chat_id', '==', feed.chat_id)
+        if self.window is not None:
+            # Needs a composite index on messages (chat_id ASC, timestamp DESC)
+            query = query.order_by('timestamp', direction='DESCENDING').limit(self.window)
+
+        def on_snapshot(docs, changes, read_time):
+            self._apply_changes(feed, changes)
+
+        feed.watch = query.on_snapshot(on_snapshot)
+
+    def _apply_changes(self, feed, changes):
+        with self._lock:
+            if self._feeds.get(feed.chat_id) is not feed:
+                return  # Feed was closed while the snapshot was in flight
+            upserts = []
+            for change in changes:
+                doc = change.document
+                if change.type.name == 'REMOVED':
+                    feed.messages.pop(doc.id, None)
+                else:
+                    msg = doc.to_dict()
+                    msg['id'] = doc.id
+                    feed.messages[doc.id] = msg
+                    upserts.append(msg)
+            feed.version += 1
+            if self.cache is not None:
+                # With a window, REMOVED usually means "scrolled out of the
+                # newest N" rather than deleted, so the cache keeps those.
+                if self.cache.merge(feed.chat_id, upserts) is None:
+                    self.cache.put(feed.chat_id, feed.sorted_messages(), complete=self.window is None)
+                self.cache.set_live(feed.chat_id, True)
+            callbacks = list(feed.callbacks.values())
+        feed.ready.set()
+        # Push outside the lock so slow consumers cannot stall the listener
+        for callback in callbacks:
+            try:
+                callback(changes)
+            except Exception:
+                pass
+
+    def _close_feed(self, feed):
+        self._feeds.pop(feed.chat_id, None)
+        if self.cache is not None:
+            self.cache.set_live(feed.chat_id, False)
+        if feed.watch is not None:
+            try:
+                feed.watch.unsubscribe()
+            except Exception:
+                pass
+            feed.watch = None
+
+    def _ensure_reaper(self):
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        self._reaper = threading.Thread(target=self._reap_loop, name="chat-feed-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        while not self._stop.wait(self.reap_interval):
+            self.reap_idle()
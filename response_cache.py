@@ -0,0 +1,127 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from database import RESPONSE_CACHE_DB_NAME, init_response_cache_db, get_db_connection
+
+# Opt-in cache of Gemini answers.
+#
+# Keys hash the model name, the normalized prompt and a scope naming the
+# conversation (for a chat: its id and the version of its rolling summary), so
+# a repeated question in the same chat is answered from memory without an API
+# call. The raw trailing turns are left out by default: once a question has
+# been answered they hold that very answer, so they would never match again.
+# Entries expire after a TTL and the in-memory tier is LRU-bounded; an optional
+# SQLite tier keeps answers across restarts and is shared by every process on
+# the machine.
+
+RESPONSE_CACHE_TTL = 24 * 3600  # seconds
+RESPONSE_CACHE_MAX_ENTRIES = 1000  # in-memory tier
+RESPONSE_CACHE_DISK_MAX_ENTRIES = 20000
+CACHE_CONTEXT_TURNS = 0  # trailing history turns that are part of the key
+
+_WHITESPACE = re.compile(r'\s+')
+_GEMINI_MENTION = re.compile(r'@gemini\b', re.IGNORECASE)
+
+
+def normalize_prompt(prompt):
+    # Case, spacing, the @Gemini trigger and trailing punctuation do not change the question
+    prompt = _GEMINI_MENTION.sub(' ', prompt)
+    prompt = _WHITESPACE.sub(' ', prompt).strip().lower()
+    return prompt.rstrip('?!. ')
+
+
+def make_cache_key(model_name, prompt, scope=None, history=(), context_turns=CACHE_CONTEXT_TURNS):
+    # History turns that are part of the key are normalized like the prompt
+    context = [{'role': turn['role'], 'parts': [normalize_prompt(part) for part in turn['parts']]}
+               for turn in history[-context_turns:]] if context_turns else []
+    payload = json.dumps([model_name, normalize_prompt(prompt), scope, context], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, db_name=RESPONSE_CACHE_DB_NAME, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        # db_name=None keeps the cache in memory only
+        self.db_name = db_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, response), LRU first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if db_name:
+            init_response_cache_db(db_name)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        row = self._disk_get(key, now)
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, row['response'], row['expires_at'])
+        return row['response']
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now + self.ttl)
+        if self.db_name:
+            conn = get_db_connection(self.db_name)
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, response, expires_at, last_used_at) VALUES (?, ?, ?, ?)",
+                (key, response, now + self.ttl, now),
+            )
+            # Expired rows go first, then the least recently used beyond the cap
+            conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache "
+                "ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (RESPONSE_CACHE_DISK_MAX_ENTRIES,),
+            )
+            conn.commit()
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def _remember(self, key, response, expires_at):
+        self._entries[key] = (expires_at, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        if not self.db_name:
+            return None
+        conn = get_db_connection(self.db_name)
+        row = conn.execute(
+            "SELECT response, expires_at FROM response_cache WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is not None:
+            conn.execute("UPDATE response_cache SET last_used_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+        conn.close()
+        return row
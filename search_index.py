@@ -0,0 +1,110 @@
+import datetime
+import re
+import threading
+
+from database import SEARCH_DB_NAME, init_search_db, get_db_connection
+
+# Full-text search over chat messages.
+#
+# Firestore has no text queries, so messages are mirrored into a local SQLite
+# FTS5 index as they are written (firebase_db feeds it from the save and
+# streaming paths). A search is one indexed MATCH ranked by BM25, restricted
+# to the chat ids the caller is allowed to see, and never touches Firestore.
+# Messages written before the index existed, or by another machine, are
+# picked up by backfill_search_index().
+
+SEARCH_RESULT_LIMIT = 20
+SNIPPET_TOKENS = 12
+CHAT_IDS_PER_QUERY = 500  # well under SQLite's bound-variable limit (999 on older builds)
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def to_match_query(text):
+    # User input becomes quoted terms (AND-ed), the last one as a prefix, so
+    # FTS5 operators typed by users are never interpreted
+    terms = _TOKEN.findall(text)
+    if not terms:
+        return None
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += '*'
+    return " ".join(quoted)
+
+
+class SearchIndex:
+    def __init__(self, db_name=SEARCH_DB_NAME):
+        self.db_name = db_name
+        self._write_lock = threading.Lock()  # one writer at a time in this process
+        init_search_db(db_name)
+
+    def add_messages(self, messages):
+        # Inserts or replaces messages (dicts with id, chat_id, sender_name,
+        # content, timestamp). Empty messages, like a streaming placeholder,
+        # are skipped until they have text.
+        rows = [m for m in messages if m.get('content')]
+        if not rows:
+            return
+        with self._write_lock:
+            conn = get_db_connection(self.db_name)
+            for m in rows:
+                old = conn.execute("SELECT fts_rowid FROM message_fts_ids WHERE msg_id = ?", (m['id'],)).fetchone()
+                if old is not None:
+                    conn.execute("DELETE FROM message_fts WHERE rowid = ?", (old['fts_rowid'],))
+                ts = m.get('timestamp')
+                cur = conn.execute(
+                    "INSERT INTO message_fts (content, sender_name, msg_id, chat_id, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    (m['content'], m.get('sender_name', ''), m['id'], m['chat_id'],
+                     ts.isoformat() if isinstance(ts, datetime.datetime) else None))
+                conn.execute(
+                    "INSERT OR REPLACE INTO message_fts_ids (msg_id, fts_rowid, chat_id) VALUES (?, ?, ?)",
+                    (m['id'], cur.lastrowid, m['chat_id']))
+            conn.commit()
+            conn.close()
+
+    def remove_chat(self, chat_id):
+        with self._write_lock:
+            conn = get_db_connection(self.db_name)
+            conn.execute(
+                "DELETE FROM message_fts WHERE rowid IN (SELECT fts_rowid FROM message_fts_ids WHERE chat_id = ?)",
+                (chat_id,))
+            conn.execute("DELETE FROM message_fts_ids WHERE chat_id = ?", (chat_id,))
+            conn.commit()
+            conn.close()
+
+    def search(self, text, chat_ids, limit=SEARCH_RESULT_LIMIT):
+        """Best matches for `text` within `chat_ids`, best first.
+
+        Each result has msg_id, chat_id, sender_name, timestamp, snippet
+        (with matches wrapped in **) and rank (lower is better).
+        """
+        match = to_match_query(text)
+        chat_ids = list(chat_ids)
+        if match is None or not chat_ids:
+            return []
+        # rank is BM25, configured in init_search_db. Users with many chats
+        # are searched a chunk of chat ids at a time; ranks come from the same
+        # index, so the chunks' best matches merge into one ordering.
+        rows = []
+        conn = get_db_connection(self.db_name)
+        for i in range(0, len(chat_ids), CHAT_IDS_PER_QUERY):
+            chunk = chat_ids[i:i + CHAT_IDS_PER_QUERY]
+            placeholders = ",".join("?" * len(chunk))
+            rows += conn.execute(
+                f"SELECT msg_id, chat_id, sender_name, timestamp, "
+                f"snippet(message_fts, 0, '**', '**', '…', {SNIPPET_TOKENS}) AS snippet, "
+                f"rank FROM message_fts WHERE message_fts MATCH ? AND chat_id IN ({placeholders}) "
+                f"ORDER BY rank LIMIT ?",
+                [match, *chunk, limit]).fetchall()
+        conn.close()
+        rows = sorted(rows, key=lambda r: r['rank'])[:limit]
+        results = []
+        for r in rows:
+            result = dict(r)
+            result['timestamp'] = datetime.datetime.fromisoformat(r['timestamp']) if r['timestamp'] else None
+            results.append(result)
+        return results
+
+    def size(self):
+        conn = get_db_connection(self.db_name)
+        count = conn.execute("SELECT COUNT(*) FROM message_fts_ids").fetchone()[0]
+        conn.close()
+        return count
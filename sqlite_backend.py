@@ -0,0 +1,311 @@
+import contextlib
+import datetime
+import json
+import queue
+import sqlite3
+import threading
+import uuid
+
+from database import STORAGE_DB_NAME, init_storage_db
+from storage import (StorageBackend, SHARED_CATEGORIES, MENTION_PATTERN,
+                     LAST_MESSAGE_PREVIEW_CHARS)
+
+# StorageBackend on a local SQLite file, for the scripts and tests that run
+# without a Firebase project. The database runs in WAL mode so reads proceed
+# while a write is in progress, and connections are pooled: each is opened once
+# with its pragmas applied and then reused across threads. Writes run in BEGIN IMMEDIATE
+# transactions, which take the write lock up front instead of failing with
+# "database is locked" when a read turns into a write.
+
+POOL_SIZE = 8
+POOL_TIMEOUT = 10  # seconds to wait for a free connection
+BUSY_TIMEOUT_MS = 5000
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _to_db_time(value):
+    # Fixed-width UTC ISO strings sort chronologically as text
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc).isoformat(timespec='microseconds')
+
+
+def _from_db_time(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def _new_id():
+    return uuid.uuid4().hex
+
+
+class ConnectionPool:
+    def __init__(self, db_name, size=POOL_SIZE):
+        self.db_name = db_name
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, timeout=BUSY_TIMEOUT_MS / 1000,
+                               check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints; safe with WAL
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA cache_size=-8000")  # KiB
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._connect()
+        return self._idle.get(timeout=POOL_TIMEOUT)
+
+    @contextlib.contextmanager
+    def connection(self):
+        # Autocommit connection for reads
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        conn = self._acquire()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                # Also after a failed COMMIT, so the connection goes back idle
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class SQLiteBackend(StorageBackend):
+    name = "sqlite"
+
+    def __init__(self, db_name=STORAGE_DB_NAME, pool_size=POOL_SIZE):
+        self.db_name = db_name
+        init_storage_db(db_name)
+        self.pool = ConnectionPool(db_name, pool_size)
+
+    def check_connection(self):
+        try:
+            with self.pool.connection() as conn:
+                conn.execute("SELECT 1").fetchone()
+            return True, None
+        except Exception as e:
+            return False, str(e)
+
+    def close(self):
+        self.pool.close()
+
+    # --- Row conversion ---
+    def _user(self, row):
+        return dict(row) if row else None
+
+    def _message(self, row):
+        msg = dict(row)
+        msg['is_ai'] = bool(msg['is_ai'])
+        msg['is_important'] = bool(msg['is_important'])
+        msg['timestamp'] = _from_db_time(msg['timestamp'])
+        return msg
+
+    def _chats(self, conn, rows):
+        # Chat dicts with their members attached, in one extra query
+        chats = []
+        for row in rows:
+            chat = dict(row)
+            chat['created_at'] = _from_db_time(chat['created_at'])
+            chat['last_activity_at'] = _from_db_time(chat['last_activity_at'])
+            chat['last_message'] = json.loads(chat['last_message']) if chat['last_message'] else None
+            chat['context_summary'] = json.loads(chat['context_summary']) if chat['context_summary'] else None
+            chat['members'] = []
+            chat['participants'] = []
+            chats.append(chat)
+        if chats:
+            by_id = {c['id']: c for c in chats}
+            placeholders = ",".join("?" * len(by_id))
+            for m in conn.execute(
+                    f"SELECT chat_id, user_id, is_participant FROM chat_members "
+                    f"WHERE chat_id IN ({placeholders}) ORDER BY added_at", list(by_id)):
+                chat = by_id[m['chat_id']]
+                chat['members'].append(m['user_id'])
+                if m['is_participant']:
+                    chat['participants'].append(m['user_id'])
+        return chats
+
+    # --- Users ---
+    def create_user(self, username, password_hash, role='user'):
+        try:
+            with self.pool.transaction() as conn:
+                conn.execute(
+                    "INSERT INTO users (id, username, password_hash, role, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (_new_id(), username, password_hash, role, _to_db_time(_now())))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def get_user_by_username(self, username):
+        with self.pool.connection() as conn:
+            return self._user(conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone())
+
+    def make_user_admin(self, user_id):
+        with self.pool.transaction() as conn:
+            conn.execute("UPDATE users SET role = 'admin' WHERE id = ?", (user_id,))
+
+    # --- Chats ---
+    def create_chat(self, user_id, category, title):
+        chat_id = _new_id()
+        now = _to_db_time(_now())
+        with self.pool.transaction() as conn:
+            conn.execute(
+                "INSERT INTO chats (id, user_id, category, title, created_at, last_activity_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (chat_id, user_id, category, title, now, now))
+            conn.execute(
+                "INSERT INTO chat_members (chat_id, user_id, is_participant, added_at) VALUES (?, ?, 0, ?)",
+                (chat_id, user_id, now))
+        return chat_id
+
+    def get_chat(self, chat_id):
+        with self.pool.connection() as conn:
+            chats = self._chats(conn, conn.execute("SELECT * FROM chats WHERE id = ?", (chat_id,)).fetchall())
+        return chats[0] if chats else None
+
+    def get_chats_by_category(self, user_id, category):
+        with self.pool.connection() as conn:
+            if category in SHARED_CATEGORIES:
+                rows = conn.execute(
+                    "SELECT * FROM chats WHERE category = ? ORDER BY last_activity_at DESC", (category,)).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT c.* FROM chats c JOIN chat_members m ON m.chat_id = c.id "
+                    "WHERE c.category = ? AND m.user_id = ? ORDER BY c.last_activity_at DESC",
+                    (category, user_id)).fetchall()
+            return self._chats(conn, rows)
+
+    def add_participant(self, chat_id, user_id):
+        with self.pool.transaction() as conn:
+            conn.execute(
+                "INSERT INTO chat_members (chat_id, user_id, is_participant, added_at) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (chat_id, user_id) DO UPDATE SET is_participant = 1",
+                (chat_id, user_id, _to_db_time(_now())))
+
+    def delete_chat(self, chat_id):
+        with self.pool.transaction() as conn:
+            deleted = conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,)).rowcount
+            conn.execute("DELETE FROM unread_mentions WHERE chat_id = ?", (chat_id,))
+            conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))  # members cascade
+        return deleted
+
+    # --- Messages ---
+    def save_messages(self, messages):
+        # One transaction for the messages, chat summaries and mention fan-out.
+        # A message whose id already exists is skipped, so retries are safe.
+        ids = []
+        with self.pool.transaction() as conn:
+            for m in messages:
+                msg_id = m.get('id') or _new_id()
+                ids.append(msg_id)
+                timestamp = _to_db_time(_now())
+                inserted = conn.execute(
+                    "INSERT OR IGNORE INTO messages (id, chat_id, sender_id, sender_name, content, is_ai, is_important, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (msg_id, m['chat_id'], m['sender_id'], m['sender_name'], m['content'],
+                     bool(m.get('is_ai', False)), bool(m.get('is_important', False)), timestamp)).rowcount
+                if not inserted:
+                    continue
+                last_message = json.dumps({
+                    'sender_name': m['sender_name'],
+                    'content': m['content'][:LAST_MESSAGE_PREVIEW_CHARS],
+                    'is_ai': bool(m.get('is_ai', False))
+                })
+                conn.execute(
+                    "UPDATE chats SET last_message = ?, last_activity_at = ?, message_count = message_count + 1, "
+                    "important_count = important_count + ? WHERE id = ?",
+                    (last_message, timestamp, 1 if m.get('is_important') else 0, m['chat_id']))
+
+                mentions = set(MENTION_PATTERN.findall(m['content']))
+                if mentions:
+                    placeholders = ",".join("?" * len(mentions))
+                    conn.execute(
+                        f"INSERT OR IGNORE INTO unread_mentions (user_id, chat_id) "
+                        f"SELECT id, ? FROM users WHERE username IN ({placeholders}) AND id != ?",
+                        [m['chat_id'], *mentions, m['sender_id']])
+        return ids
+
+    def get_messages(self, chat_id):
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT * FROM messages WHERE chat_id = ? ORDER BY timestamp, rowid", (chat_id,)).fetchall()
+        return [self._message(r) for r in rows]
+
+    def toggle_message_importance(self, msg_id, current_status):
+        # Like Firestore, the stored flag wins over current_status, which may be stale
+        with self.pool.transaction() as conn:
+            row = conn.execute("SELECT chat_id, is_important FROM messages WHERE id = ?", (msg_id,)).fetchone()
+            if row is None:
+                return
+            conn.execute("UPDATE messages SET is_important = ? WHERE id = ?", (not row['is_important'], msg_id))
+            conn.execute("UPDATE chats SET important_count = important_count + ? WHERE id = ?",
+                         (-1 if row['is_important'] else 1, row['chat_id']))
+
+    _VISIBLE_IMPORTANT = (
+        "FROM messages m JOIN chats c ON c.id = m.chat_id "
+        "WHERE m.is_important = 1 AND (c.category IN ({shared}) OR EXISTS "
+        "(SELECT 1 FROM chat_members cm WHERE cm.chat_id = c.id AND cm.user_id = ?))"
+    ).format(shared=",".join("?" * len(SHARED_CATEGORIES)))
+
+    def count_important_messages(self, user_id):
+        with self.pool.connection() as conn:
+            return conn.execute(f"SELECT COUNT(*) {self._VISIBLE_IMPORTANT}",
+                                [*SHARED_CATEGORIES, user_id]).fetchone()[0]
+
+    # --- Mentions ---
+    def add_unread_mention(self, user_id, chat_id):
+        with self.pool.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO unread_mentions (user_id, chat_id) VALUES (?, ?)", (user_id, chat_id))
+
+    def remove_unread_mention(self, user_id, chat_id):
+        with self.pool.transaction() as conn:
+            conn.execute("DELETE FROM unread_mentions WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
+
+    def get_unread_mentions(self, user_id):
+        with self.pool.connection() as conn:
+            return [r['chat_id'] for r in conn.execute(
+                "SELECT chat_id FROM unread_mentions WHERE user_id = ?", (user_id,))]
+
+    # --- Settings ---
+    def get_system_api_key(self):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT value FROM settings WHERE key = 'global_api_key'").fetchone()
+        return row['value'] if row else None
+
+    def set_system_api_key(self, key):
+        with self.pool.transaction() as conn:
+            conn.execute(
+                "INSERT INTO settings (key, value) VALUES ('global_api_key', ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key,))
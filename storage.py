@@ -0,0 +1,152 @@
+import abc
+import os
+import re
+
+# Storage backend interface.
+#
+# The account, admin and maintenance paths (auth.py, create_admin.py,
+# verify_app.py) persist users, chats, messages, mentions and settings through
+# one set of methods, so they run against Firestore
+# (firestore_backend.FirestoreBackend) or a local SQLite file
+# (sqlite_backend.SQLiteBackend). The chat UI is not on this interface: it is
+# built on Firestore's realtime listener, the outbox and the counter and
+# important-message indexes in firebase_db, and needs the Firestore backend.
+# Records are plain dicts shaped like the Firestore documents, with the
+# document id under 'id':
+#
+#   user:    id, username, password_hash, role, personal_api_key
+#   chat:    id, user_id, category, title, created_at, participants, members,
+#            last_message, last_activity_at, message_count, important_count
+#   message: id, chat_id, sender_id, sender_name, content, timestamp, is_ai,
+#            is_important
+#
+# STORAGE_BACKEND selects the implementation get_backend() returns
+# ("firestore", the default, or "sqlite"); STORAGE_DB_PATH overrides the
+# SQLite file. The constants below are shared by both backends, so the
+# categories, mention syntax and preview length cannot drift apart.
+
+STORAGE_BACKEND_ENV = "STORAGE_BACKEND"
+STORAGE_DB_PATH_ENV = "STORAGE_DB_PATH"
+SHARED_CATEGORIES = ['Study', 'Fun']  # Visible to every user
+MENTION_PATTERN = re.compile(r'@(\w+)')
+LAST_MESSAGE_PREVIEW_CHARS = 80
+
+
+class StorageBackend(abc.ABC):
+    name = None
+
+    @abc.abstractmethod
+    def check_connection(self):
+        """Returns (ok, error message or None)."""
+        raise NotImplementedError
+
+    # --- Users ---
+    @abc.abstractmethod
+    def create_user(self, username, password_hash, role='user'):
+        """Returns False if the username is taken."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_user_by_username(self, username):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def make_user_admin(self, user_id):
+        raise NotImplementedError
+
+    # --- Chats ---
+    @abc.abstractmethod
+    def create_chat(self, user_id, category, title):
+        """Returns the new chat's id."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_chat(self, chat_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_chats_by_category(self, user_id, category):
+        """Chats the user can see in a category, most recently active first."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_participant(self, chat_id, user_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_chat(self, chat_id):
+        """Deletes the chat and its messages; returns the number of messages deleted."""
+        raise NotImplementedError
+
+    # --- Messages ---
+    @abc.abstractmethod
+    def save_messages(self, messages):
+        """Writes message dicts (an 'id' makes the write idempotent); returns their ids."""
+        raise NotImplementedError
+
+    def save_message(self, chat_id, sender_id, sender_name, content, is_ai=False, is_important=False):
+        return self.save_messages([{
+            'chat_id': chat_id,
+            'sender_id': sender_id,
+            'sender_name': sender_name,
+            'content': content,
+            'is_ai': is_ai,
+            'is_important': is_important
+        }])[0]
+
+    @abc.abstractmethod
+    def get_messages(self, chat_id):
+        """Every message of the chat, oldest first."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def toggle_message_importance(self, msg_id, current_status):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def count_important_messages(self, user_id):
+        raise NotImplementedError
+
+    # --- Mentions ---
+    @abc.abstractmethod
+    def add_unread_mention(self, user_id, chat_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def remove_unread_mention(self, user_id, chat_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_unread_mentions(self, user_id):
+        raise NotImplementedError
+
+    # --- Settings ---
+    @abc.abstractmethod
+    def get_system_api_key(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_system_api_key(self, key):
+        raise NotImplementedError
+
+
+_backend = None
+
+
+def get_backend():
+    # The process-wide backend, created on first use. Imports are lazy so a
+    # SQLite deployment never loads the Firestore client (which connects at
+    # import time).
+    global _backend
+    if _backend is None:
+        kind = os.environ.get(STORAGE_BACKEND_ENV, "firestore").lower()
+        if kind == "sqlite":
+            from sqlite_backend import SQLiteBackend
+            db_path = os.environ.get(STORAGE_DB_PATH_ENV)
+            _backend = SQLiteBackend(db_path) if db_path else SQLiteBackend()
+        elif kind == "firestore":
+            from firestore_backend import FirestoreBackend
+            _backend = FirestoreBackend()
+        else:
+            raise ValueError(f"Unknown {STORAGE_BACKEND_ENV}: {kind!r} (expected 'firestore' or 'sqlite')")
+    return _backend
@@ -0,0 +1,47 @@
+import time
+
+import firebase_db
+from ai_jobs import AIJobQueue
+from response_cache import ResponseCache
+
+
+def ai_replies(chat_id):
+    return [m for m in firebase_db.get_messages_firestore(chat_id) if m['is_ai']]
+
+
+def run_one(chat, job, **queue_args):
+    from ui_components import run_ai_job
+    cache = ResponseCache(db_name=None)
+    jobs = AIJobQueue(lambda job: run_ai_job(job, chat.outbox, cache, key_limiter=jobs), **queue_args)
+    submitted = jobs.submit("chat1", "test-key-jobs", **job)
+    deadline = time.monotonic() + 5
+    while jobs.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    jobs.stop()
+    return jobs, submitted
+
+
+def test_failing_job_leaves_an_error_reply(chat, monkeypatch):
+    question = chat.outbox.enqueue("chat1", "u1", "u1", "@Gemini hi")
+    chat.outbox.flush_due()
+
+    def broken(chat_id):
+        raise RuntimeError("chat lookup failed")
+    monkeypatch.setattr("ui_components.get_chat_details", broken)
+
+    jobs, submitted = run_one(chat, {'prompt': "hi", 'question_id': question['id']})
+    assert jobs.stats()['failed'] == 1
+    [reply] = ai_replies("chat1")
+    assert reply['id'] == submitted['id']
+    assert "chat lookup failed" in reply['content']
+
+
+def test_job_does_not_answer_before_its_question_is_sent(chat, monkeypatch):
+    # The question never leaves the outbox (no worker, never flushed)
+    monkeypatch.setattr("ui_components.QUESTION_WAIT_TIMEOUT", 0.1)
+    question = chat.outbox.enqueue("chat1", "u1", "u1", "@Gemini hi")
+
+    jobs, _ = run_one(chat, {'prompt': "hi", 'question_id': question['id']})
+    assert chat.model.streams == 0
+    [reply] = ai_replies("chat1")
+    assert "still not sent" in reply['content']
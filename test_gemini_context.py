@@ -0,0 +1,41 @@
+import datetime
+
+import gemini_context
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def make_chat(count, words=40):
+    return [{'id': f"m{i}", 'content': "word " * words, 'is_ai': False,
+             'timestamp': START + datetime.timedelta(minutes=i)} for i in range(count)]
+
+
+class PagedChat:
+    def __init__(self, messages, page_size=50):
+        self.messages = messages
+        self.page_size = page_size
+        self.read = 0
+
+    def fetch_page(self, before):
+        older = [m for m in self.messages if before is None or m['timestamp'] < before]
+        page = older[-self.page_size:]
+        self.read += len(page)
+        return page, (page[0]['timestamp'] if len(page) == self.page_size else None)
+
+
+def test_loading_is_bounded_by_the_budget_not_the_chat_age():
+    chat = PagedChat(make_chat(5000))
+    messages = gemini_context.load_context_messages(chat.fetch_page)
+    wanted = gemini_context._recent_budget(gemini_context.CONTEXT_TOKEN_BUDGET) + gemini_context.SUMMARY_MAX_INPUT_TOKENS
+    per_message = gemini_context.estimate_tokens(chat.messages[0]['content'])
+    assert chat.read == len(messages) < wanted // per_message + chat.page_size
+    assert messages == chat.messages[-len(messages):]
+
+
+def test_loading_stops_at_what_the_summary_covers():
+    chat = PagedChat(make_chat(5000))
+    summary = {'text': "earlier", 'covered_until': chat.messages[-200]['timestamp']}
+    messages = gemini_context.load_context_messages(chat.fetch_page, summary)
+    assert chat.read == 200  # the page that reaches the summary is the last one read
+    history, state = gemini_context.build_context(messages, summary, summarize=lambda previous, msgs: "extended")
+    assert state['covered_until'] > summary['covered_until']
@@ -0,0 +1,234 @@
+import threading
+import time
+
+import pytest
+from google.api_core import exceptions
+
+import gemini_utils
+
+
+class FailingModel:
+    def __init__(self, error):
+        self.error = error
+
+    def generate_content(self, prompt, request_options=None):
+        raise self.error
+
+
+class StubRegistry:
+    def __init__(self, model):
+        self.model = model
+
+    def get_model(self, api_key, model_name=gemini_utils.DEFAULT_MODEL):
+        return self.model
+
+
+def test_non_retryable_error_on_half_open_trial_frees_the_key(monkeypatch):
+    key = "test-key-half-open"
+    breaker = gemini_utils.get_breaker(key)
+    breaker.record_failure(rejected=True)  # a rejected key opens the circuit
+    breaker.opened_at -= breaker.cooldown  # cooldown has passed
+    assert breaker.state == 'half_open'
+
+    monkeypatch.setattr(gemini_utils, 'model_registry', StubRegistry(FailingModel(exceptions.InvalidArgument("bad request"))))
+    for _ in range(2):
+        # Each call gets the trial slot, so the bad request surfaces instead
+        # of "no API key is available right now"
+        with pytest.raises(exceptions.InvalidArgument):
+            gemini_utils.call_gemini(lambda model: model.generate_content("hi"), key)
+    assert not breaker.trial_in_flight
+    assert breaker.allow()
+
+
+class StreamingModel:
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    def start_chat(self, history=None):
+        return self
+
+    def send_message(self, prompt, stream=False, request_options=None):
+        for text in self.chunks:
+            yield type("Chunk", (), {'text': text})()
+        if self.error:
+            raise self.error
+
+
+@pytest.mark.parametrize("error, complete", [(None, True), (exceptions.ServiceUnavailable("dropped"), False)])
+def test_stream_reports_whether_the_answer_completed(monkeypatch, error, complete):
+    monkeypatch.setattr(gemini_utils, 'model_registry', StubRegistry(StreamingModel(["Hello", " there"], error)))
+    status = {}
+    text = "".join(gemini_utils.stream_gemini_response("hi", api_key=f"test-key-stream-{complete}", status=status))
+    assert text.startswith("Hello there")
+    assert status['complete'] is complete
+
+
+class ThrottledOnceModel:
+    def __init__(self):
+        self.calls = 0
+
+    def _throttle_first(self):
+        self.calls += 1
+        if self.calls == 1:
+            raise exceptions.ResourceExhausted("429 once")
+
+    def generate_content(self, prompt, request_options=None):
+        self._throttle_first()
+        return type("Response", (), {'text': "answer"})()
+
+    def start_chat(self, history=None):
+        return self
+
+    def send_message(self, prompt, stream=False, request_options=None):
+        self._throttle_first()
+        yield type("Chunk", (), {'text': "answer"})()
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_single_key_retries_a_transient_429(monkeypatch, streaming):
+    key = f"test-key-429-{streaming}"
+    monkeypatch.setattr(gemini_utils, 'model_registry', StubRegistry(ThrottledOnceModel()))
+    monkeypatch.setattr(gemini_utils, '_backoff', lambda retry: 0)
+    for _ in range(2):
+        # Backed off and retried on the same key, which stays in rotation
+        if streaming:
+            status = {}
+            assert "".join(gemini_utils.stream_gemini_response("hi", api_key=key, status=status)) == "answer"
+            assert status['complete']
+        else:
+            assert gemini_utils.call_gemini(lambda model: model.generate_content("hi").text, key) == "answer"
+        assert gemini_utils.get_breaker(key).state == 'closed'
+
+
+class CountingLimiter:
+    def __init__(self, free):
+        self.free = free
+        self.held = 0
+
+    def acquire(self, api_key, slot=True):
+        if not self.free:
+            return False
+        self.held += slot
+        return True
+
+    def release(self, api_key):
+        self.held -= 1
+
+
+class KeyedModel:
+    def __init__(self, key, failing_key):
+        self.key = key
+        self.failing_key = failing_key
+
+    def generate_content(self, prompt, request_options=None):
+        if self.key == self.failing_key:
+            raise exceptions.ResourceExhausted("quota")
+        return type("Response", (), {'text': f"answered with {self.key}"})()
+
+
+class KeyedRegistry:
+    def __init__(self, failing_key):
+        self.failing_key = failing_key
+
+    def get_model(self, api_key, model_name=gemini_utils.DEFAULT_MODEL):
+        return KeyedModel(api_key, self.failing_key)
+
+
+@pytest.mark.parametrize("free", [True, False])
+def test_failover_borrows_a_slot_on_the_fallback_key(monkeypatch, free):
+    personal, system = f"test-personal-{free}", f"test-system-{free}"
+    monkeypatch.setattr(gemini_utils, 'model_registry', KeyedRegistry(failing_key=personal))
+    monkeypatch.setattr(gemini_utils, '_backoff', lambda retry: 0)
+    limiter = CountingLimiter(free)
+    call = lambda model: model.generate_content("hi").text
+    if free:
+        assert gemini_utils.call_gemini(call, personal, system, key_limiter=limiter) == f"answered with {system}"
+    else:
+        # The system key has no free slot, so the throttled personal key is
+        # retried until the call gives up, instead of bursting onto the other
+        with pytest.raises(exceptions.ResourceExhausted):
+            gemini_utils.call_gemini(call, personal, system, key_limiter=limiter)
+    assert limiter.held == 0
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.charges = []
+        self.held = 0
+
+    def acquire(self, api_key, slot=True):
+        self.charges.append(slot)
+        self.held += slot
+        return True
+
+    def release(self, api_key):
+        self.held -= 1
+
+
+class FlakyModel:
+    def __init__(self, failures):
+        self.failures = failures
+
+    def generate_content(self, prompt, request_options=None):
+        if self.failures:
+            self.failures -= 1
+            raise exceptions.ServiceUnavailable("try again")
+        return type("Response", (), {'text': "answer"})()
+
+
+def test_retries_on_the_own_key_pay_a_token_each(monkeypatch):
+    monkeypatch.setattr(gemini_utils, 'model_registry', StubRegistry(FlakyModel(failures=2)))
+    monkeypatch.setattr(gemini_utils, '_backoff', lambda retry: 0)
+    limiter = RecordingLimiter()
+    call = lambda model: model.generate_content("hi").text
+    assert gemini_utils.call_gemini(call, "test-key-flaky", key_limiter=limiter) == "answer"
+    # The first attempt uses the job's own slot and token; the two retries
+    # reuse the slot and pay a token each
+    assert limiter.charges == [False, False]
+    assert limiter.held == 0
+
+
+class SilentStream:
+    def __init__(self):
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def __iter__(self):
+        self.cancelled.wait(5)
+        raise exceptions.Cancelled("stream cancelled")
+
+
+class HedgedModel:
+    def __init__(self):
+        self.silent = SilentStream()
+        self.calls = 0
+
+    def start_chat(self, history=None):
+        return self
+
+    def send_message(self, prompt, stream=False, request_options=None):
+        self.calls += 1
+        if self.calls == 1:
+            return self.silent
+        return iter([type("Chunk", (), {'text': "answer"})()])
+
+
+def test_hedge_takes_a_slot_and_the_loser_is_closed(monkeypatch):
+    model = HedgedModel()
+    monkeypatch.setattr(gemini_utils, 'model_registry', StubRegistry(model))
+    monkeypatch.setattr(gemini_utils, 'HEDGE_DELAY', 0.01)
+    limiter = RecordingLimiter()
+    status = {}
+    text = "".join(gemini_utils.stream_gemini_response("hi", api_key="test-key-hedge", status=status,
+                                                       key_limiter=limiter))
+    assert text == "answer" and status['complete']
+    # The hedge runs beside the first attempt, so it takes a slot of its own
+    assert limiter.charges == [True]
+    assert model.silent.cancelled.wait(1)
+    deadline = time.monotonic() + 1
+    while limiter.held and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert limiter.held == 0
@@ -0,0 +1,45 @@
+import streamlit as st
+
+import firebase_db
+import ui_components
+
+
+def star_messages(chat, count):
+    ids = []
+    for i in range(count):
+        question = chat.outbox.enqueue("chat1", "u1", "u1", f"question {i}")
+        ids.append(question['id'])
+    while chat.outbox.flush_due():  # one message per chat per flush
+        pass
+    for msg_id in ids:
+        firebase_db.toggle_message_importance(msg_id, False)
+    return ids
+
+
+def test_show_more_continues_from_the_cursor_and_counts_are_cached(chat, monkeypatch):
+    st.session_state.pop('important_cache', None)
+    star_messages(chat, 25)
+    counts = []
+    monkeypatch.setattr(ui_components, 'count_important_messages',
+                        lambda user_id: counts.append(user_id) or firebase_db.count_important_messages(user_id))
+
+    panel = ui_components.load_important_panel("u1")
+    assert panel['count'] == 25 and len(panel['messages']) == firebase_db.IMPORTANT_PAGE_SIZE
+    ui_components.load_important_panel("u1")  # a rerun with nothing changed
+    assert len(counts) == 1
+
+    # Each click reads the page after the cursor, not the whole list again
+    for _ in range(2):
+        reads = chat.client.reads
+        ui_components.load_more_important("u1")
+        assert chat.client.reads - reads <= 2 * firebase_db.IMPORTANT_PAGE_SIZE  # one query per scope
+    panel = ui_components.load_important_panel("u1")
+    assert len(counts) == 1
+    assert len({m['id'] for m in panel['messages']}) == 25 and panel['cursor'] is None
+
+    # A new star reloads the count and the list, to the depth already shown
+    [new_id] = star_messages(chat, 1)
+    panel = ui_components.load_important_panel("u1")
+    assert len(counts) == 2
+    assert panel['count'] == 26 and len(panel['messages']) == 25
+    assert panel['messages'][0]['id'] == new_id and panel['cursor'] is not None
@@ -0,0 +1,66 @@
+import sqlite3
+import time
+
+import outbox as outbox_module
+from database import init_outbox_db
+from outbox import Outbox
+
+
+def test_two_workers_sharing_a_file_send_each_message_once(tmp_path):
+    db_name = str(tmp_path / "outbox.db")
+    sent = []
+    other = Outbox(lambda messages: sent.extend(("other", m['id']) for m in messages), db_name=db_name, start=False)
+
+    def flush(messages):
+        # The other worker runs while this one is still sending
+        other.flush_due()
+        sent.extend(("first", m['id']) for m in messages)
+    first = Outbox(flush, db_name=db_name, start=False)
+
+    ids = [first.enqueue(f"chat{i}", "u1", "u1", "hi")['id'] for i in range(3)]
+    assert first.flush_due() == 3
+    assert sorted(msg_id for _, msg_id in sent) == sorted(ids)
+    assert {worker for worker, _ in sent} == {"first"}
+    assert first.pending() == []
+
+
+def test_a_stale_claim_is_taken_over(tmp_path, monkeypatch):
+    db_name = str(tmp_path / "outbox.db")
+    sent = []
+    outbox = Outbox(lambda messages: sent.extend(m['id'] for m in messages), db_name=db_name, start=False)
+    msg = outbox.enqueue("chat1", "u1", "u1", "hi")
+    conn = sqlite3.connect(db_name)
+    conn.execute("UPDATE outbox SET claimed_by = 'dead-worker', claimed_at = ?", (time.time(),))
+    conn.commit()
+
+    assert outbox.flush_due() == 0  # still held by the other worker
+    monkeypatch.setattr(outbox_module, 'CLAIM_TIMEOUT', 0)
+    assert outbox.flush_due() == 1
+    assert sent == [msg['id']]
+    conn.close()
+
+
+def test_failed_send_releases_the_claim(tmp_path):
+    def broken(messages):
+        raise RuntimeError("unavailable")
+    db_name = str(tmp_path / "outbox.db")
+    outbox = Outbox(broken, db_name=db_name, start=False)
+    outbox.enqueue("chat1", "u1", "u1", "hi")
+    outbox.flush_due()
+    conn = sqlite3.connect(db_name)
+    assert conn.execute("SELECT attempts, claimed_by FROM outbox").fetchone() == (1, None)
+    conn.close()
+
+
+def test_old_outbox_files_gain_the_claim_columns(tmp_path):
+    db_name = str(tmp_path / "outbox.db")
+    conn = sqlite3.connect(db_name)
+    conn.execute("CREATE TABLE outbox (seq INTEGER PRIMARY KEY AUTOINCREMENT, msg_id TEXT UNIQUE NOT NULL, "
+                 "chat_id TEXT NOT NULL, sender_id, sender_name TEXT, content TEXT, is_ai BOOLEAN DEFAULT 0, "
+                 "is_important BOOLEAN DEFAULT 0, created_at TEXT NOT NULL, attempts INTEGER DEFAULT 0, "
+                 "next_attempt_at REAL DEFAULT 0, last_error TEXT)")
+    conn.commit()
+    init_outbox_db(db_name)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+    assert {'claimed_by', 'claimed_at'} <= columns
+    conn.close()
@@ -0,0 +1,65 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import realtime
+from firestore_fake import FakeFirestore
+
+
+class DeadListenerClient:
+    # Every listener stops before sending its first snapshot (e.g. a missing index)
+    def __init__(self):
+        self.listeners = 0
+
+    def collection(self, name):
+        return self
+
+    def where(self, *args):
+        return self
+
+    def order_by(self, *args, **kwargs):
+        return self
+
+    def limit(self, count):
+        return self
+
+    def on_snapshot(self, callback):
+        self.listeners += 1
+        return SimpleNamespace(is_active=False, unsubscribe=lambda: None)
+
+
+def test_failed_listener_backs_off_before_it_is_restarted(monkeypatch):
+    monkeypatch.setattr(realtime, 'LISTENER_RETRY_BASE', 0.2)
+    client = DeadListenerClient()
+    manager = realtime.ChatSubscriptionManager(client)
+
+    with pytest.raises(realtime.ListenerUnavailable):
+        manager.get_messages("chat1", "session1")
+    # Other viewers fall back at once instead of starting their own listener
+    started = time.monotonic()
+    for session in ("session1", "session2"):
+        with pytest.raises(realtime.ListenerUnavailable):
+            manager.get_messages("chat1", session)
+    assert time.monotonic() - started < realtime.FIRST_SNAPSHOT_TIMEOUT
+    assert client.listeners == 1
+    assert 0 < manager.retry_in("chat1") <= 0.2
+
+    time.sleep(0.25)
+    with pytest.raises(realtime.ListenerUnavailable):
+        manager.get_messages("chat1", "session1")
+    assert client.listeners == 2
+    assert manager.retry_in("chat1") > 0.2  # doubled after the second failure
+    manager.close()
+
+
+def test_working_listener_clears_the_backoff():
+    client = FakeFirestore()
+    client.collection('messages').document("m1").set({'chat_id': "chat1", 'content': "hi", 'timestamp': 1})
+    manager = realtime.ChatSubscriptionManager(client, window=None)
+    manager._listener_failed("chat1")
+    manager._retry["chat1"] = (1, 0)  # retry time has passed
+    messages, _ = manager.get_messages("chat1", "session1")
+    assert [m['id'] for m in messages] == ["m1"]
+    assert manager.retry_in("chat1") == 0 and "chat1" not in manager._retry
+    manager.close()
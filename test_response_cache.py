@@ -0,0 +1,22 @@
+import firebase_db
+from response_cache import ResponseCache, make_cache_key
+
+
+def test_make_cache_key_ignores_the_gemini_mention_case_and_spacing():
+    assert make_cache_key("m", "@Gemini  What is a MONAD?", ["chat1", None]) == \
+        make_cache_key("m", "what is a monad", ["chat1", None])
+    assert make_cache_key("m", "what is a monad", ["chat1", None]) != make_cache_key("m", "what is a monad", ["chat2", None])
+
+
+def test_repeated_question_is_served_from_the_cache(chat):
+    from ui_components import run_ai_job
+    cache = ResponseCache(db_name=None)
+    for i, prompt in enumerate(["@Gemini what is a monad?", "@gemini What is a monad"]):
+        question = chat.outbox.enqueue("chat1", "u1", "u1", prompt)
+        chat.outbox.flush_due()
+        run_ai_job({'id': f"ai-{i}", 'chat_id': "chat1", 'prompt': prompt, 'api_key': "test-key-cache",
+                    'question_id': question['id'], 'use_cache': True}, chat.outbox, cache)
+    assert chat.model.streams == 1
+    assert cache.stats()['hits'] == 1
+    replies = [m['content'] for m in firebase_db.get_messages_firestore("chat1") if m['is_ai']]
+    assert len(replies) == 2 and replies[0] == replies[1]
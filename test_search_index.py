@@ -0,0 +1,34 @@
+import datetime
+import logging
+
+import firebase_db
+from search_index import SearchIndex, CHAT_IDS_PER_QUERY
+
+
+def message(msg_id, chat_id, content):
+    return {'id': msg_id, 'chat_id': chat_id, 'sender_name': "u1", 'content': content,
+            'timestamp': datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)}
+
+
+def test_search_spans_more_chats_than_one_query_can_bind(tmp_path):
+    index = SearchIndex(str(tmp_path / "search.db"))
+    chat_ids = [f"chat{i}" for i in range(3 * CHAT_IDS_PER_QUERY)]
+    index.add_messages([
+        message("first", chat_ids[0], "monad"),
+        message("last", chat_ids[-1], "monad monad monad"),
+        message("hidden", "other", "monad"),
+    ])
+    results = index.search("monad", chat_ids)
+    assert [r['msg_id'] for r in results] == ["last", "first"]  # best rank first across chunks
+    assert [r['msg_id'] for r in index.search("monad", chat_ids, limit=1)] == ["last"]
+
+
+def test_indexing_failures_are_logged(chat, monkeypatch, caplog):
+    def broken(messages):
+        raise OSError("disk full")
+    monkeypatch.setattr(firebase_db.search_index, 'add_messages', broken)
+    with caplog.at_level(logging.ERROR, logger="firebase_db"):
+        firebase_db.save_messages_firestore([{'chat_id': "chat1", 'sender_id': "u1", 'sender_name': "u1",
+                                              'content': "hello"}])
+    assert "Could not index 1 message(s)" in caplog.text
+    assert len(firebase_db.get_messages_firestore("chat1")) == 1
@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+from sqlite_backend import SQLiteBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "store.db"), pool_size=1)
+    yield backend
+    backend.close()
+
+
+def make_user(backend, username):
+    assert backend.create_user(username, "hash")
+    return backend.get_user_by_username(username)
+
+
+def test_users_chats_and_mentions(backend):
+    alice, bob = make_user(backend, "alice"), make_user(backend, "bob")
+    assert not backend.create_user("alice", "other")
+
+    chat_id = backend.create_chat(alice['id'], 'Private', 'Plans')
+    assert backend.get_chats_by_category(bob['id'], 'Private') == []
+    backend.add_participant(chat_id, bob['id'])
+    assert [c['id'] for c in backend.get_chats_by_category(bob['id'], 'Private')] == [chat_id]
+
+    [msg_id] = backend.save_messages([{'id': "m1", 'chat_id': chat_id, 'sender_id': alice['id'],
+                                       'sender_name': "alice", 'content': "hi @bob"}])
+    # Saving the same id again is a no-op
+    backend.save_messages([{'id': "m1", 'chat_id': chat_id, 'sender_id': alice['id'],
+                            'sender_name': "alice", 'content': "hi @bob"}])
+    assert [m['id'] for m in backend.get_messages(chat_id)] == [msg_id]
+    assert backend.get_chat(chat_id)['message_count'] == 1
+    assert backend.get_unread_mentions(bob['id']) == [chat_id]
+    assert backend.get_unread_mentions(alice['id']) == []
+
+    assert backend.delete_chat(chat_id) == 1
+    assert backend.get_chat(chat_id) is None
+
+
+def test_toggle_flips_the_stored_flag_not_the_callers_view(backend):
+    alice = make_user(backend, "alice")
+    chat_id = backend.create_chat(alice['id'], 'Study', 'Notes')
+    msg_id = backend.save_message(chat_id, alice['id'], "alice", "remember this")
+
+    # Two viewers both saw the message unstarred and both press the star
+    backend.toggle_message_importance(msg_id, False)
+    backend.toggle_message_importance(msg_id, False)
+    assert backend.get_messages(chat_id)[0]['is_important'] is False
+    assert backend.get_chat(chat_id)['important_count'] == 0
+    assert backend.count_important_messages(alice['id']) == 0
+
+    backend.toggle_message_importance(msg_id, True)
+    assert backend.get_chat(chat_id)['important_count'] == 1
+    assert backend.count_important_messages(alice['id']) == 1
+
+
+def test_failed_commit_rolls_back_before_the_connection_is_reused(backend):
+    alice = make_user(backend, "alice")
+    with pytest.raises(sqlite3.IntegrityError):
+        with backend.pool.transaction() as conn:
+            # Deferred foreign keys are checked, and fail, at COMMIT
+            conn.execute("PRAGMA defer_foreign_keys=ON")
+            conn.execute("INSERT INTO messages (id, chat_id, content, timestamp) VALUES ('m1', 'missing', 'x', 't')")
+
+    # The pool's only connection is usable again and the insert is gone
+    chat_id = backend.create_chat(alice['id'], 'Study', 'Notes')
+    assert backend.get_messages("missing") == []
+    assert backend.get_chat(chat_id)['title'] == "Notes"
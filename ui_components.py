@@ -4,17 +4,35 @@ from firebase_db import (
     create_chat_firestore, 
     get_chat_details, 
     get_messages_firestore, 
-    save_message_firestore, 
-    get_important_messages,
+    get_messages_page_firestore,
+    MESSAGE_PAGE_SIZE,
+    save_messages_firestore,
+    get_important_messages_page,
+    count_important_messages,
+    get_important_version,
+    IMPORTANT_PAGE_SIZE,
     update_user_key,
     get_system_api_key_firestore,
     set_system_api_key_firestore,
-    get_all_users,
+    get_user_directory,
     make_user_admin,
-    get_db
+    get_db,
+    message_cache
 )
-from gemini_utils import get_gemini_response
+from gemini_utils import stream_gemini_response, summarize_conversation, key_health, KeySlots, DEFAULT_MODEL
+from gemini_context import build_context, load_context_messages
+from realtime import ChatSubscriptionManager
+from outbox import Outbox, OUTBOX_DB_PATH_ENV
+from ai_jobs import AIJobQueue, QueueFull
+from response_cache import ResponseCache, make_cache_key
+from pdf_export import PdfExporter, export_key
+from message_render import FragmentCache
+from firestore_metrics import metrics as firestore_metrics
+from database import OUTBOX_DB_NAME
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import datetime
+import os
+import time
 
 def get_chats_by_category(user_id, category):
     return get_chats_by_category_firestore(user_id, category)
@@ -22,12 +40,66 @@ def get_chats_by_category(user_id, category):
 def create_new_chat(user_id, category, title):
     return create_chat_firestore(user_id, category, title)
 
+USER_PICKER_LIMIT = 20 # matches shown in the add-member picker
+STREAM_CHECKPOINT_INTERVAL = 1.0 # seconds between partial AI reply writes
+SIDEBAR_TTL = 30 # seconds; covers changes made by other server processes
+IMPORTANT_TTL = 30 # seconds; covers stars changed by other server processes
+LIVE_REFRESH = 1 # seconds between reads of a chat's listener feed
+POLL_REFRESH = 3 # seconds between delta polls while the listener is unavailable
+QUESTION_WAIT_TIMEOUT = 60 # seconds an AI job waits for its question to reach Firestore
+
+def load_sidebar_data(user_id):
+    # Session-scoped cache of the sidebar loader. Reloads after SIDEBAR_TTL or
+    # as soon as a create/join/mention event in this process bumps a version.
+    from firebase_db import get_sidebar_data, get_sidebar_version
+    version = get_sidebar_version(user_id)
+    cached = st.session_state.get('sidebar_cache')
+    if (cached is None or cached['user_id'] != user_id or cached['version'] != version
+            or time.monotonic() - cached['loaded_at'] > SIDEBAR_TTL):
+        cached = {
+            'user_id': user_id,
+            'version': version,
+            'loaded_at': time.monotonic(),
+            'data': get_sidebar_data(user_id)
+        }
+        st.session_state.sidebar_cache = cached
+    return cached['data']
+
+def load_important_panel(user_id):
+    # Session-scoped count and loaded pages of the important panel. Reloads,
+    # to the depth already shown, after IMPORTANT_TTL or as soon as a star in
+    # this process bumps the index version.
+    version = get_important_version()
+    cached = st.session_state.get('important_cache')
+    if (cached is None or cached['user_id'] != user_id or cached['version'] != version
+            or time.monotonic() - cached['loaded_at'] > IMPORTANT_TTL):
+        shown = len(cached['messages']) if cached and cached['user_id'] == user_id else 0
+        messages, cursor = get_important_messages_page(user_id, limit=max(shown, IMPORTANT_PAGE_SIZE))
+        cached = {
+            'user_id': user_id,
+            'version': version,
+            'loaded_at': time.monotonic(),
+            'count': count_important_messages(user_id),
+            'messages': messages,
+            'cursor': cursor
+        }
+        st.session_state.important_cache = cached
+    return cached
+
+def load_more_important(user_id):
+    # Appends the page after the starred_at cursor of what is already shown
+    cached = st.session_state.important_cache
+    messages, cursor = get_important_messages_page(user_id, before=cached['cursor'])
+    cached['messages'] = cached['messages'] + messages
+    cached['cursor'] = cursor
+
 def render_sidebar():
     st.header("🗂️ Folders")
     
-    # Unread Mentions
-    from firebase_db import get_user_unread_mentions, remove_unread_mention
-    unread_chats = get_user_unread_mentions(st.session_state.user['id'])
+    # Unread Mentions + chats for every category, loaded together
+    from firebase_db import remove_unread_mention
+    sidebar = load_sidebar_data(st.session_state.user['id'])
+    unread_chats = sidebar['unread']
     
     categories = ["Private", "Study", "Fun"]
     
@@ -43,8 +115,7 @@ def render_sidebar():
                         st.rerun()
             
             # List existing chats
-            chats = get_chats_by_category(st.session_state.user['id'], cat)
-            for chat in chats:
+            for chat in sidebar['chats'].get(cat, []):
                 # Notification Dot
                 label = f"💬 {chat['title']}"
                 if chat['id'] in unread_chats:
@@ -56,6 +127,10 @@ def render_sidebar():
                     if chat['id'] in unread_chats:
                         remove_unread_mention(st.session_state.user['id'], chat['id'])
                     st.rerun()
+                # Last message preview (stored on the chat document)
+                last = chat.get('last_message')
+                if last:
+                    st.caption(f"{last['sender_name']}: {last['content']}")
 
     if st.session_state.user['role'] == 'admin':
         st.divider()
@@ -63,64 +138,256 @@ def render_sidebar():
             st.session_state.active_chat_id = "ADMIN"
             st.rerun()
 
-@st.fragment(run_every=3)
+@st.cache_resource
+def get_subscription_manager():
+    # One listener per active chat, shared by every session in this process
+    return ChatSubscriptionManager(get_db(), cache=message_cache)
+
+@st.cache_resource
+def get_outbox():
+    # Outgoing messages are queued locally and flushed to Firestore in the
+    # background; OUTBOX_DB_PATH lets the processes on a machine share one file
+    return Outbox(save_messages_firestore, db_name=os.environ.get(OUTBOX_DB_PATH_ENV, OUTBOX_DB_NAME))
+
+@st.cache_resource
+def get_fragment_cache():
+    # Rendered message HTML, shared by all sessions
+    return FragmentCache()
+
+@st.cache_resource
+def get_response_cache():
+    # Shared by all sessions; answers also persist in response_cache.db
+    return ResponseCache()
+
+@st.cache_resource
+def get_ai_jobs():
+    # Gemini requests run on a shared worker pool, rate limited per API key;
+    # a job's retries, hedges and failover are charged to the same queue
+    outbox = get_outbox()
+    response_cache = get_response_cache()
+
+    def run(job):
+        run_ai_job(job, outbox, response_cache, key_limiter=jobs)
+    jobs = AIJobQueue(run)
+    return jobs
+
+def run_ai_job(job, outbox, response_cache, key_limiter=None):
+    # Runs on an AI worker thread. The reply is written under the job's id, so
+    # the pending placeholder is replaced in place once the message exists.
+    # A job that fails still leaves a reply saying so, rather than a question
+    # that silently goes unanswered; the error is re-raised for the queue.
+    reply = {'started': False, 'text': ""}
+    try:
+        _answer_ai_job(job, outbox, response_cache, key_limiter, reply)
+    except Exception as e:
+        _save_ai_error(job, reply, e)
+        raise
+
+def _save_ai_error(job, reply, error):
+    from firebase_db import finish_streaming_message
+    if reply['started']:
+        # Keep what had arrived, like an interrupted stream
+        text = reply['text'] + "\n\n" if reply['text'] else ""
+        finish_streaming_message(job['chat_id'], job['id'], 0, "Gemini", f"{text}_(reply interrupted: {error})_")
+    else:
+        save_messages_firestore([{'id': job['id'], 'chat_id': job['chat_id'], 'sender_id': 0, 'sender_name': "Gemini",
+                                  'content': f"Error calling Gemini API: {error}", 'is_ai': True}])
+
+def _answer_ai_job(job, outbox, response_cache, key_limiter, reply):
+    from firebase_db import save_context_summary, start_streaming_message, update_streaming_message, finish_streaming_message
+    chat_id, prompt, api_key, fallback_key = job['chat_id'], job['prompt'], job['api_key'], job.get('fallback_key')
+    # The question goes first, so the reply's server timestamp sorts after it
+    question = outbox.wait_for_message(job['question_id'], timeout=QUESTION_WAIT_TIMEOUT)
+    if question != 'sent':
+        raise RuntimeError("the question could not be sent, so it was not answered" if question == 'failed'
+                           else f"the question was still not sent after {QUESTION_WAIT_TIMEOUT}s")
+    # The summary and the answer are charged to the job's slot on its key
+    slots = KeySlots(key_limiter, api_key or fallback_key)
+
+    # Build History for Context within the token budget: recent turns
+    # verbatim, older ones via the chat's rolling summary. The prompt
+    # itself is sent separately, so the question is left out.
+    chat = get_chat_details(chat_id) or {}
+    messages = load_context_messages(lambda before: get_messages_page_firestore(chat_id, before=before),
+                                     chat.get('context_summary'))
+    messages = [m for m in messages if m['id'] != job['question_id']]
+    history, summary_state = build_context(
+        messages,
+        chat.get('context_summary'),
+        summarize=lambda previous, msgs: summarize_conversation(previous, msgs, api_key, fallback_key=fallback_key,
+                                                               slots=slots))
+    if summary_state is not chat.get('context_summary'):
+        save_context_summary(chat_id, summary_state)
+
+    # Cached answers are scoped to the chat and the summary they were given
+    scope = [chat_id, (summary_state or {}).get('covered_until')]
+    cache_key = make_cache_key(DEFAULT_MODEL, prompt, scope) if job.get('use_cache') else None
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            save_messages_firestore([{'id': job['id'], 'chat_id': chat_id, 'sender_id': 0,
+                                      'sender_name': "Gemini", 'content': cached, 'is_ai': True}])
+            return
+
+    # Stream the answer, checkpointing the AI message so every participant
+    # (the asker included) sees it grow through the chat listener
+    msg_id = start_streaming_message(chat_id, 0, "Gemini", msg_id=job['id'])
+    reply['started'] = True
+    response_text = ""
+    last_checkpoint = time.monotonic()
+    stream_status = {}
+    for chunk in stream_gemini_response(prompt, history, api_key, fallback_key=fallback_key, status=stream_status,
+                                        slots=slots):
+        response_text += chunk
+        reply['text'] = response_text
+        if time.monotonic() - last_checkpoint >= STREAM_CHECKPOINT_INTERVAL:
+            update_streaming_message(msg_id, response_text)
+            last_checkpoint = time.monotonic()
+    finish_streaming_message(chat_id, msg_id, 0, "Gemini", response_text)
+    # Only answers that arrived in full are reused; a partial reply ends in an
+    # error or cut-off note that must not be replayed to later askers
+    if cache_key and response_text and stream_status['complete']:
+        response_cache.put(cache_key, response_text)
+
+def send_message(chat_id, sender_id, sender_name, content, is_ai=False):
+    return get_outbox().enqueue(chat_id, sender_id, sender_name, content, is_ai=is_ai)
+
+def with_pending(chat_id, messages):
+    # Append this chat's queued (not yet flushed) messages for optimistic
+    # display, and any that failed for good, marked as not sent
+    outbox = get_outbox()
+    pending = outbox.pending(chat_id) + outbox.failed(chat_id)
+    # Gemini replies still in the AI queue show as a placeholder
+    pending += [{
+        'id': job['id'],
+        'chat_id': chat_id,
+        'sender_id': 0,
+        'sender_name': "Gemini",
+        'content': "…",
+        'is_ai': True,
+        'is_important': False,
+        'timestamp': datetime.datetime.fromtimestamp(job['submitted_at'], datetime.timezone.utc),
+        'pending': True,
+        'queued': job['state'] == 'queued',
+    } for job in get_ai_jobs().pending(chat_id)]
+    if not pending:
+        return messages
+    known = {m['id'] for m in messages}
+    return messages + [m for m in pending if m['id'] not in known]
+
+def get_live_messages(chat_id):
+    # Read from the shared snapshot listener; fall back to the shared message
+    # cache (delta polling) if the listener cannot be started or has dropped.
+    # Returns (messages, has_older, live): the listener only holds the newest window.
+    manager = get_subscription_manager()
+    try:
+        messages, _ = manager.get_messages(chat_id, get_script_run_ctx().session_id)
+        return messages, manager.has_older(chat_id), True
+    except Exception:
+        return get_messages_firestore(chat_id), False, False
+
+def get_message_window(chat_id):
+    # Per-session view window: how many messages to show, plus any older pages
+    # fetched beyond what the live feed holds.
+    win = st.session_state.get('message_window')
+    if win is None or win['chat_id'] != chat_id:
+        win = {'chat_id': chat_id, 'size': MESSAGE_PAGE_SIZE, 'older': [], 'exhausted': False, 'last_live': []}
+        st.session_state.message_window = win
+    return win
+
+def load_earlier_messages(chat_id, win, loaded, has_older):
+    win['size'] += MESSAGE_PAGE_SIZE
+    if win['size'] <= len(loaded) or win['exhausted'] or not has_older:
+        return
+    before = loaded[0]['timestamp'] if loaded else None
+    page, older_cursor = get_messages_page_firestore(chat_id, MESSAGE_PAGE_SIZE, before=before)
+    win['older'] = page + win['older']
+    win['exhausted'] = older_cursor is None
+
+def start_metrics_rerun(label, fragment=False):
+    # Starts a new rerun in the Firestore metrics for this session; call at
+    # the top of the script and of every fragment. A fragment also runs
+    # inline during a full rerun, which stays booked to the full rerun's
+    # record, so fragments only open their own record on fragment-only runs.
+    ctx = get_script_run_ctx()
+    if fragment and not ctx.fragment_ids_this_run:
+        return
+    firestore_metrics.start_rerun(ctx.session_id, label)
+
 def render_messages_area(chat_id):
-    # Fetch Messages
-    messages = get_messages_firestore(chat_id)
+    # Messages are read from the chat's listener every LIVE_REFRESH seconds
+    # (an in-memory read). While the listener is backing off after a failure
+    # the chat is polled through the message cache every POLL_REFRESH seconds
+    # instead, which costs Firestore reads.
+    manager = get_subscription_manager()
+    previous = st.session_state.get('subscribed_chat_id')
+    if previous and previous != chat_id:
+        manager.unsubscribe(previous, get_script_run_ctx().session_id)
+    st.session_state.subscribed_chat_id = chat_id
+
+    if manager.retry_in(chat_id):
+        render_polled_messages(chat_id)
+    else:
+        render_live_messages(chat_id)
+
+@st.fragment(run_every=LIVE_REFRESH)
+def render_live_messages(chat_id):
+    start_metrics_rerun("fragment:messages", fragment=True)
+    live_messages, has_older, live = get_live_messages(chat_id)
+    if not live and get_subscription_manager().retry_in(chat_id):
+        st.rerun()  # switch to the polling fragment until the retry time
+    render_message_list(chat_id, live_messages, has_older)
+
+@st.fragment(run_every=POLL_REFRESH)
+def render_polled_messages(chat_id):
+    start_metrics_rerun("fragment:messages", fragment=True)
+    if not get_subscription_manager().retry_in(chat_id):
+        st.rerun()  # time to try the listener again
+    render_message_list(chat_id, get_messages_firestore(chat_id), False)
+
+def render_message_list(chat_id, live_messages, has_older):
+    win = get_message_window(chat_id)
+
+    # Messages pushed out of the live window by new arrivals move to the
+    # session's older pages so scrolled-back history has no gap.
+    if win['older'] and win.get('last_live'):
+        live_ids = {m['id'] for m in live_messages}
+        win['older'] += [m for m in win['last_live'] if m['id'] not in live_ids]
+    win['last_live'] = live_messages
+
+    # Only the visible window is materialized, so render cost does not grow
+    # with chat length.
+    loaded = win['older'] + live_messages
+    can_load_more = len(loaded) > win['size'] or (has_older and not win['exhausted'])
+    if can_load_more and st.button("⬆️ Load earlier messages", key=f"load_earlier_{chat_id}"):
+        load_earlier_messages(chat_id, win, loaded, has_older)
+        loaded = win['older'] + live_messages
+    messages = with_pending(chat_id, loaded[-win['size']:])
+    viewer_id = st.session_state.user['id']
     
     chat_container = st.container(height=500)
     with chat_container:
         if not messages:
             st.info("No messages yet. Start the conversation!")
-            
-        for msg in messages:
-            is_me = msg['sender_id'] == st.session_state.user['id']
-            is_ai = msg['is_ai']
-            
-            # Determine CSS class
-            if is_ai:
-                msg_class = "ai-message"
-                align_style = "align-items: flex-start;"
-            elif is_me:
-                msg_class = "user-message"
-                align_style = "align-items: flex-end;"
-            else:
-                msg_class = "other-message"
-                align_style = "align-items: flex-start;"
+        else:
+            # Each message's HTML comes from the shared fragment cache, so
+            # only new or changed messages are formatted on a rerun
+            for msg in messages:
+                col_msg, col_star = st.columns([0.9, 0.1])
+                with col_msg:
+                    st.markdown(get_fragment_cache().render(msg, viewer_id), unsafe_allow_html=True)
                 
-            # Timestamp formatting
-            ts = msg['timestamp']
-            if isinstance(ts, datetime.datetime):
-                ts_str = ts.strftime("%H:%M")
-            else:
-                ts_str = ""
-
-            # Custom HTML Rendering
-            import re
-            content = msg['content']
-            # Highlight @mentions (simple regex for @word)
-            content = re.sub(r'(@\w+)', r'<span class="mention">\1</span>', content)
-            
-            col_msg, col_star = st.columns([0.9, 0.1])
-            
-            with col_msg:
-                st.markdown(f"""
-                    <div style="display: flex; flex-direction: column; {align_style} width: 100%;">
-                        <div class="chat-message {msg_class}">
-                            <div class="sender-name">{msg['sender_name']}</div>
-                            <div class="message-content">{content}</div>
-                            <div class="timestamp">{ts_str}</div>
-                        </div>
-                    </div>
-                """, unsafe_allow_html=True)
-            
-            with col_star:
-                # Star Button
-                star_label = "★" if msg.get('is_important') else "☆"
-                if st.button(star_label, key=f"star_{msg['id']}", help="Mark as Important"):
-                    from firebase_db import toggle_message_importance
-                    toggle_message_importance(msg['id'], msg.get('is_important', False))
-                    st.rerun()
+                with col_star:
+                    # Star Button (not until the message exists in Firestore)
+                    if msg.get('pending') or msg.get('failed'):
+                        continue
+                    star_label = "★" if msg.get('is_important') else "☆"
+                    if st.button(star_label, key=f"star_{msg['id']}", help="Mark as Important"):
+                        from firebase_db import toggle_message_importance
+                        toggle_message_importance(msg['id'], msg.get('is_important', False))
+                        # Older pages are a session-local copy the listener does not update
+                        win['older'] = [dict(m, is_important=not m.get('is_important', False)) if m['id'] == msg['id'] else m for m in win['older']]
+                        st.rerun()
 
         # Auto-Scroll Script
         st.markdown("""
@@ -148,43 +415,116 @@ def render_chat_interface(chat_id):
     # Render Messages with Auto-Update
     render_messages_area(chat_id)
 
+    failed = get_outbox().failed(chat_id)
+    if failed:
+        col_warn, col_retry = st.columns([3, 1])
+        col_warn.warning(f"⚠️ {len(failed)} message(s) could not be sent: {failed[-1].get('last_error') or 'unknown error'}")
+        if col_retry.button("🔁 Retry", key=f"retry_failed_{chat_id}"):
+            get_outbox().retry_failed(chat_id)
+            st.rerun()
+
     # Chat Input (Outside fragment to avoid focus loss)
     # Gemini Mode Toggle
     gemini_mode = st.toggle("🤖 Ask Gemini", key="gemini_toggle", help="Enable to talk to Gemini without typing @Gemini")
+    # Repeated questions (FAQ-style Study chats) can be answered from the cache
+    use_cache = st.toggle("⚡ Reuse cached answers", value=chat.get('category') == 'Study', key=f"ai_cache_{chat_id}",
+                          help="Answer a question Gemini already answered in this chat without calling the API")
     
     if prompt := st.chat_input("Type your message..."):
-        # Save User Message
-        save_message_firestore(chat_id, st.session_state.user['id'], st.session_state.user['username'], prompt, is_ai=False)
+        # Queue User Message (flushed to Firestore in the background)
+        sent = send_message(chat_id, st.session_state.user['id'], st.session_state.user['username'], prompt, is_ai=False)
         
         # Check for @Gemini trigger OR Gemini Mode
         if "@gemini" in prompt.lower() or gemini_mode:
             # Get AI Response
-            # Determine API Key (User's personal or System Global)
-            api_key = st.session_state.user.get('personal_api_key')
-            if not api_key:
-                api_key = get_system_api_key_firestore()
+            # Determine API Key (User's personal or System Global); the
+            # system key also backs up a throttled or failing personal key
+            system_key = get_system_api_key_firestore()
+            api_key = st.session_state.user.get('personal_api_key') or system_key
                 
             if not api_key:
                 st.error("No API Key found. Please add one in settings.")
                 return
 
-            # Build History for Context (Fetch fresh to include just sent msg)
-            messages = get_messages_firestore(chat_id)
-            history = []
-            for m in messages:
-                role = "model" if m['is_ai'] else "user"
-                history.append({"role": role, "parts": [m['content']]})
-                
-            # UI Feedback for AI
-            with st.spinner("Thinking..."):
-                response_text = get_gemini_response(prompt, history, api_key)
-                # Save AI Message
-                save_message_firestore(chat_id, 0, "Gemini", response_text, is_ai=True)
-                st.rerun()
+            # Answered in the background; the reply replaces a placeholder
+            try:
+                get_ai_jobs().submit(chat_id, api_key, prompt=prompt, question_id=sent['id'], use_cache=use_cache,
+                                    fallback_key=system_key if system_key != api_key else None)
+            except QueueFull:
+                st.warning("Gemini is busy right now. Please ask again in a moment.")
+                return
+            st.rerun()
         else:
             # If not triggering Gemini, just rerun to show the user's message
             st.rerun()
 
+@st.cache_resource
+def get_pdf_exporter():
+    return PdfExporter()
+
+def render_pdf_export(user_id):
+    # Built only when asked for, and reused until the starred set changes
+    label = "🔄 Refresh PDF" if st.session_state.get('pdf_export_key') else "📄 Prepare PDF"
+    if st.button(label, key="pdf_prepare"):
+        from firebase_db import get_important_versions, iter_important_messages
+        versions = get_important_versions(user_id)
+        key = export_key(versions)
+        get_pdf_exporter().request(key, len(versions), lambda: iter_important_messages(user_id))
+        st.session_state.pdf_export_key = key
+    key = st.session_state.get('pdf_export_key')
+    if not key:
+        return
+    status, result = get_pdf_exporter().status(key)
+    if status == 'building':
+        render_pdf_progress(key)
+    elif status == 'failed':
+        st.error(f"PDF export failed: {result}")
+    elif status == 'ready':
+        with open(result, 'rb') as f:
+            st.download_button(
+                label="📥 Export PDF",
+                data=f,
+                file_name="important_questions.pdf",
+                mime="application/pdf"
+            )
+
+@st.fragment(run_every=2)
+def render_pdf_progress(key):
+    # Polls only while the build runs, then hands back to a full rerun,
+    # which renders the result outside this fragment
+    start_metrics_rerun("fragment:pdf", fragment=True)
+    if get_pdf_exporter().status(key)[0] != 'building':
+        st.rerun()
+    st.caption("⏳ Building PDF…")
+
+SEARCH_SCOPES = ["All chats", "This chat", "Private", "Study", "Fun"]
+
+def render_search():
+    # Full-text search over the local index, limited to chats this user can open
+    st.subheader("🔎 Search Messages")
+    text = st.text_input("Search", key="search_text", placeholder="Words to find", label_visibility="collapsed")
+    in_chat = st.session_state.active_chat_id not in (None, "ADMIN")
+    scopes = SEARCH_SCOPES if in_chat else [s for s in SEARCH_SCOPES if s != "This chat"]
+    scope = st.selectbox("Search in", scopes, key="search_scope")
+    if not text.strip():
+        return
+
+    from firebase_db import search_messages
+    user_id = st.session_state.user['id']
+    results = search_messages(
+        user_id, text,
+        chat_id=st.session_state.active_chat_id if scope == "This chat" else None,
+        category=scope if scope in ("Private", "Study", "Fun") else None,
+        chats=load_sidebar_data(user_id)['chats'])
+    if not results:
+        st.caption("No matching messages.")
+    for r in results:
+        ts = r['timestamp'].strftime("%Y-%m-%d %H:%M") if r['timestamp'] else ""
+        st.markdown(f"**{r['chat_title']}** · {r['sender_name']} · {ts}  \n{r['snippet']}")
+        if r['chat_id'] != st.session_state.active_chat_id and st.button("Open chat", key=f"search_open_{r['msg_id']}"):
+            st.session_state.active_chat_id = r['chat_id']
+            st.rerun()
+
 def render_right_panel():
     st.subheader("🔧 Settings & Info")
     
@@ -209,15 +549,12 @@ def render_right_panel():
             # Check if current user is the creator
             is_creator = chat.get('user_id') == st.session_state.user['id']
             
-            # Show current participants
-            from firebase_db import get_chat_participants, add_participant_to_chat, remove_participant_from_chat
-            participants = get_chat_participants(st.session_state.active_chat_id)
+            # Resolve creator and participants in one batched lookup
+            from firebase_db import get_chat_members, add_participant_to_chat, remove_participant_from_chat
+            creator, participants = get_chat_members(chat)
             
             # Show creator
-            db = get_db()
-            creator_doc = db.collection('users').document(chat.get('user_id')).get()
-            if creator_doc.exists:
-                creator = creator_doc.to_dict()
+            if creator:
                 st.caption(f"👑 Creator: **{creator.get('username')}**")
             
             # Show participants
@@ -234,10 +571,11 @@ def render_right_panel():
             # Add participant (only creator can do this)
             if is_creator:
                 st.caption("**Add Member:**")
-                all_users = get_all_users()
-                # Filter out users already in chat
+                # Typeahead over the shared user directory, excluding users already in chat
+                search = st.text_input("Search users", key="add_participant_search", placeholder="Start typing a username")
                 participant_ids = [p['id'] for p in participants]
-                available_users = [u for u in all_users if u['id'] not in participant_ids and u['id'] != chat.get('user_id')]
+                available_users = get_user_directory().search(
+                    search, limit=USER_PICKER_LIMIT, exclude=participant_ids + [chat.get('user_id')])
                 
                 if available_users:
                     user_options = {u['username']: u['id'] for u in available_users}
@@ -249,65 +587,78 @@ def render_right_panel():
                         st.success(f"Added {selected_username}!")
                         st.rerun()
                 else:
-                    st.caption("No more users to add")
+                    st.caption("No matching users to add")
             
             st.divider()
     
-    st.subheader("⭐ Important Questions")
-    # Fetch important messages for the current user (from all chats they are in)
-    # For simplicity, we fetch all important messages and filter if needed, 
-    # but here we just show what get_important_messages returns.
-    important_msgs = get_important_messages(st.session_state.user['id'])
+    render_search()
+    st.divider()
+    
+    # Important messages from chats the current user can access, read a page
+    # at a time from the per-user scoped index
+    important = load_important_panel(st.session_state.user['id'])
+    st.subheader(f"⭐ Important Questions ({important['count']})")
     
-    if important_msgs:
-        for msg in important_msgs:
+    if important['messages']:
+        for msg in important['messages']:
             st.info(f"{msg['sender_name']}: {msg['content'][:50]}...")
+        if important['cursor'] is not None and len(important['messages']) < important['count']:
+            if st.button("Show more", key="important_more"):
+                load_more_important(st.session_state.user['id'])
+                st.rerun()
         
-        # PDF Export
-        from fpdf import FPDF
-        
-        def create_pdf(messages):
-            pdf = FPDF()
-            pdf.add_page()
-            pdf.set_font("Arial", size=12)
-            pdf.cell(200, 10, txt="Important Questions", ln=1, align='C')
-            pdf.ln(10)
-            
-            for m in messages:
-                ts = m['timestamp']
-                if isinstance(ts, datetime.datetime):
-                    ts_str = ts.strftime("%Y-%m-%d %H:%M:%S")
-                else:
-                    ts_str = str(ts)
-                
-                # Handle unicode characters roughly (FPDF doesn't support full unicode by default without font setup)
-                # We'll replace non-latin characters to avoid errors or use a compatible font if available.
-                # For this basic implementation, we'll encode/decode to latin-1 and replace errors.
-                content = m['content'].encode('latin-1', 'replace').decode('latin-1')
-                sender = m['sender_name'].encode('latin-1', 'replace').decode('latin-1')
-                
-                pdf.set_font("Arial", 'B', 10)
-                pdf.cell(0, 10, txt=f"[{ts_str}] {sender}:", ln=1)
-                pdf.set_font("Arial", '', 10)
-                pdf.multi_cell(0, 10, txt=content)
-                pdf.ln(5)
-                
-            return pdf.output(dest='S').encode('latin-1')
-
-        pdf_bytes = create_pdf(important_msgs)
-        
-        st.download_button(
-            label="📥 Export PDF",
-            data=pdf_bytes,
-            file_name="important_questions.pdf",
-            mime="application/pdf"
-        )
+        render_pdf_export(st.session_state.user['id'])
     else:
         st.caption("No important messages marked yet.")
             
     st.divider()
     st.caption("Gemini Group Chat v1.0 (Firebase)")
 
+def delete_chats_with_progress(chat_ids):
+    # Runs the batched deletion engine with a progress bar over all messages
+    from firebase_db import delete_chat_firestore, count_chat_messages
+    total = sum(count_chat_messages(cid) for cid in chat_ids)
+    bar = st.progress(0.0, text=f"Deleting {total} messages...")
+    done = 0
+
+    def on_progress(n):
+        nonlocal done
+        done += n
+        bar.progress(min(done / max(total, 1), 1.0), text=f"Deleted {done} of {total} messages")
+
+    for cid in chat_ids:
+        delete_chat_firestore(cid, progress=on_progress)
+    bar.empty()
+
+def render_firestore_usage():
+    # Where this server process spends its Firestore reads (see firestore_metrics.py)
+    st.divider()
+    st.subheader("📊 Firestore Usage")
+    snapshot = firestore_metrics.snapshot()
+    total_reads = sum(f['reads'] for f in snapshot['functions'].values())
+    total_writes = sum(f['writes'] for f in snapshot['functions'].values())
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Reads / min (5 min)", f"{firestore_metrics.reads_per_minute():.0f}")
+    col2.metric("Reads since start", total_reads)
+    col3.metric("Writes since start", total_writes)
+
+    st.caption("Top functions by reads")
+    st.dataframe([
+        {'function': f['function'], 'reads': f['reads'], 'writes': f['writes'], 'ops': f['ops'],
+         'avg ms': round(f['ms'] / f['ops'], 1) if f['ops'] else 0.0}
+        for f in firestore_metrics.top_functions()
+    ], hide_index=True)
+
+    st.caption("Most expensive recent reruns")
+    st.dataframe([
+        {'screen': r['label'], 'session': r['session_id'][:8], 'reads': r['reads'], 'writes': r['writes'],
+         'ms': r['ms'], 'top function': max(r['functions'], key=r['functions'].get) if r['functions'] else ""}
+        for r in firestore_metrics.top_reruns()
+    ], hide_index=True)
+
+    st.download_button("⬇️ Export metrics (JSON)", firestore_metrics.export_json(),
+                       file_name="firestore_metrics.json", mime="application/json")
+
 def render_admin_panel():
     st.title("⚙️ Admin Panel")
     
@@ -318,12 +669,25 @@ def render_admin_panel():
         set_system_api_key_firestore(new_global)
         st.success("Global Key Updated!")
 
+    stats = get_response_cache().stats()
+    st.caption(f"⚡ AI answer cache: {stats['entries']} in memory · "
+               f"{stats['hits'] + stats['disk_hits']} hits / {stats['misses']} misses "
+               f"({stats['hit_rate']:.0%})")
+    jobs = get_ai_jobs().stats()
+    st.caption(f"🤖 AI queue: {jobs['queued']} queued · {jobs['running']} running · "
+               f"{jobs['completed']} done · {jobs['failed']} failed · {jobs['rejected']} turned away")
+    unhealthy = [k for k in key_health() if k['state'] != 'closed']
+    if unhealthy:
+        st.caption("🔌 Gemini keys paused: " + ", ".join(f"{k['key']} ({k['state']})" for k in unhealthy))
+
+    render_firestore_usage()
+
     st.divider()
     st.subheader("User Management")
-    users = get_all_users()
+    users = get_user_directory().all()
     
     for u in users:
-        col1, col2, col3 = st.columns([3, 1, 1])
+        col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
         col1.write(f"**{u['username']}** ({u['role']})")
         if u['role'] != 'admin':
             if col2.button("Make Admin", key=f"make_admin_{u['id']}"):
@@ -333,15 +697,25 @@ def render_admin_panel():
                 from firebase_db import delete_user_firestore
                 delete_user_firestore(u['id'])
                 st.rerun()
+            if col4.button("🧹 Delete Chats", key=f"del_user_chats_{u['id']}", help="Delete every chat this user created"):
+                from firebase_db import get_user_chat_ids
+                delete_chats_with_progress(get_user_chat_ids(u['id']))
+                st.rerun()
                 
     st.divider()
     st.subheader("Chat Management")
-    from firebase_db import get_all_chats, delete_chat_firestore
+    from firebase_db import get_all_chats
     chats = get_all_chats()
     
     for c in chats:
         col1, col2 = st.columns([4, 1])
-        col1.write(f"**{c.get('title', 'Untitled')}** ({c.get('category', 'Unknown')})")
-        if col2.button("🗑️ Delete", key=f"del_chat_{c['id']}"):
-            delete_chat_firestore(c['id'])
+        col1.write(f"**{c.get('title', 'Untitled')}** ({c.get('category', 'Unknown')}) · {c.get('message_count', 0)} messages, {c.get('important_count', 0)} ⭐")
+        if c.get('deleting'):
+            # A previous deletion was interrupted; running it again picks up the rest
+            col1.caption("⏳ Deletion incomplete")
+            label = "▶️ Resume"
+        else:
+            label = "🗑️ Delete"
+        if col2.button(label, key=f"del_chat_{c['id']}"):
+            delete_chats_with_progress([c['id']])
             st.rerun()
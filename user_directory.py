@@ -0,0 +1,77 @@
+import bisect
+import threading
+
+# Process-wide directory of users (id, username, role only — never password
+# hashes or API keys). Usernames are kept in a list sorted by lowercase name,
+# so prefix search is a binary search plus at most `limit` steps regardless of
+# how many users exist. firebase_db loads it and keeps it current from the
+# create/delete/role-change paths.
+
+
+class UserDirectory:
+    def __init__(self):
+        self._by_id = {}  # user id -> {'id', 'username', 'role'}
+        self._by_name = {}  # username -> user id
+        self._keys = []  # sorted (username.lower(), user id)
+        self._lock = threading.RLock()
+        self.loaded_at = None
+
+    def load(self, users, loaded_at):
+        with self._lock:
+            self._by_id = {}
+            self._by_name = {}
+            for u in users:
+                self._by_id[u['id']] = {'id': u['id'], 'username': u['username'], 'role': u.get('role', 'user')}
+                self._by_name[u['username']] = u['id']
+            self._keys = sorted((u['username'].lower(), uid) for uid, u in self._by_id.items())
+            self.loaded_at = loaded_at
+
+    def upsert(self, user_id, username, role='user'):
+        with self._lock:
+            self.remove(user_id)
+            self._by_id[user_id] = {'id': user_id, 'username': username, 'role': role}
+            self._by_name[username] = user_id
+            bisect.insort(self._keys, (username.lower(), user_id))
+
+    def remove(self, user_id):
+        with self._lock:
+            user = self._by_id.pop(user_id, None)
+            if user is None:
+                return
+            self._by_name.pop(user['username'], None)
+            key = (user['username'].lower(), user_id)
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+
+    def set_role(self, user_id, role):
+        with self._lock:
+            if user_id in self._by_id:
+                self._by_id[user_id] = dict(self._by_id[user_id], role=role)
+
+    def get_id(self, username):
+        with self._lock:
+            return self._by_name.get(username)
+
+    def all(self):
+        with self._lock:
+            return [self._by_id[uid] for _, uid in self._keys]
+
+    def search(self, prefix, limit=10, exclude=()):
+        # Case-insensitive prefix match, alphabetical, at most `limit` results
+        prefix = prefix.strip().lower()
+        exclude = set(exclude)
+        results = []
+        with self._lock:
+            i = bisect.bisect_left(self._keys, (prefix, ''))
+            while i < len(self._keys) and len(results) < limit:
+                name, uid = self._keys[i]
+                if not name.startswith(prefix):
+                    break
+                if uid not in exclude:
+                    results.append(self._by_id[uid])
+                i += 1
+        return results
+
+    def __len__(self):
+        return len(self._by_id)
@@ -1,15 +1,20 @@
-from database import init_db, get_db_connection
-from auth import create_user, login_user
 import os
+import tempfile
+
+# Runs against a throwaway SQLite store, so no Firebase project is needed
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["STORAGE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "verify_app.db")
+
+from storage import get_backend
+from auth import create_user, login_user
 
 def test_app_logic():
-    print("Testing Database and Auth Logic...")
+    print("Testing Storage Backend and Auth Logic...")
     
     # 1. Init DB
-    if os.path.exists("chat_app.db"):
-        os.remove("chat_app.db")
-    init_db()
-    print("✅ Database Initialized")
+    backend = get_backend()
+    assert backend.check_connection() == (True, None)
+    print(f"✅ Database Initialized ({backend.name}: {os.environ['STORAGE_DB_PATH']})")
 
     # 2. Create User
     assert create_user("testuser", "password123") == True
@@ -30,25 +35,52 @@ def test_app_logic():
     print("✅ Invalid Login Handled")
 
     # 6. Create Chat
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO chats (user_id, category, title) VALUES (?, ?, ?)", (user['id'], 'Study', 'Math Help'))
-    chat_id = c.lastrowid
-    conn.commit()
+    chat_id = backend.create_chat(user['id'], 'Study', 'Math Help')
+    assert [c['id'] for c in backend.get_chats_by_category(user['id'], 'Study')] == [chat_id]
     print(f"✅ Chat Created (ID: {chat_id})")
 
     # 7. Save Message
-    c.execute("INSERT INTO messages (chat_id, sender_id, sender_name, content) VALUES (?, ?, ?, ?)", 
-              (chat_id, user['id'], user['username'], "Hello World"))
-    conn.commit()
+    create_user("friend", "password123")
+    friend = backend.get_user_by_username("friend")
+    msg_id = backend.save_message(chat_id, user['id'], user['username'], "Hello World @friend")
     print("✅ Message Saved")
 
     # 8. Verify Message
-    msg = c.execute("SELECT * FROM messages WHERE chat_id = ?", (chat_id,)).fetchone()
-    assert msg['content'] == "Hello World"
+    msgs = backend.get_messages(chat_id)
+    assert [m['content'] for m in msgs] == ["Hello World @friend"]
+    assert backend.get_chat(chat_id)['message_count'] == 1
     print("✅ Message Retrieved")
+
+    # 9. Mentions
+    assert backend.get_unread_mentions(friend['id']) == [chat_id]
+    backend.remove_unread_mention(friend['id'], chat_id)
+    assert backend.get_unread_mentions(friend['id']) == []
+    print("✅ Mentions Tracked")
+
+    # 10. Important Messages
+    backend.toggle_message_importance(msg_id, False)
+    assert backend.count_important_messages(friend['id']) == 1
+    assert backend.get_chat(chat_id)['important_count'] == 1
+    print("✅ Important Message Marked")
+
+    # 11. Private Chat Access
+    private_id = backend.create_chat(user['id'], 'Private', 'Secret')
+    assert backend.get_chats_by_category(friend['id'], 'Private') == []
+    backend.add_participant(private_id, friend['id'])
+    assert backend.get_chat(private_id)['participants'] == [friend['id']]
+    assert [c['id'] for c in backend.get_chats_by_category(friend['id'], 'Private')] == [private_id]
+    print("✅ Private Chat Membership Enforced")
+
+    # 12. Settings
+    backend.set_system_api_key("test-key")
+    assert backend.get_system_api_key() == "test-key"
+    print("✅ Settings Stored")
+
+    # 13. Delete Chat
+    assert backend.delete_chat(chat_id) == 1
+    assert backend.get_chat(chat_id) is None
+    print("✅ Chat Deleted")
     
-    conn.close()
     print("\nALL TESTS PASSED!")
 
 if __name__ == "__main__":